@@ -1,21 +1,88 @@
 from threading import Timer
 
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, render_template, jsonify, request, send_file, Response, g
 from application.ga_adapter import get_profiles
 from utils.upload_utils import validate_upload_file
 from flask import send_from_directory
 from application import file_manager
 from application import model_builder
+from application.build_jobs import BuildJobManager, COMPLETED, BUILD_WORKERS
+from application.model_registry import ModelRegistry
+from application.scoring_service import ScoringService
+from application.stage_cache import StageCache
+from application import instrumentation
+from application import profiling
+from application import lazy_imports
 import webbrowser
+import concurrent.futures
 import os
 import json
+import tempfile
+import time
 
 
 GA_CRED_PATH = 'google_analytics_cred.json'
 DATA_TEMPLATE_PATH = 'data_template.csv'
+BUILD_JOBS_PATH = 'build_jobs'
+MODELS_PATH = 'models'
+STAGE_CACHE_PATH = 'stage_cache'
+PROFILES_PATH = 'profiles'
+PROFILE_HEADER = 'X-Profile'
 
 app = Flask(__name__)
 
+# Profile every build with "cprofile" or "sampling" without a header, eg. LAMS_PROFILE_BUILDS=sampling
+app.config['PROFILE_BUILDS'] = os.environ.get('LAMS_PROFILE_BUILDS') or None
+
+# Build with float32 numbers, categories and uint8 one hot columns to use less memory, eg. LAMS_COMPACT_BUILDS=1
+app.config['COMPACT_BUILDS'] = os.environ.get('LAMS_COMPACT_BUILDS', '0') == '1'
+
+# Load the heavy dependencies in the background once the server is listening, eg. LAMS_WARM_UP=1
+app.config['WARM_UP'] = os.environ.get('LAMS_WARM_UP', '0') == '1'
+
+# Background workers that run every model build, both jobs and builds that wait for the result.
+# Each server process runs at most this many builds at once, eg. LAMS_BUILD_WORKERS=1
+build_jobs = BuildJobManager(BUILD_JOBS_PATH, int(os.environ.get('LAMS_BUILD_WORKERS', BUILD_WORKERS)))
+
+# The saved models of every build
+model_registry = ModelRegistry(MODELS_PATH)
+
+# The output of each build stage so building again on the same file only reruns the changed stages
+stage_cache = StageCache(STAGE_CACHE_PATH)
+
+# Scores single customers with the saved models kept in memory
+scoring_service = ScoringService(model_registry)
+
+# Measure every request for the metrics route
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    if 'request_start' in g:
+        labels = {'route': request.url_rule.rule if request.url_rule is not None else 'unmatched',
+                  'method': request.method, 'status': response.status_code}
+        instrumentation.metrics.add('http_request_seconds_total', 'HTTP request wall time', 'counter', labels,
+                                    time.perf_counter() - g.request_start)
+        instrumentation.metrics.add('http_requests_total', 'HTTP request count', 'counter', labels, 1)
+    return response
+
+
+# A route for Prometheus to collect the build stage and request measurements, of every worker when the workers
+# share LAMS_METRICS_DIR (gunicorn.conf.py sets it)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(instrumentation.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# A route to report how long each heavy dependency took to import and what caused the import
+@app.route('/api/v1/imports', methods=['GET'])
+def api_imports():
+    return jsonify({'success': True, 'data': lazy_imports.import_report()})
+
+
 # A route to add the program icon
 @app.route('/favicon.ico')
 def favicon():
@@ -122,8 +189,36 @@ def api_model_build():
     # Get a dataframe of the contacts as a Pandas Dataframe ranked by the probability
     # of completing application.
     # This is the main guts of application, parses data, builds model and makes predictions
+    # The report records how the model was built eg. which clustering mode was used
+    report = {}
+
+    # Profile the build if asked to by the X-Profile header or the server setting
+    profile_mode = request.headers.get(PROFILE_HEADER) or app.config['PROFILE_BUILDS']
+    if profile_mode is not None and profile_mode not in profiling.PROFILE_MODES:
+        return jsonify({'success': False, 'error': 'The profile mode must be one of {}'
+                       .format(', '.join(profiling.PROFILE_MODES))})
+
+    # Profiled on the build worker since cProfile only sees the thread it is started on
+    path = request.path
+
+    compact = app.config['COMPACT_BUILDS']
+
+    def build():
+        if profile_mode is None:
+            return model_builder.build_and_predict(file, DATA_TEMPLATE_PATH, fields, ga_profile_id, GA_CRED_PATH,
+                                                   report=report, registry=model_registry, cache=stage_cache,
+                                                   compact=compact)
+
+        with profiling.profile(profile_mode, path, PROFILES_PATH) as profile:
+            result = model_builder.build_and_predict(file, DATA_TEMPLATE_PATH, fields, ga_profile_id,
+                                                     GA_CRED_PATH, report=report, registry=model_registry,
+                                                     cache=stage_cache, compact=compact)
+        report['profile'] = profile
+        return result
+
+    # Run on the build workers so the request threads stay free for the other routes
     try:
-        contacts = model_builder.build_and_predict(file, DATA_TEMPLATE_PATH, fields, ga_profile_id, GA_CRED_PATH)
+        contacts = build_jobs.run_now(build)
     except ValueError as err:
         return jsonify({'success': False, 'error': str(err)})
 
@@ -133,6 +228,7 @@ def api_model_build():
     # Convert back to a json object and add success = true
     json_data = {
         'data': json.loads(json_str),
+        'report': report,
         'success': True
     }
 
@@ -140,6 +236,179 @@ def api_model_build():
     return jsonify(json_data)
 
 
+# The route to score new customers with a saved model without rebuilding it. The probabilities are
+# streamed back a chunk of rows at a time so large files don't have to be held in memory.
+@app.route('/api/v1/model/score', methods=['POST'])
+def api_model_score():
+
+    # Validate the file is acceptable
+    file, error = validate_upload_file(request.files, extensions=["csv"])
+    if file is None:
+        return jsonify({'success': False, 'error': error})
+
+    # Use the pinned or latest model if no version is given
+    version = request.form.get("model_version") or None
+
+    # The upload is closed when the request ends so keep a copy to stream from
+    upload = tempfile.TemporaryFile()
+    file.save(upload)
+    upload.seek(0)
+
+    # Score the first chunk before streaming so an unusable file or model gets a normal error response
+    try:
+        bundle = model_registry.load(version)
+        chunks = model_builder.score(upload, bundle)
+        chunk = next(chunks, None)
+    except ValueError as err:
+        upload.close()
+        return jsonify({'success': False, 'error': str(err)})
+
+    def generate(chunk):
+        yield '{{"model_version": {}, "data": ['.format(json.dumps(bundle["version"]))
+
+        separator = ''
+        try:
+            while chunk is not None:
+                # The records of the chunk without the enclosing brackets
+                records = chunk.to_json(orient="records")[1:-1]
+                if records != '':
+                    yield separator + records
+                    separator = ','
+                chunk = next(chunks, None)
+        except ValueError as err:
+            # Too late to change the response so report the error at the end of the data
+            yield '], "success": false, "error": {}}}'.format(json.dumps(str(err)))
+            return
+        finally:
+            upload.close()
+
+        yield '], "success": true}'
+
+    return Response(generate(chunk), mimetype='application/json')
+
+
+# The route to score a single customer sent as json with a saved model, eg. as soon as an application
+# is abandoned. The model stays loaded in memory and customers scored at the same time share a batch.
+@app.route('/api/v1/model/score_record', methods=['POST'])
+def api_model_score_record():
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or 'record' not in body:
+        return jsonify({'success': False, 'error': 'The request must be json with a record'})
+
+    try:
+        prob, version = scoring_service.score(body['record'], body.get('model_version'))
+    except ValueError as err:
+        return jsonify({'success': False, 'error': str(err)})
+    except concurrent.futures.TimeoutError:
+        return jsonify({'success': False, 'error': 'The record was not scored in time, please try again'})
+
+    return jsonify({'success': True, 'prob': prob, 'model_version': version})
+
+
+# A route to submit a model build as a background job. Returns the job id straight away
+# which can be used to check progress, cancel the build and get the result.
+@app.route('/api/v1/model/build_jobs', methods=['POST'])
+def api_model_build_job_submit():
+
+    # Validate the file is acceptable
+    file, error = validate_upload_file(request.files, extensions=["csv"])
+    if file is None:
+        return jsonify({'success': False, 'error': error})
+
+    # Get the Google Analytics profile id and the fields the same as a normal build
+    ga_profile_id = request.form.get("connect_ga")
+    fields = json.loads(request.form.get("fields"))
+
+    job_id = build_jobs.submit(file, DATA_TEMPLATE_PATH, fields, ga_profile_id, GA_CRED_PATH,
+                               registry=model_registry, cache=stage_cache, compact=app.config['COMPACT_BUILDS'])
+
+    return jsonify({'success': True, 'job_id': job_id})
+
+
+# A route to get the state and per stage progress of a build job
+@app.route('/api/v1/model/build_jobs/<job_id>', methods=['GET'])
+def api_model_build_job_status(job_id):
+
+    status = build_jobs.status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'No build job with id {}'.format(job_id)})
+
+    return jsonify({'success': True, 'job': status})
+
+
+# A route to cancel a queued or running build job
+@app.route('/api/v1/model/build_jobs/<job_id>/cancel', methods=['POST'])
+def api_model_build_job_cancel(job_id):
+
+    if build_jobs.cancel(job_id):
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'The build job doesn\'t exist or has already finished'})
+
+
+# A route to get the ranked list of customers from a completed build job
+@app.route('/api/v1/model/build_jobs/<job_id>/result', methods=['GET'])
+def api_model_build_job_result(job_id):
+
+    status = build_jobs.status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'No build job with id {}'.format(job_id)})
+
+    if status['state'] != COMPLETED:
+        return jsonify({'success': False, 'state': status['state'],
+                        'error': status['error'] or 'The build job is {}'.format(status['state'])})
+
+    result = build_jobs.result(job_id)
+    result['success'] = True
+    return jsonify(result)
+
+
+# A route to list the saved models
+@app.route('/api/v1/models', methods=['GET'])
+def api_models():
+    return jsonify({'success': True, 'data': model_registry.list(), 'pinned': model_registry.pinned()})
+
+
+# A route to pin a saved model so it is used when no model version is given
+@app.route('/api/v1/models/<version>/pin', methods=['POST'])
+def api_model_pin(version):
+    try:
+        model_registry.pin(version)
+    except ValueError as err:
+        return jsonify({'success': False, 'error': str(err)})
+
+    return jsonify({'success': True})
+
+
+# A route to unpin the pinned model so the latest model is used
+@app.route('/api/v1/models/unpin', methods=['POST'])
+def api_model_unpin():
+    model_registry.unpin()
+    return jsonify({'success': True})
+
+
+# A route to list the saved build profiles
+@app.route('/api/v1/profiles', methods=['GET'])
+def api_profiles():
+    return jsonify({'success': True, 'data': profiling.list_profiles(PROFILES_PATH)})
+
+
+# A route to download a saved build profile. The summary is text, the raw profile is a cProfile .prof
+# file for pstats or snakeviz or the collapsed stacks of a sampling profile for flame graph tools.
+@app.route('/api/v1/profiles/<profile_id>', methods=['GET'])
+def api_profile(profile_id):
+    kind = request.args.get('format', 'summary')
+    path = profiling.profile_file(profile_id, kind, PROFILES_PATH)
+    if path is None:
+        return jsonify({'success': False, 'error': 'No profile with id {}'.format(profile_id)})
+
+    directory, filename = os.path.split(os.path.abspath(path))
+    if kind == 'summary':
+        return send_from_directory(directory, filename, mimetype='text/plain')
+    return send_from_directory(directory, filename, as_attachment=True)
+
+
 # A route to export the data to an excel file
 @app.route('/api/v1/model/export_to_excel', methods=['POST'])
 def export_to_excel():
@@ -178,6 +447,8 @@ if __name__ == '__main__':
     # Start a timer that will load the webbrowser in a new thread after flask app has
     # started
     Timer(1, open_browser).start()
+    if app.config['WARM_UP']:
+        lazy_imports.warm_up(delay=lazy_imports.WARM_UP_DELAY_SECONDS)
     app.run()
 
 
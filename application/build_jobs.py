@@ -0,0 +1,463 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from contextlib import contextmanager
+import psutil
+from application import model_builder
+
+# Locks the status file of a job between processes, not available on Windows where the app is one process
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+JOBS_DIR = 'build_jobs'  # Directory the uploads, status and results of build jobs are stored in
+BUILD_WORKERS = 2  # Number of builds that can run at the same time
+JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60  # Finished jobs older than this are removed
+
+# The states a job moves through
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = [COMPLETED, FAILED, CANCELLED]
+
+# The error of a job whose process stopped before it finished
+ABANDONED_ERROR = "The server process running the build stopped before it finished"
+
+
+class BuildJobManager:
+    """ Runs build_and_predict jobs on a background pool of workers. Everything about a job is kept in its own
+    directory so the status, result and cancellation of a job can be seen by any process sharing the directory.
+    Builds that wait for their result run on the same pool, so the CPU heavy work of a process is limited to
+    max_workers builds and the request threads stay free for the other routes.
+
+    Each job records the process that owns it, so a job left queued or running by a process that was killed or
+    restarted is reported as failed rather than running forever.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, max_workers=BUILD_WORKERS):
+        """Creates the worker pool
+
+            Args:
+                jobs_dir (string): Directory to keep the jobs in
+                max_workers (int): The number of builds that can run at the same time
+            """
+        self.jobs_dir = jobs_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # Cancel events of the jobs running in this process
+        self.cancel_events = {}
+        self.lock = threading.Lock()
+
+        # Status changes read then write the status file so they are made one at a time, the status file is
+        # also locked so they are made one at a time with other processes
+        self.status_lock = threading.RLock()
+        self.status_depths = {}
+
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+        # Jobs of a server that was stopped will never finish
+        self.fail_abandoned()
+
+    def submit(self, file, data_template_path, fields, ga_profile_id, ga_cred_file_location=None, **build_options):
+        """Saves the uploaded file and queues a build
+
+            Args:
+                file (file): The uploaded csv file object
+                data_template_path (string): filepath for the data template csv
+                fields (list): The list of fields names and data types
+                ga_profile_id (string): The Google Analytics profile id to use or '0' for none
+                ga_cred_file_location (string): storage location of the google analytics credentials file
+                build_options: Any other keyword arguments for build_and_predict
+
+            Returns:
+                (string): the job id
+            """
+        self.remove_expired()
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_path(job_id))
+
+        # The upload stream closes with the request so keep a copy for the worker
+        upload_path = self.job_path(job_id, "upload.csv")
+        file.save(upload_path)
+
+        now = time.time()
+        self.write_status(job_id, {
+            "job_id": job_id,
+            "state": QUEUED,
+            "stage": None,
+            "stages": [{"name": stage, "started": None, "finished": None} for stage in model_builder.BUILD_STAGES],
+            "progress": 0.0,
+            "error": None,
+            "submitted": now,
+            "started": None,
+            "finished": None,
+            "owner": process_identity()
+        })
+
+        with self.lock:
+            self.cancel_events[job_id] = JobCancelEvent(self.job_path(job_id, "cancel"))
+
+        self.executor.submit(self.run, job_id, upload_path, data_template_path, fields, ga_profile_id,
+                             ga_cred_file_location, build_options)
+
+        return job_id
+
+    def run_now(self, function, *args, **kwargs):
+        """Runs a build on the worker pool and waits for it to finish
+
+            Args:
+                function (function): The build eg. model_builder.build_and_predict
+                args: The positional arguments of the function
+                kwargs: The keyword arguments of the function
+
+            Returns:
+                (object): what the function returned, or raises what the function raised
+            """
+        return self.executor.submit(function, *args, **kwargs).result()
+
+    def run(self, job_id, upload_path, data_template_path, fields, ga_profile_id, ga_cred_file_location,
+            build_options):
+        """Runs a build job in a worker, recording each stage as it starts
+
+            Args:
+                job_id (string): The job id
+                upload_path (string): The saved csv file
+                data_template_path (string): filepath for the data template csv
+                fields (list): The list of fields names and data types
+                ga_profile_id (string): The Google Analytics profile id to use or '0' for none
+                ga_cred_file_location (string): storage location of the google analytics credentials file
+                build_options (dict): Any other keyword arguments for build_and_predict
+            """
+        cancel_event = self.cancel_events.get(job_id)
+
+        try:
+            # Cancelled while still in the queue, checked with the status locked so a cancel from another
+            # process either sees the job running or stops it here
+            with self.locked_status(job_id):
+                if self.is_cancelled(job_id):
+                    raise CancelledError()
+                self.update_status(job_id, state=RUNNING, started=time.time())
+
+            def progress(stage):
+                self.record_stage(job_id, stage)
+                if self.is_cancelled(job_id):
+                    raise CancelledError()
+
+            report = {}
+            with open(upload_path, "rb") as file:
+                contacts = model_builder.build_and_predict(file, data_template_path, fields, ga_profile_id,
+                                                           ga_cred_file_location, report=report, progress=progress,
+                                                           cancel_event=cancel_event, **build_options)
+
+            # Store the ranked result in the same format as the build api
+            result = {"data": json.loads(contacts.to_json(orient="records")), "report": report}
+            self.write_json(job_id, "result.json", result)
+
+            self.record_stage(job_id, None)
+            self.update_status(job_id, state=COMPLETED, progress=1.0, finished=time.time())
+
+        except CancelledError:
+            self.record_stage(job_id, None)
+            self.update_status(job_id, state=CANCELLED, finished=time.time())
+
+        except ValueError as err:
+            self.record_stage(job_id, None)
+            self.update_status(job_id, state=FAILED, error=str(err), finished=time.time())
+
+        except Exception as err:
+            self.record_stage(job_id, None)
+            self.update_status(job_id, state=FAILED, error="Unexpected error: {}".format(err),
+                               finished=time.time())
+            traceback.print_exc()
+
+        finally:
+            with self.lock:
+                self.cancel_events.pop(job_id, None)
+
+            # The upload is no longer needed
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+
+    def status(self, job_id):
+        """Gets the status of a job
+
+            Args:
+                job_id (string): The job id
+
+            Returns:
+                (dict): the job status or None if there is no such job
+            """
+        status = self.read_json(job_id, "status.json")
+        if status is not None and status["state"] not in FINISHED_STATES and not is_alive(status.get("owner")):
+            self.update_status(job_id, state=FAILED, stage=None, error=ABANDONED_ERROR, finished=time.time())
+            status = self.read_json(job_id, "status.json")
+        return status
+
+    def fail_abandoned(self):
+        """Marks the queued and running jobs of processes that have stopped as failed"""
+        for job_id in os.listdir(self.jobs_dir):
+            if is_valid_job_id(job_id):
+                self.status(job_id)
+
+    def result(self, job_id):
+        """Gets the ranked customers and report of a completed job
+
+            Args:
+                job_id (string): The job id
+
+            Returns:
+                (dict): the result or None if the job hasn't completed
+            """
+        return self.read_json(job_id, "result.json")
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job in any process sharing the jobs directory. A running job stops at the
+        start of its next stage or the next check in the prediction model search.
+
+            Args:
+                job_id (string): The job id
+
+            Returns:
+                (bool): True if the job was found and not already finished
+            """
+        status = self.status(job_id)
+        if status is None or status["state"] in FINISHED_STATES:
+            return False
+
+        # The marker file lets a job running in another process see the cancellation
+        open(self.job_path(job_id, "cancel"), "w").close()
+
+        # A job still in the queue can be marked as cancelled straight away
+        with self.locked_status(job_id):
+            if self.read_json(job_id, "status.json")["state"] == QUEUED:
+                self.update_status(job_id, state=CANCELLED, finished=time.time())
+
+        with self.lock:
+            event = self.cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+
+        return True
+
+    def is_cancelled(self, job_id):
+        """Checks if a job has been cancelled
+
+            Args:
+                job_id (string): The job id
+
+            Returns:
+                (bool): True if cancelled
+            """
+        return os.path.exists(self.job_path(job_id, "cancel"))
+
+    def record_stage(self, job_id, stage):
+        """Marks the current stage as finished and the given stage as started
+
+            Args:
+                job_id (string): The job id
+                stage (string): The stage that is starting or None if the build has ended
+            """
+        with self.locked_status(job_id):
+            status = self.read_json(job_id, "status.json")
+            now = time.time()
+
+            for entry in status["stages"]:
+                if entry["name"] == status["stage"] and entry["finished"] is None:
+                    entry["finished"] = now
+                if entry["name"] == stage:
+                    entry["started"] = now
+
+            finished = len([entry for entry in status["stages"] if entry["finished"] is not None])
+            status["stage"] = stage
+            status["progress"] = finished / len(status["stages"])
+            self.write_status(job_id, status)
+
+    def update_status(self, job_id, **values):
+        """Updates values in the status of a job
+
+            Args:
+                job_id (string): The job id
+                values: The status values to change
+            """
+        with self.locked_status(job_id):
+            status = self.read_json(job_id, "status.json")
+            status.update(values)
+            self.write_status(job_id, status)
+
+    @contextmanager
+    def locked_status(self, job_id):
+        """Makes the status changes inside the with block one at a time across threads and processes
+
+            Args:
+                job_id (string): The job id
+            """
+        with self.status_lock:
+            # Only the outermost block of each job locks the file, another lock of the same file would wait
+            depth = self.status_depths.get(job_id, 0)
+            self.status_depths[job_id] = depth + 1
+            try:
+                if fcntl is None or depth > 0:
+                    yield
+                else:
+                    with open(self.job_path(job_id, "status.lock"), "a") as lock_file:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                        try:
+                            yield
+                        finally:
+                            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                if depth == 0:
+                    del self.status_depths[job_id]
+                else:
+                    self.status_depths[job_id] = depth
+
+    def write_status(self, job_id, status):
+        """Writes the status of a job
+
+            Args:
+                job_id (string): The job id
+                status (dict): The job status
+            """
+        self.write_json(job_id, "status.json", status)
+
+    def job_path(self, job_id, filename=None):
+        """Gets the path of a job's directory or a file in it
+
+            Args:
+                job_id (string): The job id
+                filename (string): Optional file in the job directory
+
+            Returns:
+                (string): the path
+            """
+        if not is_valid_job_id(job_id):
+            raise ValueError("Invalid job id {}".format(job_id))
+
+        if filename is None:
+            return os.path.join(self.jobs_dir, job_id)
+        return os.path.join(self.jobs_dir, job_id, filename)
+
+    def read_json(self, job_id, filename):
+        """Reads a json file of a job
+
+            Args:
+                job_id (string): The job id
+                filename (string): The file in the job directory
+
+            Returns:
+                (dict): the contents or None if it doesn't exist
+            """
+        if not is_valid_job_id(job_id):
+            return None
+
+        try:
+            with open(self.job_path(job_id, filename)) as json_file:
+                return json.load(json_file)
+        except FileNotFoundError:
+            return None
+
+    def write_json(self, job_id, filename, data):
+        """Writes a json file of a job, replacing it in one step so readers never see half a file
+
+            Args:
+                job_id (string): The job id
+                filename (string): The file in the job directory
+                data (dict): The contents
+            """
+        path = self.job_path(job_id, filename)
+        handle, temp_path = tempfile.mkstemp(dir=self.job_path(job_id), prefix=".{}.".format(filename),
+                                             suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as json_file:
+                json.dump(data, json_file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def remove_expired(self):
+        """Removes finished jobs older than JOB_RETENTION_SECONDS"""
+        now = time.time()
+        for job_id in os.listdir(self.jobs_dir):
+            status = self.status(job_id)
+            if status is not None and status["state"] in FINISHED_STATES \
+                    and now - status["finished"] > JOB_RETENTION_SECONDS:
+                shutil.rmtree(self.job_path(job_id), ignore_errors=True)
+
+
+class JobCancelEvent(threading.Event):
+    """ The cancel event of a job, which is also set when another process writes the job's cancel marker. The
+    model search polls is_set so a cancel from any process stops it, wait only sees set called in this process.
+    """
+
+    def __init__(self, marker_path):
+        """Creates the event
+
+            Args:
+                marker_path (string): The cancel marker file of the job
+            """
+        super().__init__()
+        self.marker_path = marker_path
+
+    def is_set(self):
+        """Checks if the job has been cancelled in this or any other process
+
+            Returns:
+                (bool): True if cancelled
+            """
+        if not super().is_set() and os.path.exists(self.marker_path):
+            self.set()
+        return super().is_set()
+
+
+def process_identity():
+    """Identifies this process in a way that a later process with the same pid can't match
+
+        Returns:
+            (dict): the pid and start time of this process
+        """
+    process = psutil.Process()
+    return {"pid": process.pid, "created": process.create_time()}
+
+
+def is_alive(owner):
+    """Checks the process that owns a job is still running
+
+        Args:
+            owner (dict): The process from process_identity or None for jobs without an owner
+
+        Returns:
+            (bool): True if it is running or can't be checked
+        """
+    if owner is None:
+        return True
+
+    try:
+        return psutil.Process(owner["pid"]).create_time() == owner["created"]
+    except psutil.NoSuchProcess:
+        return False
+    except psutil.Error:
+        return True
+
+
+def is_valid_job_id(job_id):
+    """Checks a job id is one created by the job manager so it is safe to use in a path
+
+        Args:
+            job_id (string): The job id
+
+        Returns:
+            (bool): True if valid
+        """
+    return isinstance(job_id, str) and re.fullmatch(r"[0-9a-f]{32}", job_id) is not None
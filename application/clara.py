@@ -0,0 +1,263 @@
+import numpy as np
+from sklearn_extra.cluster import KMedoids
+from application.gower_distance import GowerFeatures, GOWER_MEMORY_BUDGET, BLOCK_TEMP_ARRAYS
+
+CLARA_SAMPLES = 5  # Number of samples to fit medoids on before keeping the best medoid set
+CLARA_SAMPLE_SIZE = 1000  # Number of rows in each sample (each sample has a sample_size squared distance matrix)
+WEIGHTED_MAX_ITER = 300  # Maximum number of assign and update rounds of the weighted K Medoids
+
+
+def stratified_sample(n_rows, sample_size, strata=None, random_state=None):
+    """Draws a random sample of row indexes keeping the proportion of each strata the same as the full data
+
+        Args:
+            n_rows (int): The number of rows to sample from
+            sample_size (int): The number of rows to sample
+            strata (numpy array): Optional label for each row to stratify by
+            random_state (numpy.random.RandomState): The random generator to use
+
+        Returns:
+            (numpy array): the sorted row indexes in the sample
+        """
+    rng = random_state if isinstance(random_state, np.random.RandomState) else np.random.RandomState(random_state)
+    sample_size = min(sample_size, n_rows)
+
+    if strata is None:
+        return np.sort(rng.choice(n_rows, sample_size, replace=False))
+
+    # Allocate the sample to each strata in proportion to its size, always keeping at least one row
+    strata = np.asarray(strata)
+    values, counts = np.unique(strata, return_counts=True)
+    allocation = np.maximum(1, np.round(counts / n_rows * sample_size)).astype(int)
+    allocation = np.minimum(allocation, counts)
+
+    sample = []
+    for value, size in zip(values, allocation):
+        members = np.flatnonzero(strata == value)
+        sample.append(rng.choice(members, size, replace=False))
+
+    return np.sort(np.concatenate(sample))
+
+
+def medoid_distances(features, medoids, memory_budget=GOWER_MEMORY_BUDGET):
+    """Calculates the Gower distance from every row to each medoid. The cost is O(n.k) and the rows are
+    processed in blocks to stay under the memory budget.
+
+        Args:
+            features (GowerFeatures): The prepared features of the full data
+            medoids (numpy array): The row indexes of the medoids
+            memory_budget (int): Bytes of working memory allowed for a block
+
+        Returns:
+            (numpy array): the n x k float32 distances
+        """
+    distances = np.zeros((features.n_rows, len(medoids)), dtype=np.float32)
+
+    rows_per_block = int(max(1, memory_budget // (max(len(medoids), 1) * 4 * BLOCK_TEMP_ARRAYS)))
+    for start in range(0, features.n_rows, rows_per_block):
+        stop = min(start + rows_per_block, features.n_rows)
+        features.distances(np.arange(start, stop), medoids, out=distances[start:stop])
+
+    return distances
+
+
+def assign_to_medoids(features, medoids, memory_budget=GOWER_MEMORY_BUDGET):
+    """Assigns every row to its nearest medoid by Gower distance
+
+        Args:
+            features (GowerFeatures): The prepared features of the full data
+            medoids (numpy array): The row indexes of the medoids
+            memory_budget (int): Bytes of working memory allowed for a block
+
+        Returns:
+            (numpy array): the index of the nearest medoid for each row
+            (numpy array): the distance to the nearest medoid for each row
+        """
+    distances = medoid_distances(features, medoids, memory_budget)
+    labels = np.argmin(distances, axis=1)
+    nearest = distances[np.arange(features.n_rows), labels]
+
+    return labels, nearest
+
+
+def simplified_silhouette(medoid_distances, labels, weights=None):
+    """The simplified (medoid based) silhouette score. Each row is scored using its distance to its own medoid
+    and to the nearest other medoid instead of the mean distance to every other row, so the cost is O(n.k)
+
+        Args:
+            medoid_distances (numpy array): n x k distances from each row to each medoid
+            labels (numpy array): The cluster of each row, indexing the medoid columns
+            weights (numpy array): Optional number of times each row appears, to average the scores by
+
+        Returns:
+            (float): the mean silhouette from -1 to 1
+        """
+    labels = np.asarray(labels)
+    if len(np.unique(labels)) < 2:
+        raise ValueError("The silhouette needs at least 2 clusters")
+
+    rows = np.arange(len(labels))
+    own = medoid_distances[rows, labels].astype(np.float64)
+
+    # Distance to the nearest medoid that isn't this row's medoid
+    others = medoid_distances.astype(np.float64)
+    others[rows, labels] = np.inf
+    nearest_other = others.min(axis=1)
+
+    largest = np.maximum(own, nearest_other)
+    scores = np.divide(nearest_other - own, largest, out=np.zeros_like(own), where=largest > 0)
+
+    return float(np.average(scores, weights=weights))
+
+
+def cluster_distance_sums(matrix, labels, weights, n_clusters):
+    """Sums the weighted distances from every row to the rows of each cluster in one product with the matrix
+
+        Args:
+            matrix (numpy array): The n x n distance matrix
+            labels (numpy array): The cluster of each row from 0 to n_clusters - 1
+            weights (numpy array): The number of times each row appears
+            n_clusters (int): The number of clusters
+
+        Returns:
+            (numpy array): n x n_clusters sums of the weighted distances, in the dtype of the matrix
+        """
+    # Use the dtype of the matrix so a float32 matrix isn't copied to float64 for the product
+    members = np.zeros((len(labels), n_clusters), dtype=matrix.dtype)
+    members[np.arange(len(labels)), labels] = weights
+    return np.asarray(matrix @ members)
+
+
+def weighted_k_medoids(matrix, n_clusters, weights, max_iter=WEIGHTED_MAX_ITER):
+    """K Medoids on a precomputed distance matrix where each row stands for several identical rows. The
+    medoids start at the rows with the lowest weighted distance to every row, then rows are assigned to
+    their nearest medoid and each medoid moves to the member with the lowest weighted distance to the other
+    members until the medoids stop moving. This is the alternate method of sklearn_extra's KMedoids, which
+    has no sample weights.
+
+        Args:
+            matrix (numpy array): The n x n distance matrix of the distinct rows
+            n_clusters (int): The number of clusters
+            weights (numpy array): The number of times each row appears
+            max_iter (int): The maximum number of assign and update rounds
+
+        Returns:
+            (numpy array): the cluster of each row
+            (numpy array): the row indexes of the medoids
+        """
+    weights = np.asarray(weights)
+    totals = np.asarray(matrix @ weights.astype(matrix.dtype))
+    medoids = np.argsort(totals, kind="stable")[:n_clusters]
+
+    for _ in range(max_iter):
+        labels = np.argmin(matrix[:, medoids], axis=1)
+
+        # Weighted distance from each row to the members of each cluster, the best medoid of a cluster
+        # is the member with the lowest sum
+        sums = cluster_distance_sums(matrix, labels, weights, n_clusters)
+        new_medoids = medoids.copy()
+        for cluster in range(n_clusters):
+            members = np.flatnonzero(labels == cluster)
+            if len(members) > 0:
+                new_medoids[cluster] = members[np.argmin(sums[members, cluster])]
+
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+
+    return np.argmin(matrix[:, medoids], axis=1), medoids
+
+
+def weighted_silhouette(matrix, labels, weights):
+    """The silhouette score of rows that each stand for several identical rows, the same as sklearn's
+    silhouette_score with metric="precomputed" on the rows repeated by their weights but without the repeats
+
+        Args:
+            matrix (numpy array): The n x n distance matrix of the distinct rows
+            labels (numpy array): The cluster of each row
+            weights (numpy array): The number of times each row appears
+
+        Returns:
+            (float): the mean silhouette from -1 to 1 over the repeated rows
+        """
+    weights = np.asarray(weights, dtype=np.float64)
+    clusters, labels = np.unique(labels, return_inverse=True)
+    if not 2 <= len(clusters) <= weights.sum() - 1:
+        raise ValueError("The silhouette needs between 2 and n - 1 clusters")
+
+    rows = np.arange(len(labels))
+    sizes = np.bincount(labels, weights=weights, minlength=len(clusters))
+    sums = cluster_distance_sums(matrix, labels, weights, len(clusters)).astype(np.float64)
+
+    # A row's copies are at distance 0 from it so only the row itself is left out of its own cluster
+    own_size = sizes[labels] - 1
+    own = np.divide(sums[rows, labels], own_size, out=np.zeros(len(labels)), where=own_size > 0)
+
+    # Mean distance to the nearest other cluster
+    others = sums / sizes
+    others[rows, labels] = np.inf
+    nearest_other = others.min(axis=1)
+
+    # Rows alone in their cluster score 0
+    largest = np.maximum(own, nearest_other)
+    scored = (largest > 0) & (own_size > 0)
+    scores = np.divide(nearest_other - own, largest, out=np.zeros(len(labels)), where=scored)
+
+    return float(np.average(scores, weights=weights))
+
+
+def clara(df, n_clusters, n_samples=CLARA_SAMPLES, sample_size=CLARA_SAMPLE_SIZE, strata=None,
+          random_state=None, memory_budget=GOWER_MEMORY_BUDGET, features=None, weights=None):
+    """Clustering Large Applications (CLARA). Fits K Medoids on the Gower distances of several samples of the
+    data, keeps the medoids with the lowest total distance over all rows and assigns every row to its
+    nearest medoid. Each sample carries over the best medoids found so far.
+
+        Args:
+            df (pandas.DataFrame): The data in a pandas dataframe
+            n_clusters (int): The number of clusters
+            n_samples (int): The number of samples to fit medoids on
+            sample_size (int): The number of rows in each sample
+            strata (numpy array): Optional label for each row to stratify the samples by
+            random_state (int): Can be used to fix the random state - ideal for testing
+            memory_budget (int): Bytes of working memory allowed when assigning rows to medoids
+            features (GowerFeatures): Optional features already prepared from df
+            weights (numpy array): Optional number of times each row appears, the medoids of each sample are
+                fitted with the weights of its rows and the cost counts each row that many times
+
+        Returns:
+            (numpy array): the cluster assignment of each row
+            (numpy array): the row indexes of the medoids
+            (float): the total distance of all rows to their medoid
+        """
+    if features is None:
+        features = GowerFeatures(df)
+
+    rng = np.random.RandomState(random_state)
+    best = None
+
+    for _ in range(n_samples):
+        sample = stratified_sample(features.n_rows, sample_size, strata, rng)
+
+        # Keep the best medoids so far in the sample so the next sample can only improve on them
+        if best is not None:
+            sample = np.union1d(sample, best[1])
+
+        # Fit on the Gower distances between rows in the sample only
+        matrix = features.distances(sample, sample)
+        if weights is None:
+            k_medoids = KMedoids(n_clusters=n_clusters, metric="precomputed", random_state=random_state).fit(matrix)
+            medoids = sample[k_medoids.medoid_indices_]
+        else:
+            medoids = sample[weighted_k_medoids(matrix, n_clusters, weights[sample])[1]]
+
+        # Total cost over all the rows, not just the sample
+        labels, nearest = assign_to_medoids(features, medoids, memory_budget)
+        if weights is None:
+            cost = float(nearest.sum(dtype=np.float64))
+        else:
+            cost = float(np.dot(nearest.astype(np.float64), weights))
+
+        if best is None or cost < best[2]:
+            best = (labels, medoids, cost)
+
+    return best
@@ -1,6 +1,10 @@
 import os
 from io import StringIO
 import csv
+import numpy as np
+import pandas as pd
+
+CSV_CHUNK_ROWS = 50000  # Number of csv rows parsed per chunk when streaming an upload into a dataframe
 
 
 def csv_to_list(filepath):
@@ -59,6 +63,166 @@ def csv_to_list_from_bin_file(file, header=True):
         return rows[1:]
 
 
+def csv_to_dataframe_from_bin_file(file, column_names, dtypes=None, skip_header=True, chunk_rows=CSV_CHUNK_ROWS):
+    """Streams a csv binary file into a dataframe one bounded chunk at a time. Each chunk is parsed
+    straight into typed columns and copied into a buffer for each column before the next chunk is read, so
+    the whole upload is never held as one string, as a list of rows or as a list of chunks.
+
+        Args:
+            file: The file object (a werkzeug FileStorage or any binary stream)
+            column_names (list): The names to give the columns in order
+            dtypes (dict): Column name to dtype to parse into, eg. np.float64 or "category", columns not listed
+                are kept as strings
+            skip_header (bool): True if the first line of the file is a header line to ignore
+            chunk_rows (int): The maximum number of rows parsed at one time
+
+        Returns:
+            (pandas.DataFrame): the csv file as a dataframe
+        """
+
+    if dtypes is None:
+        dtypes = {}
+
+    # Anything not given a type stays as a string so empty cells are kept as '' like the csv reader does
+    column_dtypes = {name: dtypes.get(name, object) for name in column_names}
+
+    # Only empty cells of non string columns are treated as missing data
+    na_values = {name: [''] for name, dtype in column_dtypes.items() if dtype is not object}
+
+    # Read from the underlying stream of an uploaded file if there is one
+    stream = getattr(file, "stream", file)
+
+    buffers = {name: ColumnBuffer(chunk_rows) for name in column_names}
+    try:
+        reader = pd.read_csv(stream, header=None, names=column_names, skiprows=1 if skip_header else 0,
+                             dtype=column_dtypes, na_values=na_values, keep_default_na=False,
+                             encoding="utf-8", chunksize=chunk_rows)
+
+        # Copy each chunk into the column buffers, the chunk is freed when the next one is read
+        for chunk in reader:
+            for name in column_names:
+                buffers[name].append(chunk[name])
+
+    # An empty upload has no rows to parse
+    except pd.errors.EmptyDataError:
+        pass
+
+    rows = buffers[column_names[0]].size if len(column_names) > 0 else 0
+    if rows == 0:
+        return pd.DataFrame(columns=column_names)
+
+    # Each buffer is handed over one at a time so only one column is ever copied
+    df = pd.DataFrame(index=pd.RangeIndex(rows))
+    for name in column_names:
+        df[name] = buffers.pop(name).finish()
+
+    return df
+
+
+class ColumnBuffer:
+    """ Collects the values of one column from a series of chunks into one array that grows as needed, like a
+    list does, so the chunks don't all have to be kept to join them at the end. Categorical chunks each have
+    their own categories, so their codes are translated to codes of the categories of the whole column.
+    """
+
+    def __init__(self, capacity):
+        """Creates an empty buffer, the array is made when the first chunk shows its dtype
+
+            Args:
+                capacity (int): The number of values the array starts with room for
+            """
+        self.capacity = capacity
+        self.values = None
+        self.size = 0
+
+        # Value to code of every category seen so far, None if the column isn't categorical
+        self.categories = None
+
+    def append(self, column):
+        """Copies the values of a chunk to the end of the buffer
+
+            Args:
+                column (pandas.Series): The column of the chunk
+            """
+        if pd.api.types.is_categorical_dtype(column):
+            if self.categories is None:
+                self.categories = {}
+            codes = np.array([self.categories.setdefault(value, len(self.categories))
+                              for value in column.cat.categories] + [-1], dtype=np.int32)
+
+            # Missing values have the code -1 which picks the -1 on the end
+            values = codes[column.cat.codes.to_numpy()]
+        else:
+            values = column.to_numpy()
+
+        if self.values is None:
+            self.values = np.empty(max(self.capacity, len(values)), dtype=values.dtype)
+        elif self.size + len(values) > len(self.values):
+            grown = np.empty(max(2 * len(self.values), self.size + len(values)), dtype=self.values.dtype)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+
+        self.values[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def finish(self):
+        """Gets the values collected, the buffer can't be used after this
+
+            Returns:
+                (numpy array or pandas.Categorical): the values of the column
+            """
+        values = self.values
+        self.values = None
+
+        # Give the unused room back without copying
+        values.resize(self.size, refcheck=False)
+
+        # Sorted categories like a single read_csv gives
+        if self.categories is not None:
+            names = list(self.categories)
+            return pd.Categorical.from_codes(values, categories=names).reorder_categories(sorted(names))
+        return values
+
+
+def csv_chunks_from_bin_file(file, dtypes=None, chunk_rows=CSV_CHUNK_ROWS):
+    """Streams a csv binary file with a header line as a series of dataframes, each with at most chunk_rows rows.
+    Columns are named from the header line and typed the same way as csv_to_dataframe_from_bin_file.
+
+        Args:
+            file: The file object (a werkzeug FileStorage or any binary stream)
+            dtypes (dict): Column name to dtype to parse into, columns not listed are kept as strings
+            chunk_rows (int): The maximum number of rows in each dataframe
+
+        Returns:
+            (generator): the dataframes in file order, the index carries on from one chunk to the next
+        """
+
+    if dtypes is None:
+        dtypes = {}
+
+    # Read from the underlying stream of an uploaded file if there is one
+    stream = getattr(file, "stream", file)
+
+    # Read the header line first so every column can be given a type
+    header = stream.readline().decode("utf-8-sig")
+    if header.strip() == "":
+        return
+    column_names = [name.strip() for name in next(csv.reader(StringIO(header)))]
+
+    column_dtypes = {name: dtypes.get(name, object) for name in column_names}
+    na_values = {name: [''] for name, dtype in column_dtypes.items() if dtype is not object}
+
+    try:
+        reader = pd.read_csv(stream, header=None, names=column_names, dtype=column_dtypes, na_values=na_values,
+                             keep_default_na=False, encoding="utf-8", chunksize=chunk_rows)
+        for chunk in reader:
+            yield chunk
+
+    # A header with no rows has nothing to parse
+    except pd.errors.EmptyDataError:
+        return
+
+
 def list_to_csv(data, filepath):
     """Writes a list to a csv file
 
@@ -1,5 +1,8 @@
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
+from application import lazy_imports
+
+# Only imported when Google Analytics is first used, see lazy_imports
+discovery = lazy_imports.lazy_module("googleapiclient.discovery")
+service_account = lazy_imports.lazy_module("oauth2client.service_account")
 
 
 class GAAdapter:
@@ -20,11 +23,11 @@ class GAAdapter:
             """
 
         # Get the credentials from local storage
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
+        credentials = service_account.ServiceAccountCredentials.from_json_keyfile_name(
             key_file_location, scopes=scopes)
 
         # Build the service object.
-        self.service = build(api_name, api_version, credentials=credentials)
+        self.service = discovery.build(api_name, api_version, credentials=credentials)
 
     def __get_account_by_index(self, index):
         """Gets a Google Analytics account by index
@@ -0,0 +1,196 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+GOWER_MEMORY_BUDGET = 256 * 1024 ** 2  # Bytes of working memory allowed for the blocks being calculated at one time
+GOWER_MEMMAP_THRESHOLD = 2 * 1024 ** 3  # Matrices larger than this many bytes are stored in a scratch file on disk
+BLOCK_TEMP_ARRAYS = 3  # Number of block sized temporary arrays needed when calculating one block
+
+
+class GowerFeatures:
+    """ The features of a dataframe scaled and coded so Gower distances between any of the rows can be
+    calculated quickly in float32.
+
+    Numeric columns are scaled by their range so the absolute difference is the Gower dissimilarity.
+    Any other column is treated as categorical and coded as integers so the dissimilarity is a mismatch.
+    Missing numbers aren't allowed since they would make every distance of their rows nan, the data is imputed
+    first. Missing categories are a category of their own.
+    """
+
+    def __init__(self, df):
+        """Prepares the features for distance calculations
+
+            Args:
+                df (pandas.DataFrame): The data in a pandas dataframe, with no missing numbers
+            """
+
+        # Numeric columns are scaled, everything else (including bool) is categorical like the gower package
+        numeric = [np.issubdtype(dtype, np.number) for dtype in df.dtypes]
+        num_columns = [col for col, is_num in zip(df.columns, numeric) if is_num]
+        cat_columns = [col for col, is_num in zip(df.columns, numeric) if not is_num]
+
+        self.n_rows = df.shape[0]
+        self.n_columns = df.shape[1]
+
+        # Scale each numeric column by its range, a column with no range never adds to the distance
+        self.num = np.zeros((self.n_rows, len(num_columns)), dtype=np.float32)
+        for index, col in enumerate(num_columns):
+            values = df[col].to_numpy(dtype=np.float64)
+            missing = int(np.isnan(values).sum())
+            if missing > 0:
+                raise ValueError("Gower distances can't be calculated with missing numbers, the field {} has {}"
+                                 .format(col, missing))
+            col_range = np.nanmax(values) - np.nanmin(values) if self.n_rows > 0 else 0
+            if col_range > 0:
+                self.num[:, index] = (values - np.nanmin(values)) / col_range
+
+        # Code each categorical column as integers so equality checks are fast
+        self.cat = np.zeros((self.n_rows, len(cat_columns)), dtype=np.int32)
+        for index, col in enumerate(cat_columns):
+            self.cat[:, index] = df[col].astype("category").cat.codes.to_numpy()
+
+    def distances(self, rows, columns=None, out=None):
+        """Calculates the Gower distances between the rows and the columns
+
+            Args:
+                rows (array like): The row indexes to calculate distances from
+                columns (array like): The row indexes to calculate distances to, all rows if None
+                out (numpy array): Optional float32 array of shape (len(rows), len(columns)) to write into
+
+            Returns:
+                (numpy array): the float32 distance block
+            """
+        num_x = self.num[rows]
+        cat_x = self.cat[rows]
+        num_y = self.num if columns is None else self.num[columns]
+        cat_y = self.cat if columns is None else self.cat[columns]
+
+        if out is None:
+            out = np.zeros((num_x.shape[0], num_y.shape[0]), dtype=np.float32)
+        else:
+            out[:] = 0
+
+        # Accumulate one column at a time so the only temporary is the size of the block
+        temp = np.empty(out.shape, dtype=np.float32)
+        for col in range(num_x.shape[1]):
+            np.subtract.outer(num_x[:, col], num_y[:, col], out=temp)
+            np.abs(temp, out=temp)
+            out += temp
+
+        for col in range(cat_x.shape[1]):
+            out += np.not_equal.outer(cat_x[:, col], cat_y[:, col])
+
+        # The Gower distance is the mean dissimilarity over all features
+        if self.n_columns > 0:
+            out /= self.n_columns
+
+        return out
+
+
+def block_rows(n_rows, memory_budget=GOWER_MEMORY_BUDGET, n_workers=1):
+    """Determines how many rows can be calculated in one block while staying under the memory budget
+
+        Args:
+            n_rows (int): The number of rows in the full distance matrix
+            memory_budget (int): The bytes of working memory that can be used by all workers
+            n_workers (int): The number of blocks that are calculated at the same time
+
+        Returns:
+            (int): the number of rows in a block
+        """
+    row_bytes = max(n_rows, 1) * np.dtype(np.float32).itemsize * BLOCK_TEMP_ARRAYS
+    return int(max(1, memory_budget // (row_bytes * max(n_workers, 1))))
+
+
+def resolve_n_jobs(n_jobs):
+    """Converts an n_jobs value to a number of workers using the sklearn convention that None is one
+    worker and negative values count back from the number of cores
+
+        Args:
+            n_jobs (int): The requested number of workers
+
+        Returns:
+            (int): the number of workers to use
+        """
+    cores = os.cpu_count() or 1
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, cores + 1 + n_jobs)
+    return max(1, min(n_jobs, cores))
+
+
+def gower_matrix(df, memory_budget=GOWER_MEMORY_BUDGET, scratch_path=None, n_jobs=-1):
+    """Computes the Gower distance matrix of a dataframe in blocks of rows so the working memory stays under
+    a budget. The matrix is float32 and is stored in a memory mapped scratch file when one is given or when
+    it would be larger than GOWER_MEMMAP_THRESHOLD. Blocks are calculated in parallel threads since numpy
+    releases the GIL for the array operations.
+
+        Args:
+            df (pandas.DataFrame): The data in a pandas dataframe
+            memory_budget (int): The bytes of working memory allowed for the blocks being calculated
+            scratch_path (string): Optional file path to memory map the matrix to
+            n_jobs (int): The number of threads to use, -1 for all cores
+
+        Returns:
+            (numpy array): the n x n float32 Gower distance matrix
+        """
+    features = GowerFeatures(df)
+    n_rows = features.n_rows
+    matrix_bytes = n_rows * n_rows * np.dtype(np.float32).itemsize
+
+    # Spill to a scratch file if the matrix would take too much memory
+    if scratch_path is None and matrix_bytes > GOWER_MEMMAP_THRESHOLD:
+        scratch_file, scratch_path = tempfile.mkstemp(prefix="gower_", suffix=".dat")
+        os.close(scratch_file)
+
+    try:
+        if scratch_path is not None and n_rows > 0:
+            matrix = np.memmap(scratch_path, dtype=np.float32, mode="w+", shape=(n_rows, n_rows))
+        else:
+            matrix = np.empty((n_rows, n_rows), dtype=np.float32)
+
+        workers = resolve_n_jobs(n_jobs)
+        rows_per_block = block_rows(n_rows, memory_budget, workers)
+
+        def compute_block(start):
+            stop = min(start + rows_per_block, n_rows)
+            features.distances(np.arange(start, stop), out=matrix[start:stop])
+
+        starts = range(0, n_rows, rows_per_block)
+        if workers == 1 or len(starts) == 1:
+            for start in starts:
+                compute_block(start)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(compute_block, starts))
+    except BaseException:
+        # The matrix never reaches the caller to be released so its scratch file is removed here
+        if scratch_path is not None:
+            try:
+                os.remove(scratch_path)
+            except OSError:
+                pass
+        raise
+
+    return matrix
+
+
+def release_matrix(matrix):
+    """Removes the scratch file behind a memory mapped distance matrix once it is no longer needed
+
+        Args:
+            matrix (numpy array): The distance matrix returned by gower_matrix
+        """
+    filename = getattr(matrix, "filename", None)
+    if filename is None:
+        return
+
+    matrix.flush()
+
+    # Windows won't remove a file that is still mapped so the temp directory clean up will have to get it
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
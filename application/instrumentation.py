@@ -0,0 +1,444 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import psutil
+
+RSS_SAMPLE_SECONDS = 0.05  # How often the resident memory is sampled while something is being measured
+METRIC_PREFIX = "lams"  # Prefix of the metric names on the /metrics route
+METRICS_FLUSH_SECONDS = 1.0  # The longest a change to the metrics of a process waits to be written to METRICS_DIR
+
+# Directory every server process writes its metrics to so /metrics can add them up, eg. LAMS_METRICS_DIR=/tmp/lams.
+# Not set to only report the process that serves /metrics, which is all of them when there is one process.
+METRICS_DIR = os.environ.get("LAMS_METRICS_DIR") or None
+
+
+class RssSampler:
+    """ Samples the resident memory of this process in a background thread while any measurement is open so
+    each measurement can report the peak memory it saw. One thread serves every open measurement.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        """Creates the sampler, the thread starts with the first measurement
+
+            Args:
+                interval (float): Seconds between samples
+            """
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peaks = {}
+        self.next_token = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.thread = None
+
+    def begin(self):
+        """Starts tracking the peak memory
+
+            Returns:
+                (int): a token to pass to end
+            """
+        rss = self.rss()
+        with self.lock:
+            token = self.next_token
+            self.next_token += 1
+            self.peaks[token] = rss
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="rss-sampler", daemon=True)
+                self.thread.start()
+            self.wake.notify()
+
+        return token
+
+    def end(self, token):
+        """Stops tracking the peak memory
+
+            Args:
+                token (int): The token from begin
+
+            Returns:
+                (int): the peak resident memory in bytes since begin
+            """
+        rss = self.rss()
+        with self.lock:
+            return max(self.peaks.pop(token), rss)
+
+    def run(self):
+        """Samples the memory while there are open measurements"""
+        while True:
+            with self.lock:
+                while len(self.peaks) == 0:
+                    self.wake.wait()
+
+            rss = self.rss()
+            with self.lock:
+                for token in self.peaks:
+                    self.peaks[token] = max(self.peaks[token], rss)
+
+            time.sleep(self.interval)
+
+    def rss(self):
+        """Gets the current resident memory
+
+            Returns:
+                (int): bytes
+            """
+        return self.process.memory_info().rss
+
+
+# The sampler is created in each process that measures something
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def sampler():
+    """Gets the memory sampler of this process
+
+        Returns:
+            (RssSampler): the sampler
+        """
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = RssSampler()
+        return _sampler
+
+
+@contextmanager
+def measure(record=None):
+    """Measures the wall time, the cpu time of this process and the peak resident memory of the code inside
+    the with block. The cpu time doesn't include worker processes, they measure themselves.
+
+        Args:
+            record (dict): Optional dictionary to add the measurements to
+
+        Returns:
+            (dict): the record with wall_seconds, cpu_seconds and peak_rss_bytes added when the block ends
+    """
+    if record is None:
+        record = {}
+
+    token = sampler().begin()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_seconds"] = time.perf_counter() - wall
+        record["cpu_seconds"] = time.process_time() - cpu
+        record["peak_rss_bytes"] = sampler().end(token)
+
+
+def measured(function, *args, **kwargs):
+    """Calls a function and measures it, used to measure work done in a worker process
+
+        Args:
+            function (function): The function to call
+            args: The arguments to call it with
+            kwargs: The keyword arguments to call it with
+
+        Returns:
+            (object): the result of the function
+            (dict): the measurements
+        """
+    with measure() as record:
+        result = function(*args, **kwargs)
+    return result, record
+
+
+def shape(data):
+    """Gets the shape of a stage input or output
+
+        Args:
+            data: A dataframe, array, list or tuple of them
+
+        Returns:
+            (list): the shape, a list of shapes for a tuple or None if it has no shape
+        """
+    if isinstance(data, tuple):
+        return [shape(item) for item in data]
+    if hasattr(data, "shape"):
+        return list(data.shape)
+    if isinstance(data, list):
+        return [len(data)]
+    return None
+
+
+class StageTimer:
+    """ Measures each stage of a build one after another and adds a record of each stage to the report """
+
+    def __init__(self, report):
+        """Creates the timer
+
+            Args:
+                report (dict): The build report, the records are added to its "stages" list
+            """
+        self.records = report.setdefault("stages", [])
+        self.open = None
+
+    def start(self, name, *inputs):
+        """Finishes the stage that is running and starts measuring the next one
+
+            Args:
+                name (string): The name of the stage
+                inputs: The input data of the stage
+            """
+        self.finish()
+
+        record = {"name": name, "input_shape": shape(inputs[0] if len(inputs) == 1 else inputs)}
+        context = measure(record)
+        context.__enter__()
+        self.open = (record, context)
+
+    def finish(self, *outputs):
+        """Finishes the stage that is running
+
+            Args:
+                outputs: The output data of the stage
+            """
+        if self.open is None:
+            return
+
+        record, context = self.open
+        self.open = None
+        context.__exit__(None, None, None)
+        if len(outputs) > 0:
+            record["output_shape"] = shape(outputs[0] if len(outputs) == 1 else outputs)
+
+        self.records.append(record)
+
+
+class MetricsRegistry:
+    """ Keeps running totals of the build and request measurements of this process and renders them in the
+    Prometheus text format.
+
+    With several server processes each one answers /metrics for itself, so when a directory is given every
+    registry also writes its totals to its own file there and render adds up the files of every process.
+    Counters are summed, including those of processes that have stopped, and gauges take the latest value.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_SECONDS):
+        """Creates an empty registry
+
+            Args:
+                directory (string): Optional directory shared by the server processes
+                flush_interval (float): The longest a change waits to be written to the directory
+            """
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_timer = None
+        self.pid = None
+        self.file_name = None
+
+        # Metric name to help text, type and the value of each set of labels
+        self.metrics = {}
+
+        # When each gauge was last set, so the latest value of every process is used
+        self.gauge_times = {}
+
+    def add(self, name, help_text, metric_type, labels, value):
+        """Adds to a counter or sets a gauge
+
+            Args:
+                name (string): The metric name without the prefix
+                help_text (string): What the metric measures
+                metric_type (string): "counter" or "gauge"
+                labels (dict): The labels of the series
+                value (float): The amount to add to a counter or the value of a gauge
+            """
+        key = tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self.lock:
+            metric = self.metrics.setdefault(name, {"help": help_text, "type": metric_type, "series": {}})
+            if metric_type == "counter":
+                metric["series"][key] = metric["series"].get(key, 0) + value
+            else:
+                metric["series"][key] = value
+                self.gauge_times[(name, key)] = time.time()
+
+            # Write the change to the directory soon, but not on every request. A forked process doesn't have
+            # the timer thread of its parent.
+            if self.directory is not None and (self.flush_timer is None or not self.flush_timer.is_alive()):
+                self.flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self):
+        """Writes the totals of this process to its file in the directory"""
+        if self.directory is None:
+            return
+
+        with self.lock:
+            self.flush_timer = None
+            state = self.state()
+            path = os.path.join(self.directory, self.own_file())
+
+        # Replace the file in one step so render never reads half of it
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".metrics-", suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as json_file:
+                json.dump(state, json_file)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def own_file(self):
+        """Gets the name of the file of this process, a forked process gets a new one
+
+            Returns:
+                (string): the file name
+            """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.file_name = "metrics-{}-{}.json".format(self.pid, uuid.uuid4().hex[:8])
+        return self.file_name
+
+    def state(self):
+        """Gets the metrics of this process in a form that can be written as json, called with the lock held
+
+            Returns:
+                (dict): metric name to help text, type and a list of the labels, value and update time of each
+                    series
+            """
+        return {name: {"help": metric["help"], "type": metric["type"],
+                       "series": [[list(key), value, self.gauge_times.get((name, key), 0)]
+                                  for key, value in metric["series"].items()]}
+                for name, metric in self.metrics.items()}
+
+    def observe(self, name, help_text, labels, record):
+        """Adds a measurement record to the seconds, cpu seconds and count counters and the peak memory gauge
+
+            Args:
+                name (string): The metric name without the prefix
+                help_text (string): What was measured
+                labels (dict): The labels of the series
+                record (dict): The record from measure
+            """
+        self.add(name + "_seconds_total", help_text + " wall time", "counter", labels, record["wall_seconds"])
+        self.add(name + "_cpu_seconds_total", help_text + " cpu time", "counter", labels, record["cpu_seconds"])
+        self.add(name + "_total", help_text + " count", "counter", labels, 1)
+        self.add(name + "_peak_rss_bytes", help_text + " peak resident memory of the last one", "gauge", labels,
+                 record["peak_rss_bytes"])
+
+    def observe_build(self, report):
+        """Adds the measurements recorded in a build report
+
+            Args:
+                report (dict): The build report
+            """
+        cached = set(report.get("cached_stages", []))
+
+        for record in report.get("stages", []):
+            self.observe("build_stage", "Build stage", {"stage": record["name"]}, record)
+
+        # Details of stages served from the cache were measured by an earlier build
+        if "cluster" not in cached:
+            for record in report.get("cluster_k", []):
+                self.observe("cluster_k", "Clustering fit and silhouette", {"k": record["k"]}, record)
+        if "lr_search" not in cached:
+            for record in report.get("lr_rounds", []):
+                self.observe("lr_round", "Stepwise selection round", {}, record)
+        if "rf_search" not in cached:
+            for record in report.get("rf_candidates", []):
+                self.add("rf_candidate_fit_seconds_total", "Random forest candidate fit time", "counter",
+                         {"search": report.get("rf_search")}, record["fit_seconds"])
+                self.add("rf_candidate_total", "Random forest candidate count", "counter",
+                         {"search": report.get("rf_search")}, 1)
+
+    def render(self):
+        """Renders the metrics in the Prometheus text format
+
+            Returns:
+                (string): the metrics
+            """
+        with self.lock:
+            states = [self.state()]
+            own_file = self.own_file() if self.directory is not None else None
+
+        # Add the totals of the other processes
+        if self.directory is not None:
+            for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+                if os.path.basename(path) == own_file:
+                    continue
+                try:
+                    with open(path) as json_file:
+                        states.append(json.load(json_file))
+                except (OSError, ValueError):
+                    # Removed while the directory was being read
+                    continue
+
+        merged = merge_states(states)
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            full_name = "{}_{}".format(METRIC_PREFIX, name)
+            lines.append("# HELP {} {}".format(full_name, metric["help"]))
+            lines.append("# TYPE {} {}".format(full_name, metric["type"]))
+            for key, (value, _) in sorted(metric["series"].items()):
+                labels = ",".join('{}="{}"'.format(label, escape(label_value)) for label, label_value in key)
+                series = "{}{{{}}}".format(full_name, labels) if labels != "" else full_name
+                lines.append("{} {}".format(series, repr(float(value))))
+
+        return "\n".join(lines) + "\n"
+
+
+def merge_states(states):
+    """Adds up the metrics of several processes, counters are summed and gauges take the latest value
+
+        Args:
+            states (list): The state of each process from MetricsRegistry.state
+
+        Returns:
+            (dict): metric name to help text, type and the value and update time of each set of labels
+    """
+    merged = {}
+    for state in states:
+        for name, metric in state.items():
+            target = merged.setdefault(name, {"help": metric["help"], "type": metric["type"], "series": {}})
+            for key, value, updated in metric["series"]:
+                key = tuple(tuple(pair) for pair in key)
+                if key not in target["series"]:
+                    target["series"][key] = (value, updated)
+                elif metric["type"] == "counter":
+                    target["series"][key] = (target["series"][key][0] + value, updated)
+                elif updated >= target["series"][key][1]:
+                    target["series"][key] = (value, updated)
+
+    return merged
+
+
+def clear_metrics_dir(directory=METRICS_DIR):
+    """Removes the metrics files of the processes of an earlier server so its totals aren't added to this one's
+
+        Args:
+            directory (string): The directory shared by the server processes, nothing is done if it is None
+    """
+    if directory is None:
+        return
+
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        os.remove(path)
+
+
+def escape(value):
+    """Escapes a label value for the Prometheus text format
+
+        Args:
+            value (string): The label value
+
+        Returns:
+            (string): the escaped value
+        """
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# The measurements of this process
+metrics = MetricsRegistry()
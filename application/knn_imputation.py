@@ -0,0 +1,196 @@
+import warnings
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from application.gower_distance import resolve_n_jobs
+
+KNN_NEIGHBOURS = 6  # Number of complete rows averaged to fill a missing value
+KNN_CHUNK_ROWS = 10000  # Rows with missing values that are looked up at one time
+KNN_N_JOBS = -1  # Number of threads looking up the neighbours of each chunk, -1 for all cores
+STATISTIC_MIN_ROWS = 500000  # Data sets with more rows than this are filled with the column means instead
+MAX_DONOR_ROWS = 10000  # Most complete rows kept as neighbours, they are saved with the model so this is a sample
+
+
+class MeanFillWarning(UserWarning):
+    """ Warns that missing values were filled with the column means instead of from the nearest rows """
+
+
+class IndexedKNNImputer:
+    """ Fills missing numbers with the mean of the nearest complete rows, like sklearn's KNNImputer but without
+    its n x n distance matrix. Only the rows that have missing values are looked up, through a k-d tree over the
+    complete rows built on the columns each row has. Rows with the same missing columns share a tree and are
+    looked up a chunk at a time. Very large data sets are filled with the column means instead.
+
+    The distance between rows only uses the columns the row being filled has, but unlike KNNImputer the
+    neighbours only come from rows that have every column, so the results differ from KNNImputer's when
+    rows are missing more than one column.
+
+    The complete rows are kept to fill new data and so are saved with the model. At most max_donor_rows of
+    them are kept, a random sample when there are more. Values filled with the column means instead of
+    neighbours are warned about and their count can be returned by transform. Transforming doesn't change
+    what was fitted so one fitted imputer can fill data in several threads at once.
+    """
+
+    def __init__(self, n_neighbors=KNN_NEIGHBOURS, chunk_rows=KNN_CHUNK_ROWS, n_jobs=KNN_N_JOBS,
+                 statistic_min_rows=STATISTIC_MIN_ROWS, max_donor_rows=MAX_DONOR_ROWS, random_state=0):
+        """Creates the imputer
+
+            Args:
+                n_neighbors (int): The number of complete rows averaged for each missing value
+                chunk_rows (int): The number of rows looked up at one time
+                n_jobs (int): The number of threads for each look up, -1 for all cores
+                statistic_min_rows (int): Fit on more rows than this and only the column means are used
+                max_donor_rows (int): The most complete rows kept as neighbours
+                random_state (int): The seed of the sample of complete rows
+            """
+        self.n_neighbors = n_neighbors
+        self.chunk_rows = chunk_rows
+        self.n_jobs = n_jobs
+        self.statistic_min_rows = statistic_min_rows
+        self.max_donor_rows = max_donor_rows
+        self.random_state = random_state
+        self.complete_ = None
+        self.means_ = None
+        self.trees = {}
+
+    def __getstate__(self):
+        # The trees are rebuilt when needed rather than saved with a model
+        state = self.__dict__.copy()
+        state["trees"] = {}
+        return state
+
+    def fit(self, x):
+        """Keeps a sample of the complete rows and the mean of each column
+
+            Args:
+                x (array like): The numbers with nan for missing values
+
+            Returns:
+                (IndexedKNNImputer): this imputer
+            """
+        x = np.asarray(x)
+        x = x.astype(float_dtype(x), copy=False)
+        missing = np.isnan(x)
+
+        # A column with no values is filled with 0
+        counts = (~missing).sum(axis=0)
+        sums = np.where(missing, 0, x).sum(axis=0, dtype=np.float64)
+        self.means_ = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+
+        complete = np.flatnonzero(~missing.any(axis=1))
+        if x.shape[0] > self.statistic_min_rows or len(complete) == 0:
+            self.complete_ = None
+        else:
+            if len(complete) > self.max_donor_rows:
+                rng = np.random.RandomState(self.random_state)
+                complete = np.sort(rng.choice(complete, self.max_donor_rows, replace=False))
+            self.complete_ = x[complete]
+        self.trees = {}
+
+        return self
+
+    def fit_transform(self, x, return_mean_filled=False):
+        """Fits the imputer and fills the missing values of the same data
+
+            Args:
+                x (array like): The numbers with nan for missing values
+                return_mean_filled (bool): Also return the number of values filled with the column means
+
+            Returns:
+                (numpy.ndarray): the numbers with no missing values
+                (int): the number of values filled with the column means, only if return_mean_filled
+            """
+        return self.fit(x).transform(x, return_mean_filled)
+
+    def transform(self, x, return_mean_filled=False):
+        """Fills the missing values
+
+            Args:
+                x (array like): The numbers with nan for missing values, with the columns the imputer was fitted on
+                return_mean_filled (bool): Also return the number of values filled with the column means
+
+            Returns:
+                (numpy.ndarray): a copy of the numbers with no missing values
+                (int): the number of values filled with the column means, only if return_mean_filled
+            """
+        if self.means_ is None:
+            raise ValueError("The imputer must be fitted before it can transform data")
+
+        x = np.asarray(x)
+        x = x.astype(float_dtype(x))
+        missing = np.isnan(x)
+        rows = np.flatnonzero(missing.any(axis=1))
+        mean_filled = 0
+        if len(rows) == 0:
+            return (x, mean_filled) if return_mean_filled else x
+
+        # Without any complete rows, or on very large data, use the column means
+        if self.complete_ is None:
+            x[missing] = np.take(self.means_, np.nonzero(missing)[1])
+            mean_filled = int(missing.sum())
+            warn_mean_filled(mean_filled, "there were no complete rows to use as neighbours"
+                             if len(x) <= self.statistic_min_rows else "the data has too many rows")
+            return (x, mean_filled) if return_mean_filled else x
+
+        # Rows missing the same columns are looked up in the same tree
+        patterns, inverse = np.unique(missing[rows], axis=0, return_inverse=True)
+        for pattern_index, pattern in enumerate(patterns):
+            pattern_rows = rows[inverse.ravel() == pattern_index]
+            observed = np.flatnonzero(~pattern)
+            filled = np.flatnonzero(pattern)
+
+            # A row with no values has nothing to find neighbours with
+            if len(observed) == 0:
+                x[np.ix_(pattern_rows, filled)] = self.means_[filled]
+                mean_filled += len(pattern_rows) * len(filled)
+                continue
+
+            tree = self.tree(tuple(observed))
+            donors = self.complete_[:, filled]
+            for start in range(0, len(pattern_rows), self.chunk_rows):
+                chunk = pattern_rows[start:start + self.chunk_rows]
+                _, neighbours = tree.kneighbors(x[np.ix_(chunk, observed)])
+                x[np.ix_(chunk, filled)] = donors[neighbours].mean(axis=1)
+
+        if mean_filled > 0:
+            warn_mean_filled(mean_filled, "some rows have none of the columns")
+        return (x, mean_filled) if return_mean_filled else x
+
+    def tree(self, observed):
+        """Gets the index of the complete rows over some of the columns, building it the first time
+
+            Args:
+                observed (tuple): The indexes of the columns
+
+            Returns:
+                (sklearn.neighbors.NearestNeighbors): the fitted index
+            """
+        tree = self.trees.get(observed)
+        if tree is None:
+            tree = NearestNeighbors(n_neighbors=min(self.n_neighbors, len(self.complete_)), algorithm="kd_tree",
+                                    n_jobs=resolve_n_jobs(self.n_jobs))
+            tree.fit(self.complete_[:, list(observed)])
+            self.trees[observed] = tree
+        return tree
+
+
+def warn_mean_filled(count, reason):
+    """Warns that values were filled with the column means instead of from neighbours
+
+        Args:
+            count (int): The number of values filled with the means
+            reason (string): Why the means were used
+    """
+    warnings.warn("{} missing values were filled with the column means because {}".format(count, reason),
+                  MeanFillWarning)
+
+
+def float_dtype(x):
+    """Chooses the dtype to impute in, float32 data stays float32
+
+        Args:
+            x (numpy.ndarray): The data
+
+        Returns:
+            (numpy.dtype): float32 or float64
+    """
+    return np.float32 if x.dtype == np.float32 else np.float64
@@ -0,0 +1,197 @@
+import importlib
+import sys
+import threading
+import time
+from application import instrumentation
+
+# The dependencies that are slow to import and only needed to build, score or export. Nothing imports them
+# until they are first used or warm_up loads them, in this order, once the server is listening.
+HEAVY_MODULES = ["application.knn_imputation", "sklearn.metrics", "sklearn_extra.cluster", "application.clara",
+                 "application.logistic_regression_model", "application.random_forest_model", "xlsxwriter",
+                 "oauth2client.service_account", "googleapiclient.discovery"]
+WARM_UP_DELAY_SECONDS = 1  # Seconds after the server starts before the heavy dependencies are loaded
+
+
+class LazyModule:
+    """ Stands in for a module until one of its attributes is used, then imports the module and records how
+    long the import took. Used in place of a module level import of a heavy dependency eg.
+
+        xlsxwriter = lazy_imports.lazy_module("xlsxwriter")
+    """
+
+    def __init__(self, name):
+        """Creates the stand in, nothing is imported
+
+            Args:
+                name (string): The full name of the module eg. sklearn.metrics
+            """
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def __getattr__(self, attribute):
+        # Only called for attributes that aren't set on the stand in itself
+        module = self._lazy_module
+        if module is None:
+            module = self._lazy_module = load(self._lazy_name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return "<lazy module '{}'{}>".format(self._lazy_name, "" if self._lazy_module is None else " (loaded)")
+
+
+class ImportRecorder:
+    """ Records the time taken by each lazy import and whether it was loaded by a request or the warm up """
+
+    def __init__(self):
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def load(self, name, source):
+        """Imports a module, timing the import if it wasn't already imported
+
+            Args:
+                name (string): The full name of the module
+                source (string): What caused the import "first use" or "warm up"
+
+            Returns:
+                (module): the imported module
+            """
+        if name in self.records:
+            # The import system waits for another thread that is still importing the module
+            return importlib.import_module(name)
+
+        # A module still being imported by another thread is in sys.modules but not ready
+        module = sys.modules.get(name)
+        already_imported = module is not None and not getattr(getattr(module, "__spec__", None),
+                                                               "_initializing", False)
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        seconds = time.perf_counter() - start
+
+        with self.lock:
+            if name in self.records:
+                return module
+            self.records[name] = {"module": name, "seconds": 0.0 if already_imported else seconds,
+                                  "source": "already imported" if already_imported else source,
+                                  "thread": threading.current_thread().name}
+
+        if not already_imported:
+            instrumentation.metrics.add("import_seconds_total", "Time spent importing heavy dependencies",
+                                        "counter", {"module": name, "source": source}, seconds)
+        return module
+
+    def report(self, modules=None):
+        """Reports the import time of each heavy dependency
+
+            Args:
+                modules (list): The module names to report on, HEAVY_MODULES by default
+
+            Returns:
+                (list): a dict for each module with its name, whether it is loaded, the seconds the import took,
+                    what caused it and the thread it was imported on
+            """
+        modules = HEAVY_MODULES if modules is None else modules
+        with self.lock:
+            records = dict(self.records)
+
+        report = []
+        for name in modules:
+            record = records.get(name)
+            if record is None:
+                # Imported directly by other code, or not at all
+                record = {"module": name, "seconds": None, "source": None, "thread": None}
+            report.append(dict(record, loaded=name in sys.modules))
+
+        return report
+
+
+recorder = ImportRecorder()
+
+
+def lazy_module(name):
+    """Gets a stand in for a module that is only imported when first used
+
+        Args:
+            name (string): The full name of the module
+
+        Returns:
+            (LazyModule): the stand in
+    """
+    return LazyModule(name)
+
+
+def load(name, source="first use"):
+    """Imports a module and records the time it took
+
+        Args:
+            name (string): The full name of the module
+            source (string): What caused the import
+
+        Returns:
+            (module): the imported module
+    """
+    return recorder.load(name, source)
+
+
+def warm_up(modules=None, delay=0):
+    """Imports the heavy dependencies in a background thread so the first build doesn't wait for them.
+    A failed import is left for the first use to report.
+
+        Args:
+            modules (list): The module names to import, HEAVY_MODULES by default
+            delay (float): Seconds to wait before importing, eg. so the server can start listening first
+
+        Returns:
+            (threading.Thread): the started thread
+    """
+    modules = HEAVY_MODULES if modules is None else modules
+
+    def run():
+        if delay > 0:
+            time.sleep(delay)
+        for name in modules:
+            try:
+                load(name, "warm up")
+            except ImportError:
+                pass
+
+    thread = threading.Thread(target=run, name="import-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def import_report(modules=None):
+    """Reports the import time of each heavy dependency
+
+        Args:
+            modules (list): The module names to report on, HEAVY_MODULES by default
+
+        Returns:
+            (list): the record of each module from ImportRecorder.report
+    """
+    return recorder.report(modules)
+
+
+def main():
+    """Prints how long importing the app takes and then how long each heavy dependency takes on first use:
+
+        python -m application.lazy_imports
+    """
+    start = time.perf_counter()
+    importlib.import_module("app")
+    app_seconds = time.perf_counter() - start
+
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    print("Importing app took {:.3f}s".format(app_seconds))
+    if len(loaded) > 0:
+        print("Loaded at start up: {}".format(", ".join(loaded)))
+
+    for name in HEAVY_MODULES:
+        load(name)
+    for record in import_report():
+        seconds = "-" if record["seconds"] is None else "{:.3f}s".format(record["seconds"])
+        print("    {:<40} {:>8} {}".format(record["module"], seconds, record["source"] or ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,200 @@
+import warnings
+from concurrent.futures import CancelledError
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.compose import ColumnTransformer
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import cross_val_score
+from sklearn.pipeline import Pipeline
+from sklearn.model_selection import check_cv
+from sklearn.preprocessing import StandardScaler
 
 from sklearn.exceptions import ConvergenceWarning
-from sklearn.utils._testing import ignore_warnings
+from application import instrumentation
 
+LR_N_JOBS = -1  # Number of processes used to cross validate the candidate features to drop, -1 for all cores
+STANDARDISE = True  # Standardise the features on the training rows of each fold (helps the solver converge)
+WARM_START = True  # Start each fit from the coefficients of the parent feature set in the same fold
 
-def cv_model(x, y, cv):
-    """ Helper function to do a cross validation and get the score
+
+def cv_columns(z, y, folds, columns, parent_coefs=None, parent_columns=None, sample_weight=None, scaling=None):
+    """ Cross validates a logistic regression on a subset of the columns using fold splits that were worked out
+    up front. When the coefficients of the parent column set are given each fold is warm started from them.
+    When the scaling of each fold is given the columns are standardised with the mean and scale of the training
+    rows of the fold, so the test rows of a fold never change how it is fitted.
 
        Args:
-           x (pandas.DataFrame): The data in a pandas dataframe
-           y (list like object): The response variable
-           cv (int): The number of cross validation folds to use
+           z (numpy array): The full design matrix
+           y (numpy array): The response variable
+           folds (list): The train and test row indexes of each fold
+           columns (list): The indexes of the columns to use
+           parent_coefs (list): The coefficients and intercept fitted in each fold on the parent columns
+           parent_columns (list): The indexes of the parent columns, a superset of columns
+           sample_weight (numpy array): Optional weight of each row, each fold is fitted and scored with them
+           scaling (list): Optional mean and scale of every column of the training rows of each fold
 
        Returns:
-           (float): The best cross validation score
+           (float): The average cross validation score
+           (list): The coefficients and intercept fitted in each fold
+           (int): The number of fits that didn't converge
         """
-
-    lr = LogisticRegression()
-    lr_scores = cross_val_score(lr, x, y, cv=cv)
-    av_score = sum(lr_scores) / len(lr_scores)
-    return av_score
-
-@ignore_warnings(category=ConvergenceWarning)
-def determine_best_model_probabilities(x, y, cv):
+    scores = []
+    coefs = []
+    not_converged = 0
+
+    # Position of each column within the parent columns so the parent coefficients can be reused
+    if parent_coefs is not None:
+        positions = [list(parent_columns).index(col) for col in columns]
+
+    for index, (train, test) in enumerate(folds):
+        train_weight = None if sample_weight is None else sample_weight[train]
+        test_weight = None if sample_weight is None else sample_weight[test]
+        lr = LogisticRegression(warm_start=parent_coefs is not None)
+        if parent_coefs is not None:
+            lr.coef_ = parent_coefs[index][0][:, positions].copy()
+            lr.intercept_ = parent_coefs[index][1].copy()
+
+        # Selecting the columns copies them so they can be standardised in place
+        train_z = z[np.ix_(train, columns)]
+        test_z = z[np.ix_(test, columns)]
+        if scaling is not None:
+            mean, scale = scaling[index]
+            for fold_z in (train_z, test_z):
+                fold_z -= mean[columns]
+                fold_z /= scale[columns]
+
+        # Count the fits that didn't converge instead of hiding the warnings
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ConvergenceWarning)
+            lr.fit(train_z, y[train], sample_weight=train_weight)
+        not_converged += len([w for w in caught if issubclass(w.category, ConvergenceWarning)])
+
+        scores.append(lr.score(test_z, y[test], sample_weight=test_weight))
+        coefs.append((lr.coef_, lr.intercept_))
+
+    av_score = sum(scores) / len(scores)
+    return av_score, coefs, not_converged
+
+
+def determine_best_model_probabilities(x, y, cv, n_jobs=LR_N_JOBS, standardise=STANDARDISE, warm_start=WARM_START,
+                                       report=None, cancel_event=None, return_model=False, compact=False,
+                                       sample_weight=None):
     """ Uses stepwise backward feature selection with a cross validation metric used for
     determining the best set of features
 
+    The fold splits are worked out once and shared by every fit, the candidate features to drop in each round
+    are cross validated in parallel processes and each fit can be warm started from the coefficients of the
+    feature set it was derived from.
+
     Args:
         x (pandas.DataFrame): The data in a pandas dataframe
         y (list like object): The response variable
         cv (int): The number of cross validation folds to use
+        n_jobs (int): The number of processes to cross validate the candidates in, -1 for all cores
+        standardise (bool): Standardise the features, each fold with the mean and scale of its training rows
+            and the final model with those of all the rows
+        warm_start (bool): Warm start each fit from the parent feature set's coefficients
+        report (dict): Optional dictionary that the selected features, fits that didn't converge and the
+            measurements of each round (lr_rounds) are recorded in
+        cancel_event (threading.Event): Optional event that stops the selection before the next batch of
+            candidates, each batch is one candidate for each process
+        return_model (bool): Also return the fitted model
+        compact (bool): Keep the design matrix shared by the fits in float32, each fit still solves in float64
+        sample_weight (numpy array): Optional number of times each row appears, every fit and cross validation
+            score counts each row that many times. The standardisation is not weighted.
 
     Returns:
         (float): The best cross validation score
         (list): List of probabilities for data belonging to best cluster
+        (sklearn.pipeline.Pipeline): The model that selects (and standardises) the best features of the encoded
+            data then predicts, only if return_model
     """
 
     # Get the current full list of features
-    feature_list = x.columns
+    feature_names = list(x.columns)
+    y = np.asarray(y)
+    if sample_weight is not None:
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
+
+    # Build the design matrix once
+    z = x.to_numpy(dtype=np.float32 if compact else np.float64)
+
+    # The same folds cross_val_score would use
+    folds = list(check_cv(cv, y, classifier=True).split(z, y))
+
+    # The scaling of each fold is fitted on its training rows only, the same as a scaler in a cross validated
+    # pipeline
+    scaling = None
+    if standardise:
+        scaling = []
+        for train, _ in folds:
+            scaler = StandardScaler().fit(z[train])
+            scaling.append((scaler.mean_.astype(z.dtype), scaler.scale_.astype(z.dtype)))
 
     # Determine score with all features
-    best_score = cv_model(x, y, cv)
+    feature_list = list(range(len(feature_names)))
+    with instrumentation.measure({"round": 0, "features": len(feature_list), "candidates": 1}) as record:
+        best_score, best_coefs, not_converged = cv_columns(z, y, folds, feature_list, sample_weight=sample_weight,
+                                                           scaling=scaling)
+    record["best_score"] = best_score
+    rounds = [record]
     best_list = feature_list.copy()
 
     # Perform stepwise backward feature selection process
     improved = True
+    parent_coefs = best_coefs if warm_start else None
     # Keep cycling while there is an improved score from removing one feature
     while improved is True and len(feature_list) > 1:
-
         improved = False
-        # Get the cv score by dropping one feature at a time
-        for feature in feature_list:
-            temp_list = [f for f in feature_list if f != feature]
-            score = cv_model(x[temp_list], y, cv)
+        # Get the cv score by dropping one feature at a time, the candidates are evaluated a batch at a time on
+        # the same processes
+        candidates = [[f for f in feature_list if f != feature] for feature in feature_list]
+        record = {"round": len(rounds), "features": len(feature_list), "candidates": len(candidates)}
+        results = []
+        with instrumentation.measure(record), Parallel(n_jobs=n_jobs) as parallel:
+            batch_size = effective_n_jobs(n_jobs)
+            for start in range(0, len(candidates), batch_size):
+
+                # Stop if another model has already made this one redundant
+                if cancel_event is not None and cancel_event.is_set():
+                    raise CancelledError()
+
+                results += parallel(
+                    delayed(cv_columns)(z, y, folds, temp_list, parent_coefs, feature_list, sample_weight,
+                                        scaling)
+                    for temp_list in candidates[start:start + batch_size])
+        rounds.append(record)
+
+        for temp_list, (score, coefs, round_not_converged) in zip(candidates, results):
+            not_converged += round_not_converged
 
             # If this score is better then keep the record of it and the
             # feature list
             if score > best_score:
                 best_score = score
                 best_list = temp_list
+                best_coefs = coefs
                 improved = True
 
         feature_list = best_list.copy()
+        parent_coefs = best_coefs if warm_start else None
+        record["best_score"] = best_score
 
-    # Build the model based on the feature list with the best score
-    lr = LogisticRegression()
-    lr.fit(x[feature_list], y)
+    # Build the model based on the feature list with the best score, selecting the columns by name so the
+    # model can be used on new data encoded the same way
+    selected_names = [feature_names[f] for f in feature_list]
+    select = ColumnTransformer([("features", StandardScaler() if standardise else "passthrough", selected_names)])
+    model = Pipeline([("select", select), ("lr", LogisticRegression())])
+    model.fit(x, y, lr__sample_weight=sample_weight)
 
     # Calculate the probabilities of belonging to the success class.
-    prob = lr.predict_proba(x[feature_list])
+    prob = model.predict_proba(x)
     prob_success = prob[:, 1]
 
-    return best_score, prob_success
-
-
-
-
-
-
-
+    if report is not None:
+        report["lr_features"] = selected_names
+        report["lr_not_converged"] = not_converged
+        report["lr_rounds"] = rounds
 
+    if return_model:
+        return best_score, prob_success, model
+    return best_score, prob_success
@@ -1,21 +1,62 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, CancelledError, Future, FIRST_COMPLETED, wait
 from io import BytesIO
-import gower
-from sklearn_extra.cluster import KMedoids
-from sklearn.metrics import silhouette_score
-from xlsxwriter import Workbook
-from application.file_manager import list_to_csv, csv_to_list, csv_to_list_from_bin_file
+from application.file_manager import list_to_csv, csv_to_list, csv_to_dataframe_from_bin_file, \
+    csv_chunks_from_bin_file
 from application.ga_adapter import get_data
-from application import logistic_regression_model
-from application import random_forest_model
+from application import gower_distance
+from application import instrumentation
+from application import lazy_imports
+from application import number_parser
+from application import stage_cache
 import pandas as pd
-from sklearn.impute import KNNImputer
 import numpy as np
+from joblib import Parallel, delayed
+
+# Slow to import and only needed once a model is built or exported, see lazy_imports
+logistic_regression_model = lazy_imports.lazy_module("application.logistic_regression_model")
+random_forest_model = lazy_imports.lazy_module("application.random_forest_model")
+clara = lazy_imports.lazy_module("application.clara")
+sklearn_extra_cluster = lazy_imports.lazy_module("sklearn_extra.cluster")
+sklearn_metrics = lazy_imports.lazy_module("sklearn.metrics")
+knn_imputation = lazy_imports.lazy_module("application.knn_imputation")
+xlsxwriter = lazy_imports.lazy_module("xlsxwriter")
 
 MAX_NULL_PERCENT = 0.1  # Maximum number of nulls allowed in feature before it is excluded
 MAX_VALUE_SET = 20  # Maximum number of values in a value set to prevent too many columns
 CROSS_VAL_FOLDS = 10  # Number of cross validation folds to use
 SUCCESS_VALUE = 100  # The value that indicates a success (client has vales from 0 to 100 with 100 being success)
 MIN_SUCCESS_PROPORTION = 0.05  # Minimum number of successes in data set required to build a robust model
+CANCEL_POLL_SECONDS = 0.5  # How often a cancel event is checked while waiting for the prediction models
+
+# The stages of build_and_predict in the order they run
+BUILD_STAGES = ["parse", "merge_google_analytics", "validate_types", "stripdown_features", "impute_nulls",
+                "encode_categorical", "collapse_duplicates", "gower_matrix", "cluster", "determine_target_cluster",
+                "best_model_probabilities", "rank"]
+
+# The earlier outputs a build loads from the cache as well as the output of the last cached stage when it resumes
+# from that stage, the stages after it use them. The response variable and contact details are cached apart
+# from the features so they can be loaded without the features.
+RESUME_NEEDS = {"response": ["validate_types"], "stripdown_features": ["response"], "impute_nulls": ["response"],
+                "encode_categorical": ["response"], "collapse_duplicates": ["response"],
+                "gower_matrix": ["collapse_duplicates", "response"], "cluster": ["collapse_duplicates", "response"]}
+CLARA_ROW_THRESHOLD = 10000  # Data sets with more rows than this are clustered on samples (CLARA) instead of in full
+MODEL_TIME_LIMIT = None  # Seconds the slower prediction model has to finish before it is cancelled, None to wait
+MODEL_N_JOBS = -1  # Number of cores shared by the prediction models, -1 for all cores
+K_SELECTION = "medoid"  # Silhouette used to choose k: "medoid", "precomputed" (Gower matrix) or "euclidean"
+CLUSTER_N_JOBS = -1  # Number of processes used to fit the different cluster counts, -1 for all cores
+PARALLEL_SWEEP_MIN_ROWS = 2000  # Data sets with fewer rows than this fit each cluster count in this process
+SHARED_MEMORY_MIN_BYTES = "1M"  # Arrays bigger than this are memory mapped to the sweep processes instead of copied
+SCORE_CHUNK_ROWS = 10000  # Number of rows scored at one time when scoring new data with a saved model
+PARSE_N_JOBS = -1  # Number of threads converting text columns to numbers, -1 for all cores
+COMPACT_DTYPES = False  # Build with float32 numbers, category text and uint8 one hot columns to use less memory
+COMPACT_PROB_TOLERANCE = 0.02  # Probabilities of a compact build are within this of a full precision build
+COLLAPSE_DUPLICATES = True  # Cluster and model each distinct row once, weighted by the number of times it appears
+
+# The formatting characters removed from the text of each type of number field before it is converted
+NUMBER_FORMATTING = {"Numeric": "", "Percentage": "%", "Money": "$,", "Response Variable": ""}
 
 
 def update_data_template(data_template_path, fields):
@@ -65,17 +106,52 @@ def update_data_template(data_template_path, fields):
         list_to_csv(current_fields, data_template_path)
 
 
-def validate_types(df, fields):
-    """ Validate and convert all data types used for modelling.
+def field_dtypes(fields):
+    """Chooses the dtype each column of an uploaded csv can be parsed straight into. The few values of Value Set
+    and Yes/No fields are parsed as categories so each row only stores a code, everything else is kept as a
+    string for validate_types to convert. Number fields stay strings so their bad cells are reported by
+    number_parser with the row and text of each one.
+
+        Args:
+            fields (list): The list of fields names and data types
+
+        Returns:
+            (dict): column name to dtype for the columns that don't need to stay as strings
+        """
+    category_types = ["Value Set", "Yes/No"]
+    return {x[0]: "category" for x in fields if x[1] in category_types}
+
+
+def validate_types(df, fields, percentage_scales=None, return_scales=False, n_jobs=PARSE_N_JOBS, compact=False):
+    """ Validate and convert all data types used for modelling. Number fields still stored as text are
+    converted by number_parser in one pass each, different fields at the same time.
 
         Args:
             df (pandas.DataFrame): The data in a pandas dataframe
             fields (list): The list of fields names and data types
+            percentage_scales (dict): Optional multiplier of each Percentage field found by a previous build, so
+                new data is scaled the same way instead of by its own range
+            return_scales (bool): Also return the multiplier used for each Percentage field
+            n_jobs (int): The number of threads converting text to numbers, -1 for all cores
+            compact (bool): Convert numbers to float32 and Value Set and Yes/No fields to categories
 
         Returns:
             (pandas.DataFrame): the modified dataframe with converted data types
+            (dict): the multiplier used for each Percentage field, only if return_scales
         """
 
+    scales = {}
+    number_dtype = np.float32 if compact else np.float64
+
+    # Convert the number fields that are still text
+    strips = {field_name: NUMBER_FORMATTING[field_type] for field_name, field_type in fields
+              if field_type in NUMBER_FORMATTING and df[field_name].dtype == object}
+    parsed = number_parser.parse_columns(df, strips, n_jobs)
+    for field_name, (numbers, bad) in parsed.items():
+        if bad.any():
+            raise number_parser.bad_cells_error(field_name, df[field_name].to_numpy(), bad)
+        df[field_name] = numbers
+
     # Go through each field and validate data based on the expected field type
     for field_info in fields:
 
@@ -93,29 +169,28 @@ def validate_types(df, fields):
         # Numeric fields are any type of number
         elif field_type == "Numeric":
 
-            # Might be sent as a string so convert to a float
-            if df[field_name].dtype == object:
-                df[field_name] = df[field_name].where(df[field_name] != '', np.nan)  #  Make sure we have a na for missing data
-                df[field_name] = df[field_name].astype(float)
+            # Text has already been converted to a float with a na for missing data
+            df[field_name] = df[field_name].astype(number_dtype)
 
         # Percentage field is a number between 0 and 1 or between 1 and 100
         elif field_type == "Percentage":
 
-            # Remove string representation of percentage
-            if df[field_name].dtype == object:
-                df[field_name] = df[field_name].str.replace("%", "")
-                df[field_name] = df[field_name].where(df[field_name] != '', np.nan)  #  Make sure we have a na for missing data
-
-                # Convert to a float
-                df[field_name] = df[field_name].astype(float)
+            # Text has already been converted to a float without the % sign
+            df[field_name] = df[field_name].astype(number_dtype)
 
             # Determine if this is represented by a number from 0 to 1 or from 1 to 100
             max_val = max(df[field_name])
             min_val = min(df[field_name])
 
-            # Multiply by 100 if values are between 0 and 1
-            if min_val >= 0 and max_val <= 1:
-                df[field_name] = df[field_name] * 100
+            # Multiply by 100 if values are between 0 and 1 or by the scale a previous build used
+            if percentage_scales is not None:
+                scales[field_name] = percentage_scales[field_name]
+            else:
+                scales[field_name] = 100 if min_val >= 0 and max_val <= 1 else 1
+            if scales[field_name] != 1:
+                df[field_name] = df[field_name] * scales[field_name]
+                max_val = max_val * scales[field_name]
+                min_val = min_val * scales[field_name]
 
             # Throw an error if values don't match percentage type
             if min_val < 0 or max_val > 100:
@@ -124,14 +199,8 @@ def validate_types(df, fields):
 
         # Some data is sent as a string with a $ sign but needs to be a number
         elif field_type == "Money":
-            # Remove string representation of money
-            if df[field_name].dtype == object:
-                df[field_name] = df[field_name].str.replace("$", "")
-                df[field_name] = df[field_name].str.replace(",", "")
-                df[field_name] = df[field_name].where(df[field_name] != '', np.nan)  #  Make sure we have a na for missing data
-
-            # Convert to a float
-            df[field_name] = df[field_name].astype(float)
+            # Text has already been converted to a float without the $ sign and thousands separators
+            df[field_name] = df[field_name].astype(number_dtype)
 
         # Value set is a selection of predefined text values
         elif field_type == "Value Set":
@@ -143,6 +212,10 @@ def validate_types(df, fields):
                 raise ValueError("The maximum number of values in a Value Set is {}. The field {} has {}."
                                  .format(MAX_VALUE_SET, field_type, unique))
 
+            # Each row only stores the code of its value
+            if compact:
+                df[field_name] = df[field_name].astype("category")
+
         # This is a boolean field but can also contain "No Data"
         elif field_type == "Yes/No":
             # Count how many unique values
@@ -153,17 +226,21 @@ def validate_types(df, fields):
                 raise ValueError("The maximum number of values in a Yes/No is 3. The field {} has {}."
                                  .format(field_type, unique))
 
+            if compact:
+                df[field_name] = df[field_name].astype("category")
+
         elif field_type == "Response Variable":
-            if df[field_name].dtype == object:
-                df[field_name] = df[field_name].str.replace('', '0')  # make sure we have a zero for missing data
-                df[field_name] = df[field_name].astype(float)
+            # Missing data is a zero
+            df[field_name] = df[field_name].astype(number_dtype).fillna(0)
 
+    if return_scales:
+        return df, scales
     return df
 
 
 def stripdown_features(df, fields):
     """This function splits the features and the response variable and removes columns that are not
-        suitable for modelling.
+        suitable for modelling. The features are the one copy of the data that the later steps change in place.
 
         Args:
             df (pandas.DataFrame): The data in a pandas dataframe
@@ -175,25 +252,13 @@ def stripdown_features(df, fields):
         """
 
     # Create a list of columns to drop
-    cols_to_drop = []
-
-    # Get the name of the response variable - should on be one otherwise throw error
-    response_field_names = [x[0] for x in fields if x[1] == "Response Variable"]
-    if len(response_field_names) != 1:
-        raise ValueError("There must only be one response variable marked for the data set.")
-    response_field_name = response_field_names[0]
-    cols_to_drop.append(response_field_name)
+    response_field_name, missing_response, y = response_variable(df, fields)
+    cols_to_drop = [response_field_name]
 
     # Drop any rows where response variable is missing - response variable is required
-    df = df.dropna(subset=[response_field_name])
-
-    # Assign the y series to the response variable
-    y = df[response_field_name]
-
-    # Reassign y as a success or fail - success is 100 because application is 100% complete
-    # Only if not in binary format
-    if np.all(sorted(y.unique()) != [0, 1]):
-        y = pd.Series(np.where(y >= SUCCESS_VALUE, 1, 0))
+    # Most files have none so only copy the rows when there are some
+    if missing_response.any():
+        df = df.take(np.flatnonzero(~missing_response))
 
     # Remove contact fields
     contact_fields = [x[0] for x in fields if x[1] == "Contact Details"]
@@ -228,16 +293,55 @@ def stripdown_features(df, fields):
     return new_df, y, fields
 
 
-def impute_nulls(df, fields):
+def response_variable(df, fields):
+    """Gets the response variable as a success or fail for the rows that have one
+
+        Args:
+            df (pandas.DataFrame): The data in a pandas dataframe
+            fields (list): The list of fields names and data types
+
+        Returns:
+            (string): the name of the response variable
+            (numpy array): True for each row that is missing the response variable
+            (pandas.Series): the response variable of the other rows, 1 for a success and 0 for a fail
+        """
+    # Get the name of the response variable - should on be one otherwise throw error
+    response_field_names = [x[0] for x in fields if x[1] == "Response Variable"]
+    if len(response_field_names) != 1:
+        raise ValueError("There must only be one response variable marked for the data set.")
+    response_field_name = response_field_names[0]
+
+    # Assign the y series to the response variable of the rows that have one
+    y = df[response_field_name]
+    missing_response = y.isna().to_numpy()
+    if missing_response.any():
+        y = y.take(np.flatnonzero(~missing_response))
+
+    # Reassign y as a success or fail - success is 100 because application is 100% complete
+    # Only if not in binary format
+    if np.all(sorted(y.unique()) != [0, 1]):
+        y = pd.Series(np.where(y >= SUCCESS_VALUE, 1, 0))
+
+    return response_field_name, missing_response, y
+
+
+def impute_nulls(df, fields, imputer=None, return_imputer=False, return_mean_filled=False):
     """This function fills missing categorical data iwth "No Data" and Imputes missing numerical data with
-    KNNImputer
+    the nearest complete rows (IndexedKNNImputer). The columns are replaced in df one at a time instead of
+    copying the whole dataframe.
 
         Args:
             df (pandas.DataFrame): The data in a pandas dataframe
             fields (list): The list of fields names and data types
+            imputer (IndexedKNNImputer): Optional imputer already fitted by a previous build to only transform with
+            return_imputer (bool): Also return the fitted imputer
+            return_mean_filled (bool): Also return the number of values filled with the column means instead of
+                from the nearest rows
 
         Returns:
-            (pandas.DataFrame): the new imputed dataframe with no missing values
+            (pandas.DataFrame): df with no missing values
+            (IndexedKNNImputer): the fitted imputer or None if there was nothing to impute, only if return_imputer
+            (int): the number of values filled with the column means, only if return_mean_filled
         """
 
     # Fill Value Set and the Yes/No data types with "No Data" as opposed to imputing categorical
@@ -247,9 +351,20 @@ def impute_nulls(df, fields):
     cat_types = ["Value Set", "Yes/No"]
     cat_columns = [x[0] for x in fields if x[1] in cat_types]
 
+    # Compact data keeps these as categories so only the categories are changed, not every row
+    category_columns = [col for col in cat_columns if pd.api.types.is_categorical_dtype(df[col])]
+    text_columns = [col for col in cat_columns if col not in category_columns]
+
     # Fill empty cells with NA then fill na with No Data
-    df[cat_columns] = df[cat_columns].replace(r'^\s*$', pd.NA, regex=True)
-    df[cat_columns] = df[cat_columns].fillna("No Data")
+    for col in text_columns:
+        df[col] = df[col].replace(r'^\s*$', pd.NA, regex=True).fillna("No Data")
+
+    for col in category_columns:
+        blanks = [value for value in df[col].cat.categories if isinstance(value, str) and value.strip() == ""]
+        values = df[col].cat.remove_categories(blanks)
+        if "No Data" not in values.cat.categories:
+            values = values.cat.add_categories("No Data")
+        df[col] = values.fillna("No Data")
 
     # Only impute Numeric, Percentage, Money columns
     valid_types = ["Numeric", "Percentage", "Money"]
@@ -259,39 +374,59 @@ def impute_nulls(df, fields):
     imputer_df = df[valid_columns]
 
     # Do nothing if no columns to impute
-    if imputer_df.shape[1] == 0:
-        return df
+    mean_filled = 0
+    if imputer_df.shape[1] > 0:
+
+        # Create a KNN Imputer with 6 neighbours and impute the values
+        # or only transform with the imputer from a previous build
+        if imputer is None:
+            imputer = knn_imputation.IndexedKNNImputer(n_neighbors=6)
+            results, mean_filled = imputer.fit_transform(imputer_df, return_mean_filled=True)
+        else:
+            results, mean_filled = imputer.transform(imputer_df, return_mean_filled=True)
 
-    # Create a KNN Imputer with 6 neighbours
-    imputer = KNNImputer(n_neighbors=6)
+        # Overwrite the imputed columns with the results while maintaining untouched columns
+        for index, col_name in enumerate(valid_columns):
+            df[col_name] = results[:, index]
 
-    # Impute the values
-    results = imputer.fit_transform(imputer_df)
+    returned = (df,)
+    if return_imputer:
+        returned += (imputer,)
+    if return_mean_filled:
+        returned += (mean_filled,)
+    return returned if len(returned) > 1 else df
 
-    # Covert back into a dataFrame so we maintain column mapping
-    results_df = pd.DataFrame(results, columns=imputer_df.columns)
 
-    # Overwrite the imputed columns with the results while maintaining untouched columns
-    new_df = pd.DataFrame()
-    for col_name in df.columns:
-        if col_name in results_df.columns:
-            new_df[col_name] = results_df[col_name]
-        else:
-            new_df[col_name] = df[col_name]
+def encoding_categories(x, fields):
+    """Gets the values of each categorical field (Value Set and Yes/No) so the same one hot encoded columns
+    can be made again for new data
+
+        Args:
+            x (pandas.DataFrame): The data in a pandas dataframe
+            fields (list): The list of fields names and data types
 
-    return new_df
+        Returns:
+            (dict): the sorted values of each categorical field
+        """
+    columns = [field[0] for field in fields if field[1] == "Value Set" or field[1] == "Yes/No"]
+    return {column: sorted(x[column].dropna().unique().tolist()) for column in columns}
 
 
-def encode_categorical(x, fields):
-    """Uses pandas get_dummies to encode categorical data (Value Set and Yes/No)
-    into more columns with  0 and 1
+def encode_categorical(x, fields, categories=None, compact=False):
+    """One hot encodes categorical data (Value Set and Yes/No) into columns with 0 and 1, named, ordered and
+    typed the same as pandas get_dummies. Each field is replaced in x by its encoded columns so nothing else
+    is copied: the categorical columns of the frame passed in are removed and it is the frame returned.
 
         Args:
-            x (pandas.DataFrame): The data in a pandas dataframe
+            x (pandas.DataFrame): The data in a pandas dataframe, changed in place
             fields (list): The list of fields names and data types
+            categories (dict): Optional values of each field from encoding_categories, every value gets a column
+                even if it isn't in x and values not in categories get no column
+            compact (bool): Make the encoded columns uint8 rather than the get_dummies default. They are kept
+                dense since the Gower distances and the models read whole columns.
 
         Returns:
-            (pandas.DataFrame): the new dataframe with encoded values
+            (pandas.DataFrame): x with the encoded columns
         """
 
     # Only encode fields that are Value Set or Yes/No
@@ -301,53 +436,464 @@ def encode_categorical(x, fields):
         if field[1] == "Value Set" or field[1] == "Yes/No":
             columns.append(field[0])
 
-    # Encode categorical variables
-    enc_df = pd.get_dummies(x, columns=columns, prefix=columns)
+    # Use the values of each field from a previous build so the encoded columns match
+    if categories is None:
+        categories = encoding_categories(x, fields)
+
+    # The encoded columns go after the other columns in the order of the fields
+    for column in columns:
+        dummies = pd.get_dummies(pd.Categorical(x[column], categories=categories[column]),
+                                 dtype=np.uint8 if compact else None)
+        del x[column]
+        for value in categories[column]:
+            x["{}_{}".format(column, value)] = dummies[value].to_numpy()
+
+    return x
+
+
+def collapse_duplicates(x):
+    """Collapses rows with the same encoded features into one row and counts how many times each appears.
+    Clustering and the prediction models only need the distinct rows with their counts as weights, and the
+    labels and probabilities of the distinct rows are spread back to every row with the returned rows.
+
+        Args:
+            x (pandas.DataFrame): The encoded features
+
+        Returns:
+            (pandas.DataFrame): the distinct rows in the order they first appear, with a new index
+            (numpy array): the number of times each distinct row appears or None if every row is distinct
+            (numpy array): the index of the distinct row of each row of x
+            (numpy array): the row of x each distinct row first appears in
+        """
+    # Rows are compared as float64 numbers, np.unique can't compare rows of an object array of mixed columns
+    _, first, inverse, counts = np.unique(x.to_numpy(dtype=np.float64), axis=0, return_index=True,
+                                          return_inverse=True, return_counts=True)
+
+    # np.unique sorts the rows, put them back in the order they first appear
+    order = np.argsort(first)
+    position = np.empty(len(order), dtype=np.intp)
+    position[order] = np.arange(len(order))
+    first_rows = first[order]
+    rows = position[inverse.ravel()]
+
+    if len(first_rows) == len(x):
+        return x, None, rows, first_rows
+    return x.iloc[first_rows].reset_index(drop=True), counts[order], rows, first_rows
+
+
+class FeaturePipeline:
+    """ The validate_types, stripdown_features, impute_nulls and encode_categorical steps of a build as one
+    object. It is fitted on the data of a build and then transforms new data the same way without refitting.
+    Each step changes the columns of the data in place so a build only copies the features once, when they
+    are split from the contact details in stripdown_features.
+    """
+
+    def __init__(self, fields, compact=False, n_jobs=PARSE_N_JOBS):
+        """Creates an unfitted pipeline
+
+            Args:
+                fields (list): The list of fields names and data types of the data
+                compact (bool): Use the compact dtypes, see validate_types
+                n_jobs (int): The number of threads converting text to numbers, -1 for all cores
+            """
+        self.fields = fields
+        self.compact = compact
+        self.n_jobs = n_jobs
+
+        # What is fitted by each step
+        self.percentage_scales = None
+        self.model_fields = None
+        self.imputer = None
+        self.categories = None
+        self.columns = None
+
+        # The number of values of the data it was fitted on that were filled with the column means
+        self.mean_filled_values = 0
+
+    def validate(self, df):
+        """Fits and applies validate_types
+
+            Args:
+                df (pandas.DataFrame): The data, changed in place
+
+            Returns:
+                (pandas.DataFrame): the data with converted data types
+            """
+        df, self.percentage_scales = validate_types(df, self.fields, return_scales=True, n_jobs=self.n_jobs,
+                                                    compact=self.compact)
+        return df
+
+    def strip(self, df):
+        """Fits and applies stripdown_features
+
+            Args:
+                df (pandas.DataFrame): The validated data
+
+            Returns:
+                (pandas.DataFrame): a copy of the features used for modelling
+                (pandas.Series): the response variable
+            """
+        x, y, self.model_fields = stripdown_features(df, self.fields)
+        return x, y
+
+    def impute(self, x):
+        """Fits and applies impute_nulls
+
+            Args:
+                x (pandas.DataFrame): The features, changed in place
+
+            Returns:
+                (pandas.DataFrame): the features with no missing values
+            """
+        x, self.imputer, self.mean_filled_values = impute_nulls(x, self.model_fields, return_imputer=True,
+                                                                return_mean_filled=True)
+        return x
+
+    def encode(self, x):
+        """Fits and applies encode_categorical
+
+            Args:
+                x (pandas.DataFrame): The imputed features, changed in place
+
+            Returns:
+                (pandas.DataFrame): the encoded features
+            """
+        self.categories = encoding_categories(x, self.model_fields)
+        x = encode_categorical(x, self.model_fields, self.categories, self.compact)
+        self.columns = list(x.columns)
+        return x
+
+    def fit_transform(self, df):
+        """Fits every step on the data of a build
+
+            Args:
+                df (pandas.DataFrame): The data with every field, changed in place
+
+            Returns:
+                (pandas.DataFrame): the encoded features
+                (pandas.Series): the response variable
+            """
+        x, y = self.strip(self.validate(df))
+        return self.encode(self.impute(x)), y
+
+    def fit(self, df):
+        """Fits every step on the data of a build
+
+            Args:
+                df (pandas.DataFrame): The data with every field, changed in place
+
+            Returns:
+                (FeaturePipeline): this pipeline
+            """
+        self.fit_transform(df)
+        return self
+
+    def transform(self, df):
+        """Prepares new data for the model using only what was fitted, nothing is refitted
+
+            Args:
+                df (pandas.DataFrame): The new data with at least the fields the model uses
+
+            Returns:
+                (pandas.DataFrame): the encoded features in the columns and order the model was fitted on
+            """
+        if self.model_fields is None:
+            raise ValueError("The pipeline must be fitted before it can transform data")
 
-    return enc_df
+        field_names = [field[0] for field in self.model_fields]
+        missing = [name for name in field_names if name not in df.columns]
+        if len(missing) > 0:
+            raise ValueError("The data is missing the fields the model uses: {}".format(", ".join(missing)))
 
+        if self.columns is None or self.categories is None:
+            raise ValueError("The pipeline must be fitted before it can transform data")
 
-def cluster(df, random_state=None):
+        # The one copy, imputed and encoded by row position so the index starts from 0
+        x = df.reindex(columns=field_names)
+        x.index = pd.RangeIndex(len(x))
+        x = validate_types(x, self.model_fields, percentage_scales=self.percentage_scales, n_jobs=self.n_jobs,
+                           compact=self.compact)
+        x = impute_nulls(x, self.model_fields, imputer=self.imputer)
+        x = encode_categorical(x, self.model_fields, self.categories, self.compact)
+
+        if list(x.columns) != self.columns:
+            x = x[self.columns]
+        return x
+
+
+def cluster(df, random_state=None, memory_budget=gower_distance.GOWER_MEMORY_BUDGET, scratch_path=None,
+            mode=None, strata=None, report=None, k_selection=K_SELECTION, n_jobs=CLUSTER_N_JOBS, weights=None,
+            matrix=None):
     """Use Gower distances and K Medioids to cluster the data from between 2 to 8 clusters.
     Uses silhouette analysis to determine optimal number of clusters
 
+    Data sets larger than CLARA_ROW_THRESHOLD are clustered in "clara" mode, where the medoids are fitted on
+    samples and every row is assigned to its nearest medoid, instead of "full" mode on the n2 distance matrix.
+
+    The silhouette used to choose k is set with k_selection:
+        "medoid" - simplified silhouette from the Gower distances of each row to the medoids, O(n.k)
+        "precomputed" - exact silhouette on the Gower distance matrix (on a sample in clara mode)
+        "euclidean" - silhouette on euclidean distances of the features (on a sample in clara mode)
+
         Args:
             df (pandas.DataFrame): The data in a pandas dataframe
             random_state (int): Can be sued to fix the random state - ideal for testing
+            memory_budget (int): Bytes of working memory allowed when calculating the distance matrix
+            scratch_path (string): Optional file path to memory map the distance matrix to
+            mode (string): "full" or "clara", or None to choose based on the number of rows
+            strata (numpy array): Optional label for each row to stratify the clara samples by
+            report (dict): Optional dictionary that the clustering mode, cluster count, medoid row indexes and
+                the measurements of each k (cluster_k) are recorded in
+            k_selection (string): "medoid", "precomputed" or "euclidean" silhouette to choose k with
+            n_jobs (int): The number of processes to fit the cluster counts in, -1 for all cores
+            weights (numpy array): Optional number of times each row appears, from collapse_duplicates. The
+                medoids and silhouettes count each row that many times.
+            matrix (numpy array): Optional Gower distance matrix of the data that was already calculated, it is
+                used in "full" mode and left for the caller to release
 
         Returns:
             (array): an array of the cluster assignments
             (int): the number of clusters used
         """
-    # Compute the Gower distance matrix
-    # NOTE:large datasets will cause slow processing since array size is n2
-    matrix = gower.gower_matrix(df)
+    if mode is None:
+        mode = "clara" if df.shape[0] > CLARA_ROW_THRESHOLD else "full"
+
+    if k_selection not in ["medoid", "precomputed", "euclidean"]:
+        raise ValueError("Unknown k selection criterion {}".format(k_selection))
+
+    if mode == "clara":
+        labels, cluster_count, medoids, details = cluster_samples(df, random_state, memory_budget, strata,
+                                                                  k_selection, n_jobs, weights)
+    elif mode == "full":
+        labels, cluster_count, medoids, details = cluster_full(df, random_state, memory_budget, scratch_path,
+                                                               k_selection, n_jobs, weights, matrix)
+    else:
+        raise ValueError("Unknown clustering mode {}".format(mode))
+
+    if report is not None:
+        report["cluster_mode"] = mode
+        report["cluster_count"] = cluster_count
+        report["k_selection"] = k_selection
+        report["medoids"] = [int(index) for index in medoids]
+        report.update(details)
+
+    return labels, cluster_count
+
+
+def cluster_full(df, random_state=None, memory_budget=gower_distance.GOWER_MEMORY_BUDGET, scratch_path=None,
+                 k_selection=K_SELECTION, n_jobs=CLUSTER_N_JOBS, weights=None, matrix=None):
+    """Clusters the data with K Medoids on the full Gower distance matrix for 2 to 8 clusters and
+    uses silhouette analysis to determine optimal number of clusters. Each k is fitted in a separate
+    process and the distance matrix is shared with the processes through a memory map.
+    Both KMedoids and, for weighted rows, clara.weighted_k_medoids use the Gower matrix as precomputed
+    distances so duplicates collapsed into weights are clustered the same way as the repeated rows.
+
+        Args:
+            df (pandas.DataFrame): The data in a pandas dataframe
+            random_state (int): Can be sued to fix the random state - ideal for testing
+            memory_budget (int): Bytes of working memory allowed when calculating the distance matrix
+            scratch_path (string): Optional file path to memory map the distance matrix to
+            k_selection (string): "medoid", "precomputed" or "euclidean" silhouette to choose k with
+            n_jobs (int): The number of processes to fit in, -1 for all cores
+            weights (numpy array): Optional number of times each row appears
+            matrix (numpy array): Optional Gower distance matrix of the data that was already calculated, it is
+                left for the caller to release
+
+        Returns:
+            (array): an array of the cluster assignments
+            (int): the number of clusters used
+            (array): the row indexes of the medoids
+            (dict): the measurements of each k to add to the report
+        """
+    details = {}
+
+    # Compute the Gower distance matrix in float32 blocks
+    # NOTE: the matrix is still n2 in size so large matrices are spilled to a scratch file
+    release = matrix is None
+    if release:
+        with instrumentation.measure({"shape": [df.shape[0], df.shape[0]]}) as gower_record:
+            matrix = gower_distance.gower_matrix(df, memory_budget=memory_budget, scratch_path=scratch_path)
+        details["gower_matrix"] = gower_record
+
+    # Features are only needed for the euclidean silhouette
+    x = df.to_numpy(dtype=np.float64) if k_selection == "euclidean" else None
 
     # Use silhouette analysis to determine the optimal number of clusters
-    # between 2 and 8 clusters
-    res = []
-    for k in range(2, 9):
+    # between 2 and 8 clusters (must have enough samples ie. k-1)
+    ks = [k for k in range(2, 9) if k < len(matrix) - 1]
+    # Each k is measured in its worker
+    res = Parallel(n_jobs=sweep_jobs(df.shape[0], n_jobs), max_nbytes=SHARED_MEMORY_MIN_BYTES)(
+        delayed(instrumentation.measured)(score_k_full, matrix, x, k, random_state, k_selection, weights)
+        for k in ks)
+
+    # Best cluster has the value closest to 1 from the range -1 to 1
+    # The labels of the best fit are kept so there is no need to refit
+    best_cluster = max([result for result, _ in res], key=lambda x: x[1])
+
+    # Remove the scratch file if the matrix was spilled to disk
+    if release:
+        gower_distance.release_matrix(matrix)
+
+    details["cluster_k"] = k_records(res)
+    return best_cluster[2], best_cluster[0], best_cluster[3], details
 
-        #must have enough samples ie. k-1
-        if k < len(matrix) - 1:
-            k_medoids = KMedoids(n_clusters=k, random_state=random_state).fit(matrix)
 
-            # Catch exceptions here and set the score to -1 (worst)
-            try:
-                silhouette_avg = silhouette_score(df, k_medoids.labels_)
-                res.append([k, silhouette_avg])
+def score_k_full(matrix, x, k, random_state, k_selection, weights=None):
+    """Fits K Medoids with k clusters on the full distance matrix and scores it with the silhouette.
+    This runs in a worker process of the k sweep.
 
-            # If only one cluster causes an error so give worst score to this k
-            except ValueError:
-                res.append([k, -1])
+        Args:
+            matrix (numpy array): The Gower distance matrix
+            x (numpy array): The features, only needed for the euclidean silhouette
+            k (int): The number of clusters
+            random_state (int): Can be used to fix the random state
+            k_selection (string): "medoid", "precomputed" or "euclidean" silhouette to score with
+            weights (numpy array): Optional number of times each row appears
+
+        Returns:
+            (list): k, the silhouette score, the cluster labels and the medoid row indexes
+        """
+    if weights is None:
+        k_medoids = sklearn_extra_cluster.KMedoids(n_clusters=k, metric="precomputed",
+                                                   random_state=random_state).fit(matrix)
+        labels, medoids = k_medoids.labels_, k_medoids.medoid_indices_
+    else:
+        labels, medoids = clara.weighted_k_medoids(matrix, k, weights)
+
+    # Catch exceptions here and set the score to -1 (worst)
+    try:
+        if k_selection == "medoid":
+            medoid_distances = matrix[:, medoids]
+            silhouette_avg = clara.simplified_silhouette(medoid_distances, labels, weights)
+        elif weights is not None:
+            if k_selection == "precomputed":
+                distances = matrix
+            else:
+                distances = sklearn_metrics.pairwise_distances(x)
+            silhouette_avg = clara.weighted_silhouette(distances, labels, weights)
+        elif k_selection == "precomputed":
+            silhouette_avg = sklearn_metrics.silhouette_score(matrix, labels, metric="precomputed")
+        else:
+            silhouette_avg = sklearn_metrics.silhouette_score(x, labels)
+        return [k, silhouette_avg, labels, medoids]
+
+    # If only one cluster causes an error so give worst score to this k
+    except ValueError:
+        return [k, -1, labels, medoids]
+
+
+def cluster_samples(df, random_state=None, memory_budget=gower_distance.GOWER_MEMORY_BUDGET, strata=None,
+                    k_selection=K_SELECTION, n_jobs=CLUSTER_N_JOBS, weights=None):
+    """Clusters the data with CLARA for 2 to 8 clusters so the distance matrix is never bigger than a sample.
+    Uses silhouette analysis on a sample to determine optimal number of clusters. Each k is fitted in a
+    separate process.
+
+        Args:
+            df (pandas.DataFrame): The data in a pandas dataframe
+            random_state (int): Can be sued to fix the random state - ideal for testing
+            memory_budget (int): Bytes of working memory allowed when assigning rows to medoids
+            strata (numpy array): Optional label for each row to stratify the samples by
+            k_selection (string): "medoid", "precomputed" or "euclidean" silhouette to choose k with
+            n_jobs (int): The number of processes to fit in, -1 for all cores
+            weights (numpy array): Optional number of times each row appears
+
+        Returns:
+            (array): an array of the cluster assignments
+            (int): the number of clusters used
+            (array): the row indexes of the medoids
+            (dict): the measurements of each k to add to the report
+        """
+    # Prepare the features once for every k
+    features = gower_distance.GowerFeatures(df)
+
+    # Use the same sample to score every k with the sampled silhouettes
+    sample_size = min(clara.CLARA_SAMPLE_SIZE, df.shape[0])
+    sample = clara.stratified_sample(df.shape[0], sample_size, strata, random_state)
+    sample_matrix = features.distances(sample, sample) if k_selection == "precomputed" else None
+    sample_x = df.iloc[sample].to_numpy(dtype=np.float64) if k_selection == "euclidean" else None
+
+    # Keep the labels of each k so the best doesn't need to be refit
+    # (must have enough samples ie. k-1)
+    ks = [k for k in range(2, 9) if k < df.shape[0] - 1]
+    res = Parallel(n_jobs=sweep_jobs(df.shape[0], n_jobs), max_nbytes=SHARED_MEMORY_MIN_BYTES)(
+        delayed(instrumentation.measured)(score_k_samples, features, k, strata, random_state, memory_budget,
+                                          k_selection, sample, sample_matrix, sample_x, weights) for k in ks)
 
     # Best cluster has the value closest to 1 from the range -1 to 1
-    best_cluster = max(res, key=lambda x: x[1])
+    best_cluster = max([result for result, _ in res], key=lambda x: x[1])
+
+    return best_cluster[2], best_cluster[0], best_cluster[3], {"cluster_k": k_records(res)}
+
+
+def k_records(res):
+    """Combines the score of each k in a sweep with its measurements
+
+        Args:
+            res (list): The result and measurements of each k
+
+        Returns:
+            (list): a record of k, the silhouette and the measurements for each k
+        """
+    return [dict(record, k=result[0], silhouette=float(result[1])) for result, record in res]
+
+
+def score_k_samples(features, k, strata, random_state, memory_budget, k_selection, sample, sample_matrix, sample_x,
+                    weights=None):
+    """Fits CLARA with k clusters and scores it with the silhouette. This runs in a worker process of the k sweep.
+
+        Args:
+            features (GowerFeatures): The prepared features of the full data
+            k (int): The number of clusters
+            strata (numpy array): Optional label for each row to stratify the samples by
+            random_state (int): Can be used to fix the random state
+            memory_budget (int): Bytes of working memory allowed when assigning rows to medoids
+            k_selection (string): "medoid", "precomputed" or "euclidean" silhouette to score with
+            sample (numpy array): The rows the sampled silhouettes are calculated on
+            sample_matrix (numpy array): The Gower distances of the sample for the precomputed silhouette
+            sample_x (numpy array): The features of the sample for the euclidean silhouette
+            weights (numpy array): Optional number of times each row appears
 
-    # Refit with the best number of clusters
-    k_medoids = KMedoids(n_clusters=best_cluster[0], random_state=random_state).fit(matrix)
+        Returns:
+            (list): k, the silhouette score, the cluster labels and the medoid row indexes
+        """
+    labels, medoids, cost = clara.clara(None, k, strata=strata, random_state=random_state,
+                                        memory_budget=memory_budget, features=features, weights=weights)
+
+    # Score on medoid distances or on a sample since the full silhouette is n2
+    try:
+        if k_selection == "medoid":
+            medoid_distances = clara.medoid_distances(features, medoids, memory_budget)
+            silhouette_avg = clara.simplified_silhouette(medoid_distances, labels, weights)
+        elif weights is not None:
+            if k_selection == "precomputed":
+                distances = sample_matrix
+            else:
+                distances = sklearn_metrics.pairwise_distances(sample_x)
+            silhouette_avg = clara.weighted_silhouette(distances, labels[sample], weights[sample])
+        elif k_selection == "precomputed":
+            silhouette_avg = sklearn_metrics.silhouette_score(sample_matrix, labels[sample], metric="precomputed")
+        else:
+            silhouette_avg = sklearn_metrics.silhouette_score(sample_x, labels[sample])
+        return [k, silhouette_avg, labels, medoids]
 
-    return k_medoids.labels_, best_cluster[0]
+    # If only one cluster causes an error so give worst score to this k
+    except ValueError:
+        return [k, -1, labels, medoids]
+
+
+def sweep_jobs(n_rows, n_jobs):
+    """Decides how many processes the k sweep should use, small data sets are quicker in this process
+
+        Args:
+            n_rows (int): The number of rows being clustered
+            n_jobs (int): The requested number of processes, -1 for all cores
+
+        Returns:
+            (int): the number of processes
+        """
+    if n_rows < PARALLEL_SWEEP_MIN_ROWS:
+        return 1
+    return min(gower_distance.resolve_n_jobs(n_jobs), 7)
 
 
 def determine_target_cluster(success_labels, cluster_labels, cluster_count):
@@ -387,36 +933,164 @@ def determine_target_cluster(success_labels, cluster_labels, cluster_count):
     return cluster_index
 
 
-def best_model_probabilities(x, cluster_labels, target_cluster, cv=CROSS_VAL_FOLDS, random_state=None):
+def best_model_probabilities(x, cluster_labels, target_cluster, cv=CROSS_VAL_FOLDS, random_state=None,
+                             time_limit=MODEL_TIME_LIMIT, n_jobs=MODEL_N_JOBS, rf_search=None,
+                             report=None, cancel_event=None, return_model=False, cache=None, cache_key=None,
+                             compact=False, sample_weight=None):
     """Optimises a logistic regression model and a random forest model to determine which has the best
     cross validation score. The best model is used to predict the probabilities that a customer
     belongs to the cluster with the highest success in application completions
 
+    Both models are trained at the same time with the cores split between them. Once one model has finished
+    the other is cancelled if it can no longer win or if it doesn't finish within the time limit.
+
         Args:
             x (Pandas.DataFroma): The features
             cluster_labels (numpy array): the cluster labelling
             target_cluster (int): the cluster with the highes % application completions
             cv (int): the number of cross validation folds
             random_state (int): The random seed can be used for testing for consistent results
+            time_limit (float): Seconds the slower model has from the start to finish, None to always wait
+            n_jobs (int): The number of cores to share between the models, -1 for all cores
+            rf_search (string): The random forest search "grid", "halving" or "oob", None for RF_SEARCH
+            report (dict): Optional dictionary that the model scores and the chosen model are recorded in
+            cancel_event (threading.Event): Optional event that cancels both models when set
+            return_model (bool): Also return the chosen model
+            cache (StageCache): Optional cache of each model search, only searches that finish are cached
+            cache_key (string): The key of the clustering stage the searches are cached on
+            compact (bool): Give the models float32 copies of the features
+            sample_weight (numpy array): Optional number of times each row appears, from collapse_duplicates
 
         Returns:
             (list): the probabilities that a customer belongs to the cluster with the highest success
+            (object): the chosen fitted model that predicts from the encoded features, only if return_model
         """
 
     # Adjust the response variable to be either 1 belongs to target cluster or 0 does not belong
     y = np.where(cluster_labels == target_cluster, 1, 0)
 
-    # Try the logistic regression model
-    lr_score, lr_prob = logistic_regression_model.determine_best_model_probabilities(x, y, cv)
-
-    # Try the Random forest model
-    rf_score, rf_prob = random_forest_model.determine_best_model_probabilities(x, y, cv, random_state)
+    if rf_search is None:
+        rf_search = random_forest_model.RF_SEARCH
+
+    # Split the cores between the models so they don't oversubscribe the CPU
+    cores = gower_distance.resolve_n_jobs(n_jobs)
+    lr_jobs = max(1, cores // 2)
+    rf_jobs = max(1, cores - lr_jobs)
+
+    # Setting the event stops whichever model is still running
+    stop_event = threading.Event()
+    start = time.monotonic()
+
+    # Each search records its details in its own report so they can be cached with its result
+    def run_lr():
+        search_report = {}
+        result = logistic_regression_model.determine_best_model_probabilities(
+            x, y, cv, n_jobs=lr_jobs, report=search_report, cancel_event=stop_event, return_model=True,
+            compact=compact, sample_weight=sample_weight)
+        return result + (search_report,)
+
+    def run_rf():
+        search_report = {}
+        result = random_forest_model.determine_best_model_probabilities(
+            x, y, cv, random_state, search=rf_search, report=search_report, n_jobs=rf_jobs,
+            cancel_event=stop_event, return_model=True, compact=compact, sample_weight=sample_weight)
+        return result + (search_report,)
+
+    searches = {
+        "lr": (run_lr, [cv, target_cluster, logistic_regression_model.STANDARDISE]),
+        "rf": (run_rf, [cv, target_cluster, random_state, rf_search, random_forest_model.PARAM_GRID,
+                        random_forest_model.RF_BUDGET])
+    }
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        # Try the logistic regression model and the random forest model at the same time
+        # unless a search has already been cached
+        futures = {}
+        search_keys = {}
+        for name, (search, params) in searches.items():
+            if cache is not None and cache_key is not None:
+                search_keys[name] = cache.key(name + "_search", cache_key, params)
+                hit, value = cache.get(search_keys[name])
+                if hit:
+                    futures[name] = Future()
+                    futures[name].set_result(value)
+                    search_keys[name] = None
+                    if report is not None:
+                        report.setdefault("cached_stages", []).append(name + "_search")
+                    continue
+            futures[name] = executor.submit(search)
+
+        done = wait_or_cancel(futures.values(), FIRST_COMPLETED, None, cancel_event)
+        first = "lr" if futures["lr"] in done else "rf"
+        second = "rf" if first == "lr" else "lr"
+        results = {first: futures[first].result()}
+        first_score = results[first][0]
+
+        # The random forest only wins with a higher score so it can't beat a perfect logistic regression
+        if not (first == "lr" and first_score >= 1):
+            timeout = None if time_limit is None else max(0.0, time_limit - (time.monotonic() - start))
+            done = wait_or_cancel([futures[second]], FIRST_COMPLETED, timeout, cancel_event)
+            if futures[second] in done:
+                results[second] = futures[second].result()
+    finally:
+        # Cancel anything still running and wait for it to stop at its next check so its processes aren't
+        # still busy after this returns
+        stop_event.set()
+        executor.shutdown(wait=True)
+
+    # Cache the searches that finished and add their details to the report
+    for name, result in results.items():
+        if search_keys.get(name) is not None:
+            cache.put(search_keys[name], result)
+        if report is not None:
+            report.update(result[3])
+
+    lr_score, lr_prob, lr_model, _ = results.get("lr", (None, None, None, None))
+    rf_score, rf_prob, rf_model, _ = results.get("rf", (None, None, None, None))
 
     # Determine the best one and return the probabilities
-    if rf_score > lr_score:
-        return rf_prob
+    if lr_score is None or (rf_score is not None and rf_score > lr_score):
+        best = "rf"
     else:
-        return lr_prob
+        best = "lr"
+
+    if report is not None:
+        report["lr_score"] = lr_score
+        report["rf_score"] = rf_score
+        report["best_model"] = best
+        report["cancelled_model"] = None if second in results else second
+
+    if return_model:
+        return (rf_prob, rf_model) if best == "rf" else (lr_prob, lr_model)
+    return rf_prob if best == "rf" else lr_prob
+
+
+def wait_or_cancel(futures, return_when, timeout, cancel_event):
+    """Waits for futures like concurrent.futures.wait but raises CancelledError as soon as the cancel event is set
+
+        Args:
+            futures (list): The futures to wait for
+            return_when (string): When to return eg. FIRST_COMPLETED
+            timeout (float): The maximum seconds to wait or None to wait until done
+            cancel_event (threading.Event): Event that cancels the wait, or None
+
+        Returns:
+            (set): the futures that are done
+        """
+    if cancel_event is None:
+        return wait(futures, timeout=timeout, return_when=return_when)[0]
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        poll = CANCEL_POLL_SECONDS if deadline is None else min(CANCEL_POLL_SECONDS, deadline - time.monotonic())
+        done, pending = wait(futures, timeout=max(0.0, poll), return_when=return_when)
+        if cancel_event.is_set():
+            raise CancelledError()
+        if len(done) > 0 and (return_when == FIRST_COMPLETED or len(pending) == 0):
+            return done
+        if deadline is not None and time.monotonic() >= deadline:
+            return done
 
 
 def merge_google_analytics(df, fields, ga_profile_id, ga_cred_file_location):
@@ -451,10 +1125,8 @@ def merge_google_analytics(df, fields, ga_profile_id, ga_cred_file_location):
 
     # Convert into a dataframe
     cols = ["GA Merge Variable", "User Type", "Session Count", "Session Duration"]
-    ga_df = pd.DataFrame(columns=cols)
     # Exclude the last column as this is just user_count metric
-    for row in results["rows"]:
-        ga_df = ga_df.append(pd.Series(row[:-1], index=cols), ignore_index=True)
+    ga_df = pd.DataFrame([row[:-1] for row in results.get("rows", [])], columns=cols)
 
     # Merge the data frame on the merge variable ie. user id
     df = pd.merge(df, ga_df, how="left", left_on=[merge_field], right_on=["GA Merge Variable"])
@@ -468,7 +1140,8 @@ def merge_google_analytics(df, fields, ga_profile_id, ga_cred_file_location):
     return df, fields
 
 
-def build_and_predict(file, data_template_path, fields, ga_profile_id, ga_cred_file_location = None):
+def build_and_predict(file, data_template_path, fields, ga_profile_id, ga_cred_file_location = None, report=None,
+                      progress=None, cancel_event=None, registry=None, cache=None, compact=COMPACT_DTYPES):
     """This function starts by updating the data_templates with new field names if the exist
         then builds the model then predicts what are the best customers to follow up on
 
@@ -478,72 +1151,319 @@ def build_and_predict(file, data_template_path, fields, ga_profile_id, ga_cred_f
             fields (list): The list of fields names and data types
             ga_profile_id (string): string representing the Google Analytics profile id to use or '0' for none
             ga_cred_file_location (string): storage location of the google analytics credentials file
+            report (dict): Optional dictionary that details of how the model was built are recorded in
+            progress (function): Optional callback that is passed the name of each stage in BUILD_STAGES as it
+                starts, it can raise an exception to stop the build
+            cancel_event (threading.Event): Optional event that cancels the prediction model search when set
+            registry (ModelRegistry): Optional registry to save the fitted pipeline in, the version is recorded in
+                the report as model_version
+            cache (StageCache): Optional cache of the output of each stage, the stages served from the cache are
+                recorded in the report as cached_stages
+            compact (bool): Carry the data as float32 numbers, categories and uint8 one hot columns, the
+                probabilities are within COMPACT_PROB_TOLERANCE of a full precision build
+
+        The wall time, cpu time, peak memory and input and output shapes of each stage are recorded in the report
+        as stages, with the measurements of each k, stepwise round and random forest candidate as cluster_k,
+        lr_rounds and rf_candidates. The number of missing numbers filled with the column means rather than
+        from the nearest rows is recorded as mean_filled_values and the number of distinct feature rows that
+        were clustered and modelled as distinct_rows.
 
         Returns:
             list: a list of customers and contact details
         """
 
-    # Update data templates
-    update_data_template(data_template_path, fields)
+    # Report each stage as it starts
+    if progress is None:
+        progress = lambda stage: None
 
-    # Get the names of the fields
-    field_names = [x[0] for x in fields]
-    contact_fields = [x[0] for x in fields if x[1] == "Contact Details"]
+    # The saved model is described by what is recorded in the report
+    if report is None:
+        report = {}
+    uploaded_fields = fields
+    report["compact"] = compact
 
-    # Throw an error if we don't have any contact details
-    if len(contact_fields) == 0:
-        raise ValueError("The supplied data must have at least one field marked as \
-        Contact Details to identify customers")
+    # Measure each stage as well as reporting it as it starts
+    timer = instrumentation.StageTimer(report)
 
-    # Get the file contents as a dataframe
-    data = csv_to_list_from_bin_file(file, header=False)
-    df = pd.DataFrame(data, columns=field_names)
+    def start_stage(stage, *inputs):
+        timer.start(stage, *inputs)
+        progress(stage)
 
-    # Merge data from Google Analytics if selected
-    if ga_profile_id != '0' and ga_cred_file_location is not None:
-        df, fields = merge_google_analytics(df, fields, ga_profile_id, ga_cred_file_location)
+    # A stage that raises is still closed so its memory sampling stops
+    try:
+        # Update data templates
+        update_data_template(data_template_path, fields)
 
-    # Convert data columns to correct type and check all types are valid
-    df = validate_types(df, fields)
+        # Get the names of the fields
+        field_names = [x[0] for x in fields]
+        contact_fields = [x[0] for x in fields if x[1] == "Contact Details"]
 
-    # Determine what features to remove (if String type or if too many nulls)
-    x, y, fields = stripdown_features(df, fields)
+        # Throw an error if we don't have any contact details
+        if len(contact_fields) == 0:
+            raise ValueError("The supplied data must have at least one field marked as \
+        Contact Details to identify customers")
 
-    # Make sure we have a number of successes to be able to run model
-    if len(y[y == 1]) / len(y) < MIN_SUCCESS_PROPORTION:
-        raise ValueError("There needs to be a minimum of {0:.0f}% completed applications\
+        # Each cached stage is keyed on the key of the stage before it, starting with the file contents. The keys
+        # are worked out up front so a build resumes from the last stage in the cache without loading the others.
+        use_google_analytics = ga_profile_id != '0' and ga_cred_file_location is not None
+        resume = stage_cache.Resume({}, [], {})
+        if cache is not None:
+            stages = [("parse", [field_names, field_dtypes(fields)])]
+
+            # The Google Analytics data changes over time so nothing after it can be cached
+            if not use_google_analytics:
+                stages += [("validate_types", [fields, MAX_VALUE_SET, compact]),
+                           ("response", [fields, SUCCESS_VALUE]),
+                           ("stripdown_features", [fields, MAX_NULL_PERCENT]),
+                           ("impute_nulls", [knn_imputation.KNN_NEIGHBOURS, knn_imputation.STATISTIC_MIN_ROWS,
+                                             knn_imputation.MAX_DONOR_ROWS]),
+                           ("encode_categorical", []),
+                           ("collapse_duplicates", [COLLAPSE_DUPLICATES]),
+                           ("gower_matrix", [CLARA_ROW_THRESHOLD]),
+                           ("cluster", [K_SELECTION, CLARA_ROW_THRESHOLD, clara.CLARA_SAMPLES,
+                                        clara.CLARA_SAMPLE_SIZE])]
+            resume = cache.resume(cache.chain(cache.file_key(file), stages), RESUME_NEEDS)
+
+        # The outputs of skipped stages are never used
+        df = x = matrix = None
+
+        # Stream the file contents into a dataframe, parsing value sets directly into categories
+        start_stage("parse")
+        if not skip_stage("parse", resume, report):
+            df = run_stage(cache, "parse", resume, report,
+                           lambda: csv_to_dataframe_from_bin_file(file, field_names, field_dtypes(fields),
+                                                                  skip_header=True))
+        timer.finish(df)
+
+        # Merge data from Google Analytics if selected
+        start_stage("merge_google_analytics", df)
+        if use_google_analytics:
+            df, fields = merge_google_analytics(df, fields, ga_profile_id, ga_cred_file_location)
+        timer.finish(df)
+
+        # Validate, strip, impute and encode are the steps of a pipeline that is saved with the model
+        # Each of them is cached with the pipeline fitted so far
+        pipeline = FeaturePipeline(fields, compact)
+
+        # Convert data columns to correct type and check all types are valid
+        start_stage("validate_types", df)
+        if not skip_stage("validate_types", resume, report):
+            df, pipeline = run_stage(cache, "validate_types", resume, report,
+                                     lambda: (pipeline.validate(df), pipeline))
+        timer.finish(df)
+
+        # Determine what features to remove (if String type or if too many nulls)
+        start_stage("stripdown_features", df)
+        y, contacts = run_stage(cache, "response", resume, report,
+                                lambda: (response_variable(df, fields)[2], df[contact_fields]))
+        if not skip_stage("stripdown_features", resume, report):
+            x, pipeline = run_stage(cache, "stripdown_features", resume, report,
+                                    lambda: (pipeline.strip(df)[0], pipeline))
+        timer.finish(x, y)
+
+        # Make sure we have a number of successes to be able to run model
+        if len(y[y == 1]) / len(y) < MIN_SUCCESS_PROPORTION:
+            raise ValueError("There needs to be a minimum of {0:.0f}% completed applications\
          in the data set to build a robust model."
-                         .format(MIN_SUCCESS_PROPORTION*100))
+                             .format(MIN_SUCCESS_PROPORTION*100))
+
+        # Fill missing Categorical data with "No Data" and use the nearest complete rows for numerical data
+        start_stage("impute_nulls", x)
+        if not skip_stage("impute_nulls", resume, report):
+            x, pipeline = run_stage(cache, "impute_nulls", resume, report, lambda: (pipeline.impute(x), pipeline))
+        timer.finish(x)
+
+        # One hot encode categorical variables
+        start_stage("encode_categorical", x)
+        if not skip_stage("encode_categorical", resume, report):
+            x, pipeline = run_stage(cache, "encode_categorical", resume, report,
+                                    lambda: (pipeline.encode(x), pipeline))
+        timer.finish(x)
+
+        # Cluster and model each distinct row once with the number of times it appears as its weight
+        start_stage("collapse_duplicates", x)
+
+        def collapse_stage():
+            if not COLLAPSE_DUPLICATES:
+                return x, None, np.arange(len(x)), np.arange(len(x)), pipeline
+            return collapse_duplicates(x) + (pipeline,)
+
+        distinct_x, weights, rows, first_rows, pipeline = run_stage(cache, "collapse_duplicates", resume, report,
+                                                                    collapse_stage)
+        report["distinct_rows"] = len(distinct_x)
+        report["mean_filled_values"] = pipeline.mean_filled_values
+        timer.finish(distinct_x)
+
+        # The Gower distance matrix of a full clustering is cached on its own so it is reused when only the way
+        # the clusters are chosen changes
+        start_stage("gower_matrix", distinct_x)
+        if not skip_stage("gower_matrix", resume, report):
+            matrix = run_stage(cache, "gower_matrix", resume, report,
+                               lambda: gower_distance.gower_matrix(distinct_x)
+                               if len(distinct_x) <= CLARA_ROW_THRESHOLD else None)
+        timer.finish(matrix)
+
+        # Cluster Analysis to determine groups (including determining cluster count)
+        start_stage("cluster", distinct_x)
+
+        def cluster_stage():
+            cluster_report = {}
+            stage_labels, stage_count = cluster(distinct_x, strata=np.asarray(y)[first_rows], report=cluster_report,
+                                                weights=weights, matrix=matrix)
+
+            # Report the medoids as rows of the data rather than of the distinct rows
+            cluster_report["medoids"] = [int(first_rows[index]) for index in cluster_report["medoids"]]
+            return stage_labels, stage_count, cluster_report
+
+        # Remove the scratch file if the matrix was spilled to disk
+        try:
+            distinct_labels, cluster_count, cluster_report = run_stage(cache, "cluster", resume, report,
+                                                                       cluster_stage)
+        finally:
+            gower_distance.release_matrix(matrix)
+        report.update(cluster_report)
+        cluster_labels = distinct_labels[rows]
+        timer.finish(cluster_labels)
+
+        # Calculate cluster with highest % completion of applications
+        start_stage("determine_target_cluster", cluster_labels)
+        best_cluster = determine_target_cluster(y, cluster_labels, cluster_count)
+        timer.finish()
+
+        # Build the best prediction model to predict which cluster client belongs to
+        # The higher the probability the client belongs to the target cluster
+        # the closer they are to the being the type of customer to complete an application
+        start_stage("best_model_probabilities", distinct_x)
+        prob, model = best_model_probabilities(distinct_x, distinct_labels, best_cluster, report=report,
+                                               cancel_event=cancel_event, return_model=True,
+                                               cache=cache if "cluster" in resume.keys else None,
+                                               cache_key=resume.keys.get("cluster"),
+                                               compact=compact, sample_weight=weights)
+        prob = prob[rows]
+        timer.finish(prob)
+
+        # Save everything that was fitted so new data can be scored without a rebuild
+        if registry is not None:
+            report["model_version"] = registry.save({
+                "fields": uploaded_fields,
+                "pipeline": pipeline,
+                "features": report["lr_features"] if report["best_model"] == "lr" else list(distinct_x.columns),
+                "model": model,
+                "model_type": report["best_model"],
+                "target_cluster": int(best_cluster),
+                "cluster_count": int(cluster_count),
+                "medoids": json.loads(distinct_x.iloc[rows[report["medoids"]]].to_json(orient="records")),
+                "scores": {"lr": report["lr_score"], "rf": report["rf_score"]}
+            })
+
+        # Select only the contact details and probabilty scores from the dataframe
+        start_stage("rank", contacts)
+        df = contacts
+        df["Prob"] = prob
+
+        # Select only the customers that have not completed the application
+        df = df[y == 1]
+
+        # Order the df by probability
+        df = df.sort_values(by=["Prob"], axis=0, ascending=False)
+        timer.finish(df)
+
+        # Add the measurements to the totals on the metrics route
+        instrumentation.metrics.observe_build(report)
+
+        # Return the dataframe
+        return df
+    finally:
+        timer.finish()
 
-    # Fill missing Categorical data with "No Data" and use KNNImpute on numerical data
-    x = impute_nulls(x, fields)
+def run_stage(cache, stage, resume, report, function):
+    """Runs a stage of a build and stores its output in the cache or gets its output from the outputs that were
+    loaded when the build resumed
 
-    # One hot encode categorical variables
-    x = encode_categorical(x, fields)
+        Args:
+            cache (StageCache): The cache or None to always run the stage
+            stage (string): The name of the stage
+            resume (Resume): Where the build resumes from, from StageCache.resume. Stages without a key are always
+                run and not cached.
+            report (dict): Dictionary the stage is added to as one of the cached_stages if it is in the cache
+            function (function): Runs the stage and returns its output
 
-    # Cluster Analysis to determine groups (including determining cluster count)
-    cluster_labels, cluster_count = cluster(x)
+        Returns:
+            (object): the output of the stage
+        """
+    key = resume.keys.get(stage)
+    if cache is None or key is None:
+        return function()
 
-    # Calculate cluster with highest % completion of applications
-    best_cluster = determine_target_cluster(y, cluster_labels, cluster_count)
+    if stage in resume.outputs:
+        report.setdefault("cached_stages", []).append(stage)
+        return resume.outputs[stage]
 
-    # Build the best prediction model to predict which cluster client belongs to
-    # The higher the probability the client belongs to the target cluster
-    # the closer they are to the being the type of customer to complete an application
-    prob = best_model_probabilities(x, cluster_labels, best_cluster)
+    # The stages after the one the build resumed from are not in the cache
+    value = function()
+    cache.put(key, value)
+    return value
 
-    # Select only the contact details and probabilty scores from the dataframe
-    df = df[contact_fields]
-    df["Prob"] = prob
 
-    # Select only the customers that have not completed the application
-    df = df[y == 1]
+def skip_stage(stage, resume, report):
+    """Checks if a stage is skipped because the build resumed from a later stage that doesn't need its output,
+    a skipped stage is neither run nor loaded from the cache
 
-    # Order the df by probability
-    df = df.sort_values(by=["Prob"], axis=0, ascending=False)
+        Args:
+            stage (string): The name of the stage
+            resume (Resume): Where the build resumes from, from StageCache.resume
+            report (dict): Dictionary the stage is added to as one of the cached_stages if it is skipped
+
+        Returns:
+            (bool): True if the stage is skipped
+        """
+    if stage not in resume.skipped:
+        return False
+
+    report.setdefault("cached_stages", []).append(stage)
+    return True
+
+
+def transform_features(df, bundle):
+    """Prepares new data for a saved model with the FeaturePipeline fitted when the model was built, nothing
+    is refitted.
+
+        Args:
+            df (pandas.DataFrame): The new data with at least the fields the model uses
+            bundle (dict): The saved model from the ModelRegistry
+
+        Returns:
+            (pandas.DataFrame): the encoded features in the columns and order the model was fitted on
+        """
+    return bundle["pipeline"].transform(df)
+
+
+def score(file, bundle, chunk_rows=SCORE_CHUNK_ROWS):
+    """Scores new customers with a saved model one chunk of rows at a time. There is no clustering or model
+    fitting so the cost is linear in the number of rows.
+
+        Args:
+            file (file): A csv file object with a header line
+            bundle (dict): The saved model from the ModelRegistry
+            chunk_rows (int): The number of rows scored at one time
+
+        Returns:
+            (generator): a dataframe of the contact details and probability of each customer for each chunk
+        """
+    contact_fields = [x[0] for x in bundle["fields"] if x[1] == "Contact Details"]
+
+    for chunk in csv_chunks_from_bin_file(file, field_dtypes(bundle["fields"]), chunk_rows):
+
+        missing = [name for name in contact_fields if name not in chunk.columns]
+        if len(missing) > 0:
+            raise ValueError("The data is missing the contact fields: {}".format(", ".join(missing)))
+
+        x = transform_features(chunk, bundle)
+        customers = chunk[contact_fields].reset_index(drop=True)
+        customers["Prob"] = bundle["model"].predict_proba(x)[:, 1]
+
+        yield customers
 
-    # Return the dataframe
-    return df
 
 def export_to_excel(customers):
     """Converts customer list data into a Microsoft Excel file and
@@ -558,7 +1478,7 @@ def export_to_excel(customers):
 
     # Create an Microsoft Excel workbook and sheet
     output = BytesIO()
-    book = Workbook(output)
+    book = xlsxwriter.Workbook(output)
     sheet = book.add_worksheet('Customer List')
     fields = []
 
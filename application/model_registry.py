@@ -0,0 +1,268 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import joblib
+
+MODELS_DIR = 'models'  # Directory the artifact bundles of built models are stored in
+BUNDLE_FILE = 'bundle.joblib'  # The fitted objects of a model
+MANIFEST_FILE = 'manifest.json'  # The description of a model that can be read without loading it
+PIN_FILE = 'pinned'  # Holds the version of the pinned model
+DEFAULT_VERSION_TTL_SECONDS = 1.0  # How long the default version is reused before the models directory is read again
+
+# The keys of a bundle that are also written to its manifest
+MANIFEST_KEYS = ["version", "created", "fields", "features", "model_type", "target_cluster", "cluster_count",
+                 "medoids", "scores"]
+
+# What the pipeline of a bundle fitted that is also written to its manifest
+PIPELINE_MANIFEST_KEYS = ["model_fields", "percentage_scales", "categories", "columns"]
+
+
+class ModelRegistry:
+    """ Saves the fitted pipeline of every build as a versioned artifact bundle so new data can be scored
+    without a rebuild. Each version has its own directory holding the pickled bundle and a json manifest
+    describing it. One version can be pinned as the model to use, otherwise the latest is used.
+
+    A bundle is a dictionary of:
+        version (string): The version of the model
+        created (float): When the model was saved
+        fields (list): The fields names and data types of the uploaded data
+        pipeline (FeaturePipeline): The fitted steps that prepare new data for the model
+        features (list): The encoded columns the model uses
+        model (object): The fitted model with predict_proba
+        model_type (string): "lr" or "rf"
+        target_cluster (int): The cluster with the highest success
+        cluster_count (int): The number of clusters
+        medoids (list): The encoded rows of the cluster medoids
+        scores (dict): The cross validation scores of the models
+    """
+
+    def __init__(self, models_dir=MODELS_DIR, default_ttl=DEFAULT_VERSION_TTL_SECONDS):
+        """Creates the registry
+
+            Args:
+                models_dir (string): Directory to keep the models in
+                default_ttl (float): Seconds the default version is reused for. Saving, pinning or removing a model
+                    in this process finds it again straight away, other processes sharing the directory see the
+                    change within this time.
+            """
+        self.models_dir = models_dir
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+
+        # The default version, when it was found and a count of the changes made by this process
+        self.default = None
+        self.default_found = None
+        self.changes = 0
+
+        os.makedirs(self.models_dir, exist_ok=True)
+
+    def save(self, bundle):
+        """Saves a bundle as a new version
+
+            Args:
+                bundle (dict): The fitted pipeline without the version and created keys
+
+            Returns:
+                (string): the version
+            """
+        created = time.time()
+        version = "{}-{}".format(time.strftime("%Y%m%d%H%M%S", time.gmtime(created)), uuid.uuid4().hex[:8])
+
+        bundle = dict(bundle, version=version, created=created)
+        manifest = {key: bundle.get(key) for key in MANIFEST_KEYS}
+        manifest.update({key: getattr(bundle.get("pipeline"), key, None) for key in PIPELINE_MANIFEST_KEYS})
+
+        # Write to a temporary directory and rename it so a half saved model is never listed
+        temp_path = os.path.join(self.models_dir, ".{}.tmp".format(version))
+        os.makedirs(temp_path)
+        joblib.dump(bundle, os.path.join(temp_path, BUNDLE_FILE))
+        with open(os.path.join(temp_path, MANIFEST_FILE), "w") as json_file:
+            json.dump(manifest, json_file)
+        os.rename(temp_path, self.model_path(version))
+        self.changed()
+
+        return version
+
+    def list(self):
+        """Lists the manifests of the saved models
+
+            Returns:
+                (list): the manifests from oldest to newest, the pinned one has "pinned" set to True
+            """
+        pinned = self.pinned()
+        manifests = []
+        for version in sorted(os.listdir(self.models_dir)):
+            manifest = self.manifest(version)
+            if manifest is not None:
+                manifest["pinned"] = version == pinned
+                manifests.append(manifest)
+
+        return manifests
+
+    def manifest(self, version):
+        """Gets the manifest of a model
+
+            Args:
+                version (string): The model version
+
+            Returns:
+                (dict): the manifest or None if there is no such model
+            """
+        if not is_valid_version(version):
+            return None
+
+        try:
+            with open(self.model_path(version, MANIFEST_FILE)) as json_file:
+                return json.load(json_file)
+        except FileNotFoundError:
+            return None
+
+    def load(self, version=None):
+        """Loads a bundle
+
+            Args:
+                version (string): The model version, None for the pinned model or the latest if none is pinned
+
+            Returns:
+                (dict): the bundle
+            """
+        if version is None:
+            version = self.default_version()
+            if version is None:
+                raise ValueError("No models have been built yet")
+
+        if self.manifest(version) is None:
+            raise ValueError("No model with version {}".format(version))
+
+        return joblib.load(self.model_path(version, BUNDLE_FILE))
+
+    def default_version(self):
+        """Gets the version used when none is given, reusing the one found within the last default_ttl seconds
+        so scoring a record doesn't read the models directory every time
+
+            Returns:
+                (string): the pinned version, otherwise the latest version or None if there are no models
+            """
+        now = time.monotonic()
+        with self.lock:
+            if self.default_found is not None and now - self.default_found < self.default_ttl:
+                return self.default
+            changes = self.changes
+
+        version = self.find_default_version()
+
+        # Don't keep it if this process changed the models while it was being found
+        with self.lock:
+            if changes == self.changes:
+                self.default = version
+                self.default_found = now
+
+        return version
+
+    def find_default_version(self):
+        """Reads the models directory for the version used when none is given
+
+            Returns:
+                (string): the pinned version, otherwise the latest version or None if there are no models
+            """
+        pinned = self.pinned()
+        if pinned is not None:
+            return pinned
+
+        # Versions start with the time they were saved so the latest sorts last
+        versions = sorted(version for version in os.listdir(self.models_dir) if is_valid_version(version))
+        return versions[-1] if len(versions) > 0 else None
+
+    def pin(self, version):
+        """Pins a model so it is used when no version is given
+
+            Args:
+                version (string): The model version
+            """
+        if self.manifest(version) is None:
+            raise ValueError("No model with version {}".format(version))
+
+        with self.lock:
+            # The temporary file is unique across the processes sharing the models directory
+            temp_file, temp_path = tempfile.mkstemp(dir=self.models_dir, prefix=PIN_FILE + ".", suffix=".tmp")
+            with os.fdopen(temp_file, "w") as pin_file:
+                pin_file.write(version)
+            os.replace(temp_path, os.path.join(self.models_dir, PIN_FILE))
+        self.changed()
+
+    def unpin(self):
+        """Removes the pin so the latest model is used"""
+        with self.lock:
+            try:
+                os.remove(os.path.join(self.models_dir, PIN_FILE))
+            except FileNotFoundError:
+                pass
+        self.changed()
+
+    def changed(self):
+        """Forgets the default version after this process saves, pins or removes a model"""
+        with self.lock:
+            self.changes += 1
+            self.default_found = None
+
+    def pinned(self):
+        """Gets the pinned version
+
+            Returns:
+                (string): the pinned version or None
+            """
+        try:
+            with open(os.path.join(self.models_dir, PIN_FILE)) as pin_file:
+                version = pin_file.read().strip()
+        except FileNotFoundError:
+            return None
+
+        return version if self.manifest(version) is not None else None
+
+    def remove(self, version):
+        """Removes a model, the pinned model can't be removed
+
+            Args:
+                version (string): The model version
+            """
+        if self.manifest(version) is None:
+            raise ValueError("No model with version {}".format(version))
+        if version == self.pinned():
+            raise ValueError("The pinned model can't be removed")
+
+        shutil.rmtree(self.model_path(version), ignore_errors=True)
+        self.changed()
+
+    def model_path(self, version, filename=None):
+        """Gets the path of a model's directory or a file in it
+
+            Args:
+                version (string): The model version
+                filename (string): Optional file in the model directory
+
+            Returns:
+                (string): the path
+            """
+        if not is_valid_version(version):
+            raise ValueError("Invalid model version {}".format(version))
+
+        if filename is None:
+            return os.path.join(self.models_dir, version)
+        return os.path.join(self.models_dir, version, filename)
+
+
+def is_valid_version(version):
+    """Checks a version is one created by the registry so it is safe to use in a path
+
+        Args:
+            version (string): The model version
+
+        Returns:
+            (bool): True if valid
+        """
+    return isinstance(version, str) and re.fullmatch(r"[0-9]{14}-[0-9a-f]{8}", version) is not None
@@ -0,0 +1,130 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from application.gower_distance import resolve_n_jobs
+
+WHITESPACE = " \t\r\n"  # Characters removed from around every number, they aren't allowed inside one
+PARSE_CHUNK_ROWS = 100000  # Rows converted at one time so the character arrays stay small
+PARALLEL_MIN_ROWS = 10000  # Columns with fewer rows than this are converted one after another
+BAD_CELL_EXAMPLES = 5  # Number of bad cells shown in the error message
+
+
+def parse_numbers(values, strip=""):
+    """Converts text to floats in one pass over the characters. The text is laid out as a matrix of character
+    codes, the formatting characters are removed from every cell at once and the rest is parsed by numpy.
+    Cells that are missing or empty once the formatting is removed are nan.
+
+    Whitespace is removed from around a number but a cell with whitespace inside the number, eg. "1 000", is
+    not a number since it can't be told apart from two numbers in one cell.
+
+        Args:
+            values (array like): The text of each cell, numbers and missing values are allowed
+            strip (string): Formatting characters to remove, eg. "$," for money
+
+        Returns:
+            (numpy.ndarray): the float64 numbers
+            (numpy.ndarray): True for the cells that aren't numbers
+    """
+    values = np.asarray(values, dtype=object)
+    numbers = np.empty(len(values), dtype=np.float64)
+    bad = np.zeros(len(values), dtype=bool)
+
+    for start in range(0, len(values), PARSE_CHUNK_ROWS):
+        end = min(start + PARSE_CHUNK_ROWS, len(values))
+        numbers[start:end], bad[start:end] = parse_chunk(values[start:end], strip)
+
+    return numbers, bad
+
+
+def parse_chunk(values, strip):
+    """Converts a chunk of text to floats
+
+        Args:
+            values (numpy.ndarray): The text of each cell as objects
+            strip (string): The characters to remove
+
+        Returns:
+            (numpy.ndarray): the float64 numbers
+            (numpy.ndarray): True for the cells that aren't numbers
+    """
+    text = np.where(pd.isna(values), "", values).astype(str)
+    if text.dtype.itemsize == 0:
+        text = text.astype("<U1")
+    width = text.dtype.itemsize // 4
+
+    # One row of unicode code points per cell, padded with zeros
+    codes = text.view(np.uint32).reshape(len(text), width)
+    formatting = codes == 0
+    for char in strip:
+        formatting |= codes == ord(char)
+    space = np.zeros_like(formatting)
+    for char in WHITESPACE:
+        space |= codes == ord(char)
+
+    # Keep everything from the first to the last character of the number apart from the formatting, whitespace
+    # inside the number is kept so the cell is bad
+    digits = ~(formatting | space)
+    keep = np.logical_or.accumulate(digits, axis=1)
+    keep &= np.logical_or.accumulate(digits[:, ::-1], axis=1)[:, ::-1]
+    keep &= ~formatting
+
+    # Move the kept characters to the front of each row without changing their order, a column at a time with
+    # the number of characters each row has kept so far as the position they move to
+    compacted = np.zeros_like(codes)
+    kept = np.zeros(len(codes), dtype=np.intp)
+    for column in range(width):
+        rows = np.flatnonzero(keep[:, column])
+        compacted[rows, kept[rows]] = codes[rows, column]
+        kept[rows] += 1
+    cleaned = compacted.view(text.dtype).reshape(len(text))
+
+    empty = kept == 0
+    cleaned[empty] = "0"
+
+    try:
+        numbers = cleaned.astype(np.float64)
+        bad = np.zeros(len(cleaned), dtype=bool)
+    except ValueError:
+        # Only when there are bad cells, anything that isn't a number becomes nan
+        numbers = pd.to_numeric(pd.Series(cleaned, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+        bad = np.isnan(numbers) & (np.char.lower(cleaned) != "nan")
+
+    numbers[empty] = np.nan
+    return numbers, bad
+
+
+def parse_columns(df, strips, n_jobs=None):
+    """Converts text columns to floats, different columns at the same time
+
+        Args:
+            df (pandas.DataFrame): The data
+            strips (dict): Column name to the formatting characters to remove from it
+            n_jobs (int): The number of threads to use, -1 for all cores
+
+        Returns:
+            (dict): column name to the numbers and the bad cell mask from parse_numbers
+    """
+    columns = list(strips)
+    workers = min(len(columns), resolve_n_jobs(n_jobs))
+    if workers <= 1 or len(df) < PARALLEL_MIN_ROWS:
+        return {col: parse_numbers(df[col].to_numpy(), strips[col]) for col in columns}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {col: executor.submit(parse_numbers, df[col].to_numpy(), strips[col]) for col in columns}
+        return {col: future.result() for col, future in futures.items()}
+
+
+def bad_cells_error(field_name, values, bad):
+    """Describes the cells of a field that aren't numbers
+
+        Args:
+            field_name (string): The field
+            values (array like): The original text of the field
+            bad (numpy.ndarray): True for the cells that aren't numbers
+
+        Returns:
+            (ValueError): the error to raise, with the row number and text of the first few bad cells
+    """
+    rows = np.flatnonzero(bad)
+    examples = ", ".join("row {} \"{}\"".format(row + 1, values[row]) for row in rows[:BAD_CELL_EXAMPLES])
+    return ValueError("The field {} has {} values that are not numbers eg. {}".format(field_name, len(rows), examples))
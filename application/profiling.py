@@ -0,0 +1,228 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILES_DIR = 'profiles'  # Directory the saved profiles are stored in
+PROFILE_MODES = ["cprofile", "sampling"]  # Deterministic (cProfile) or statistical (stack sampling) profiling
+SAMPLE_INTERVAL_SECONDS = 0.005  # How often the sampling profiler records the stack of every thread
+SUMMARY_LINES = 60  # Number of functions listed in the text summary of a profile
+
+# The innermost frames of a thread that is waiting rather than working, these samples are left out
+IDLE_FRAMES = {("wait", "threading.py"), ("_wait_for_tstate_lock", "threading.py"), ("get", "queue.py"),
+               ("_worker", "thread.py"), ("select", "selectors.py")}
+IDLE_THREADS = {"rss-sampler"}  # Threads that only sleep between measurements
+
+# Only one profile runs at a time, cProfile can't be nested and profiles of overlapping requests would mix
+_profile_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """ A statistical profiler that records the stack of every thread in this process at a fixed interval.
+    Unlike cProfile it sees the worker threads of a build (eg. the model searches and the Gower blocks) and
+    adds little overhead. Threads that are waiting are left out. The stacks are saved in the collapsed
+    (folded) format used by flame graph tools.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS):
+        """Creates the profiler
+
+            Args:
+                interval (float): Seconds between samples
+            """
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Starts sampling in a background thread"""
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops sampling"""
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        """Records the stacks until stopped"""
+        own_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or names.get(thread_id) in IDLE_THREADS:
+                    continue
+                if (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename)) in IDLE_FRAMES:
+                    continue
+
+                # Collapse the stack from the outermost call to the innermost
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        """Gets the stacks in the collapsed format
+
+            Returns:
+                (string): one line per stack of the frames separated by ; then the number of samples
+            """
+        return "".join("{} {}\n".format(stack, count) for stack, count in self.stacks.most_common())
+
+    def summary(self, lines=SUMMARY_LINES):
+        """Summarises the samples by function
+
+            Args:
+                lines (int): The number of functions to list
+
+            Returns:
+                (string): the functions with the most samples, in their own code (self) and in total
+            """
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+
+        text = ["{} samples every {} seconds".format(self.samples, self.interval), "", "self total function"]
+        for frame, count in total.most_common(lines):
+            text.append("{:4d} {:5d} {}".format(own[frame], count, frame))
+
+        return "\n".join(text) + "\n"
+
+
+@contextmanager
+def profile(mode, name, profiles_dir=PROFILES_DIR):
+    """Profiles the code inside the with block and saves the profile. If another profile is already running
+    the code runs without being profiled.
+
+        Args:
+            mode (string): "cprofile" or "sampling"
+            name (string): What is being profiled eg. the route
+            profiles_dir (string): Directory to save the profile in
+
+        Returns:
+            (dict): the profile details, profile_id is None if it wasn't profiled
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError("Unknown profile mode {}".format(mode))
+
+    details = {"profile_id": None, "mode": mode, "name": name}
+    if not _profile_lock.acquire(blocking=False):
+        details["error"] = "Another request is being profiled"
+        yield details
+        return
+
+    try:
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = SamplingProfiler()
+            profiler.start()
+
+        details["started"] = time.time()
+        try:
+            yield details
+        finally:
+            if mode == "cprofile":
+                profiler.disable()
+            else:
+                profiler.stop()
+            details["seconds"] = time.time() - details["started"]
+            details["profile_id"] = save_profile(profiler, details, profiles_dir)
+    finally:
+        _profile_lock.release()
+
+
+def save_profile(profiler, details, profiles_dir=PROFILES_DIR):
+    """Saves a profile, its text summary and its details
+
+        Args:
+            profiler (object): The stopped cProfile.Profile or SamplingProfiler
+            details (dict): The profile details
+            profiles_dir (string): Directory to save the profile in
+
+        Returns:
+            (string): the profile id
+        """
+    os.makedirs(profiles_dir, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    details = dict(details, profile_id=profile_id)
+
+    if details["mode"] == "cprofile":
+        profiler.dump_stats(os.path.join(profiles_dir, profile_id + ".prof"))
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(SUMMARY_LINES)
+        summary = summary.getvalue()
+    else:
+        with open(os.path.join(profiles_dir, profile_id + ".folded"), "w") as folded_file:
+            folded_file.write(profiler.folded())
+        summary = profiler.summary()
+
+    with open(os.path.join(profiles_dir, profile_id + ".txt"), "w") as summary_file:
+        summary_file.write(summary)
+    with open(os.path.join(profiles_dir, profile_id + ".json"), "w") as json_file:
+        json.dump(details, json_file)
+
+    return profile_id
+
+
+def list_profiles(profiles_dir=PROFILES_DIR):
+    """Lists the saved profiles
+
+        Args:
+            profiles_dir (string): Directory the profiles are saved in
+
+        Returns:
+            (list): the details of each profile, newest first
+        """
+    if not os.path.isdir(profiles_dir):
+        return []
+
+    profiles = []
+    for filename in os.listdir(profiles_dir):
+        if filename.endswith(".json"):
+            with open(os.path.join(profiles_dir, filename)) as json_file:
+                profiles.append(json.load(json_file))
+
+    return sorted(profiles, key=lambda details: details["started"], reverse=True)
+
+
+def profile_file(profile_id, kind, profiles_dir=PROFILES_DIR):
+    """Gets the path of a saved profile file
+
+        Args:
+            profile_id (string): The profile id
+            kind (string): "summary" for the text summary or "raw" for the .prof or .folded profile
+            profiles_dir (string): Directory the profiles are saved in
+
+        Returns:
+            (string): the path or None if there is no such profile
+        """
+    if not isinstance(profile_id, str) or re.fullmatch(r"[0-9a-f]{32}", profile_id) is None:
+        return None
+
+    extensions = [".txt"] if kind == "summary" else [".prof", ".folded"]
+    for extension in extensions:
+        path = os.path.join(profiles_dir, profile_id + extension)
+        if os.path.exists(path):
+            return path
+
+    return None
@@ -1,60 +1,337 @@
-
-from sklearn.model_selection import cross_val_score
+import warnings
+from concurrent.futures import CancelledError
+import numpy as np
+from sklearn.base import clone
+from sklearn.model_selection import check_cv
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import ParameterGrid
+from sklearn.utils import _safe_indexing
+from application import instrumentation
+
+RF_N_JOBS = -1  # Number of cores used to fit the trees, -1 for all cores
+RF_SEARCH = "grid"  # How to search the parameters: "grid", "halving" (successive halving on trees) or "oob"
+RF_BUDGET = 40000  # Maximum number of trees the halving and oob searches can fit
+HALVING_FACTOR = 3  # Only the best 1 / HALVING_FACTOR of the configurations are kept after each halving round
+OOB_CHECKPOINTS = [50, 100, 200, 300, 500, 1000]  # Forest sizes the out of bag score is checked at
+OOB_TOLERANCE = 0.002  # Growing a forest stops when the out of bag score improves by less than this
+
+# The parameter grid of suitable parameters to search
+PARAM_GRID = {
+    'max_depth': [30, 90, 180],
+    'max_features': [2, 3],
+    'n_estimators': [100, 300, 1000]
+}
 
 
-def determine_best_model_probabilities(x, y, cv, random_state = None):
-    """ Uses stepwise backward feature selection with a cross validation metric used for
-    determining the best set of features
+def determine_best_model_probabilities(x, y, cv, random_state=None, search=RF_SEARCH, budget=RF_BUDGET,
+                                       report=None, n_jobs=RF_N_JOBS, cancel_event=None, return_model=False,
+                                       compact=False, sample_weight=None):
+    """ Searches the random forest parameters with a cross validation metric used for
+    determining the best parameters
 
     Args:
         x (pandas.DataFrame): The data in a pandas dataframe
         y (list like object): The response variable
         cv (int): The number of cross validations to use
         random_state (int): random seed to use to get consistent results for testing
+        search (string): "grid", "halving" or "oob"
+        budget (int): The maximum number of trees the halving and oob searches can fit
+        report (dict): Optional dictionary that the search, best parameters, trees fitted and the measurements of
+            each candidate (rf_candidates) are recorded in
+        n_jobs (int): The number of cores to fit the trees on, -1 for all cores
+        cancel_event (threading.Event): Optional event that stops the search before the next fit
+        return_model (bool): Also return the fitted model
+        compact (bool): Convert the features to float32 once, which is what the trees are fitted on, instead of
+            converting them for every fit
+        sample_weight (numpy array): Optional number of times each row appears, every fit and score counts each
+            row that many times. The trees are bootstrapped from the distinct rows so the forest is close to, but
+            not the same as, a forest fitted on the repeated rows.
 
     Returns:
         (float): The best cross validation score
         (list): List of probabilities for data belonging to best cluster
+        (RandomForestClassifier): The best model fitted on all the data, only if return_model
     """
 
-    # Create the parameter grid of suitable parameters to search
-    param_grid = {
-        'max_depth': [30, 90, 180],
-        'max_features': [2, 3],
-        'n_estimators': [100, 300, 1000]
-    }
+    if compact:
+        x = x.to_numpy(dtype=np.float32)
+    y = np.asarray(y)
+    if sample_weight is not None:
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
 
-    # Create a based model
-    model = RandomForestClassifier(random_state=random_state)
+    # Each search adds the measurements of every candidate it fits
+    candidates = []
+    if search == "grid":
+        best_score, model, trees_fitted = grid_search(x, y, cv, random_state, n_jobs, cancel_event, candidates,
+                                                      sample_weight)
+    elif search == "halving":
+        best_score, model, trees_fitted = halving_search(x, y, cv, random_state, budget, n_jobs, cancel_event,
+                                                         candidates, sample_weight)
+    elif search == "oob":
+        best_score, model, trees_fitted = oob_search(x, y, random_state, budget, n_jobs, cancel_event, candidates,
+                                                     sample_weight)
+    else:
+        raise ValueError("Unknown random forest search {}".format(search))
 
-    # Instantiate the grid search model
-    grid_search = GridSearchCV(estimator=model, param_grid=param_grid,
-                               cv=cv, n_jobs=-1)
+    # Make predictions on probability
+    prob = model.predict_proba(x)
+    prob_success = prob[:, 1]
 
-    # Fit the grid search to the data
-    grid_search.fit(x, y)
+    # The saved model scores a few records at a time, which is slower spread over threads
+    model.set_params(n_jobs=1)
 
-    # Get the best cross val score
-    best_score = grid_search.best_score_
+    if report is not None:
+        report["rf_search"] = search
+        report["rf_params"] = {name: model.get_params()[name] for name in PARAM_GRID}
+        report["rf_trees_fitted"] = trees_fitted
+        report["rf_candidates"] = candidates
+        if search != "grid":
+            report["rf_budget"] = budget
 
-    # Create the model with the best params
-    model = grid_search.best_estimator_
+    if return_model:
+        return best_score, prob_success, model
+    return best_score, prob_success
 
-    # Fit on training data
-    model.fit(x, y)
 
-    # Make predictions on probability
-    prob = model.predict_proba(x)
-    prob_success = prob[:, 1]
+def grid_search(x, y, cv, random_state=None, n_jobs=RF_N_JOBS, cancel_event=None, candidates=None,
+                sample_weight=None):
+    """ Exhaustive grid search of the parameter grid. Each configuration is cross validated in turn with its
+    trees fitted in parallel, so the search can be cancelled before any fit, unlike GridSearchCV.
 
-    return best_score, prob_success
+    Args:
+        x (pandas.DataFrame): The data in a pandas dataframe
+        y (numpy array): The response variable
+        cv (int): The number of cross validations to use
+        random_state (int): random seed to use to get consistent results for testing
+        n_jobs (int): The number of cores to fit the trees on, -1 for all cores
+        cancel_event (threading.Event): Optional event that stops the search before the next fit
+        candidates (list): Optional list to add the parameters, score and measurements of each candidate to
+        sample_weight (numpy array): Optional weight of each row to fit and score with
+
+    Returns:
+        (float): The best cross validation score
+        (RandomForestClassifier): The best model fitted on all the data
+        (int): The number of trees fitted
+    """
+
+    configurations = list(ParameterGrid(PARAM_GRID))
+    n_splits = check_cv(cv, y, classifier=True).get_n_splits()
+
+    scores = []
+    for params in configurations:
+        model = RandomForestClassifier(random_state=random_state, n_jobs=n_jobs, **params)
+        with instrumentation.measure({"params": params}) as record:
+            scores.append(cv_score(model, x, y, cv, sample_weight, cancel_event))
+        add_candidate(candidates, record, scores[-1])
+
+    # The first of the best configurations is refit on all the data, as GridSearchCV does
+    best_index = int(np.argmax(scores))
+    check_cancelled(cancel_event)
+    model = RandomForestClassifier(random_state=random_state, n_jobs=n_jobs, **configurations[best_index])
+    model.fit(x, y, sample_weight=sample_weight)
+
+    # Every configuration is fitted in every fold then the best is refit
+    trees_fitted = sum(params["n_estimators"] for params in configurations) * n_splits + model.n_estimators
+
+    return scores[best_index], model, trees_fitted
+
+
+def cv_score(model, x, y, cv, sample_weight=None, cancel_event=None):
+    """ The average cross validation accuracy of a model, the same as cross_val_score but each fold can be
+    fitted and scored with sample weights and the cancel event is checked before each fold
+
+    Args:
+        model (RandomForestClassifier): The unfitted model
+        x (pandas.DataFrame): The data in a pandas dataframe
+        y (numpy array): The response variable
+        cv (int): The number of cross validations to use
+        sample_weight (numpy array): Optional weight of each row
+        cancel_event (threading.Event): Optional event that stops the cross validation before the next fold
+
+    Returns:
+        (float): The average cross validation score
+    """
+
+    scores = []
+    for train, test in check_cv(cv, y, classifier=True).split(x, y):
+        check_cancelled(cancel_event)
+        train_weight = None if sample_weight is None else sample_weight[train]
+        test_weight = None if sample_weight is None else sample_weight[test]
+        fold_model = clone(model).fit(_safe_indexing(x, train), y[train], sample_weight=train_weight)
+        scores.append(fold_model.score(_safe_indexing(x, test), y[test], sample_weight=test_weight))
+    return sum(scores) / len(scores)
+
+
+def oob_accuracy(model, y, sample_weight=None):
+    """ The out of bag accuracy of a forest fitted with oob_score, weighted by the sample weights
+
+    Args:
+        model (RandomForestClassifier): The fitted forest
+        y (numpy array): The response variable it was fitted on
+        sample_weight (numpy array): Optional weight of each row
+
+    Returns:
+        (float): The out of bag score
+    """
 
+    if sample_weight is None:
+        return model.oob_score_
 
+    # Rows without an out of bag prediction are counted as the first class, as oob_score_ does
+    predicted = model.classes_[np.argmax(np.nan_to_num(model.oob_decision_function_), axis=1)]
+    return float(np.average(predicted == y, weights=sample_weight))
 
 
+def halving_search(x, y, cv, random_state=None, budget=RF_BUDGET, n_jobs=RF_N_JOBS, cancel_event=None,
+                   candidates=None, sample_weight=None):
+    """ Successive halving search using the number of trees as the resource. Every configuration of max_depth
+    and max_features is cross validated with the fewest trees, then only the best 1 / HALVING_FACTOR are
+    cross validated with the next number of trees and so on. The search stops early rather than go over
+    the budget of trees.
 
+    Args:
+        x (pandas.DataFrame): The data in a pandas dataframe
+        y (list like object): The response variable
+        cv (int): The number of cross validations to use
+        random_state (int): random seed to use to get consistent results for testing
+        budget (int): The maximum number of trees that can be fitted
+        n_jobs (int): The number of cores to fit the trees on, -1 for all cores
+        cancel_event (threading.Event): Optional event that stops the search before the next configuration
+        candidates (list): Optional list to add the parameters, score and measurements of each candidate to
+        sample_weight (numpy array): Optional weight of each row to fit and score with
+
+    Returns:
+        (float): The best cross validation score
+        (RandomForestClassifier): The best model fitted on all the data
+        (int): The number of trees fitted
+    """
+
+    # The number of trees for each round
+    resources = sorted(PARAM_GRID["n_estimators"])
+    configurations = list(ParameterGrid({name: values for name, values in PARAM_GRID.items()
+                                         if name != "n_estimators"}))
+    n_folds = cv if isinstance(cv, int) else cv.get_n_splits()
+
+    trees_fitted = 0
+    best = None
+    for n_estimators in resources:
 
+        # Stop before a round (plus the final fit) would go over budget, always run the first round
+        round_cost = len(configurations) * n_estimators * n_folds
+        if best is not None and trees_fitted + round_cost + n_estimators > budget:
+            break
 
+        scores = []
+        for params in configurations:
+            check_cancelled(cancel_event)
+            model = RandomForestClassifier(n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs,
+                                           **params)
+            with instrumentation.measure({"params": dict(params, n_estimators=n_estimators)}) as record:
+                score = cv_score(model, x, y, cv, sample_weight, cancel_event)
+            scores.append([score, params, n_estimators])
+            add_candidate(candidates, record, scores[-1][0])
+        trees_fitted += round_cost
+
+        # Keep the best configurations for the next round
+        scores.sort(key=lambda s: s[0], reverse=True)
+        best = scores[0]
+        keep = max(1, -(-len(configurations) // HALVING_FACTOR))
+        configurations = [s[1] for s in scores[:keep]]
+
+    # Fit the winning configuration on all the data
+    best_score, params, n_estimators = best
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs, **params)
+    model.fit(x, y, sample_weight=sample_weight)
+    trees_fitted += n_estimators
+
+    return best_score, model, trees_fitted
+
+
+def oob_search(x, y, random_state=None, budget=RF_BUDGET, n_jobs=RF_N_JOBS, cancel_event=None, candidates=None,
+               sample_weight=None):
+    """ Grows one forest for each configuration of max_depth and max_features, adding trees with warm_start
+    and reading the out of bag score at each checkpoint in OOB_CHECKPOINTS. A forest stops growing when
+    its score plateaus. The out of bag score replaces cross validation so every configuration is only
+    fitted once on all the data and the best forest is used without refitting.
+
+    Args:
+        x (pandas.DataFrame): The data in a pandas dataframe
+        y (list like object): The response variable
+        random_state (int): random seed to use to get consistent results for testing
+        budget (int): The maximum number of trees that can be fitted
+        n_jobs (int): The number of cores to fit the trees on, -1 for all cores
+        cancel_event (threading.Event): Optional event that stops the search before the next fit
+        candidates (list): Optional list to add the parameters, score and measurements of each forest size to
+        sample_weight (numpy array): Optional weight of each row to fit and score with
 
+    Returns:
+        (float): The best out of bag score
+        (RandomForestClassifier): The best model fitted on all the data
+        (int): The number of trees fitted
+    """
+
+    configurations = list(ParameterGrid({name: values for name, values in PARAM_GRID.items()
+                                         if name != "n_estimators"}))
+
+    # Split the budget evenly so every configuration gets to grow
+    forest_budget = max(OOB_CHECKPOINTS[0], budget // len(configurations))
+
+    trees_fitted = 0
+    best_score = None
+    best_model = None
+    for params in configurations:
+        model = RandomForestClassifier(n_estimators=OOB_CHECKPOINTS[0], warm_start=True, oob_score=True,
+                                       random_state=random_state, n_jobs=n_jobs, **params)
+        score = None
+        for n_estimators in OOB_CHECKPOINTS:
+            if n_estimators > forest_budget:
+                break
+            check_cancelled(cancel_event)
+
+            # Add trees to the existing forest
+            model.set_params(n_estimators=n_estimators)
+            with warnings.catch_warnings(), \
+                    instrumentation.measure({"params": dict(params, n_estimators=n_estimators)}) as record:
+                # Small forests can leave a few rows without an out of bag score
+                warnings.simplefilter("ignore", UserWarning)
+                model.fit(x, y, sample_weight=sample_weight)
+            oob_score = oob_accuracy(model, y, sample_weight)
+            add_candidate(candidates, record, oob_score)
+
+            # Stop growing once the score has plateaued
+            improvement = None if score is None else oob_score - score
+            score = oob_score
+            if improvement is not None and improvement < OOB_TOLERANCE:
+                break
+
+        trees_fitted += model.n_estimators
+
+        if best_score is None or score > best_score:
+            best_score = score
+            best_model = model
+
+    return best_score, best_model, trees_fitted
+
+
+def add_candidate(candidates, record, score):
+    """ Adds the measurements of a candidate to the list of candidates
+
+    Args:
+        candidates (list): The list of candidates or None if they aren't being recorded
+        record (dict): The parameters and measurements of the candidate
+        score (float): The score of the candidate
+    """
+    if candidates is not None:
+        record["score"] = float(score)
+        record["fit_seconds"] = record["wall_seconds"]
+        candidates.append(record)
+
+
+def check_cancelled(cancel_event):
+    """ Raises CancelledError if the search has been cancelled
+
+    Args:
+        cancel_event (threading.Event): The event that is set to cancel, or None
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise CancelledError()
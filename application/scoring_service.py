@@ -0,0 +1,221 @@
+import math
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import pandas as pd
+from application import model_builder
+
+MODEL_CACHE_SIZE = 4  # Number of loaded models kept in memory, the least recently used is dropped first
+BATCH_MAX_SIZE = 32  # Maximum number of records scored in one call to predict_proba
+BATCH_WAIT_SECONDS = 0.002  # How long the first record of a batch waits for other records to join it
+SCORE_TIMEOUT_SECONDS = 5  # Maximum seconds to wait for a record to be scored
+
+# The field types that are parsed as numbers
+NUMBER_TYPES = ["Numeric", "Money", "Percentage"]
+
+
+class ModelCache:
+    """ Keeps the most recently used models loaded in memory so a record can be scored without reading the
+    model from disk.
+    """
+
+    def __init__(self, registry, max_size=MODEL_CACHE_SIZE):
+        """Creates the cache
+
+            Args:
+                registry (ModelRegistry): The registry the models are loaded from
+                max_size (int): The number of models to keep loaded
+            """
+        self.registry = registry
+        self.max_size = max_size
+        self.bundles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, version=None):
+        """Gets a model, loading it if it isn't in the cache
+
+            Args:
+                version (string): The model version, None for the pinned model or the latest if none is pinned
+
+            Returns:
+                (dict): the bundle
+            """
+        if version is None:
+            version = self.registry.default_version()
+            if version is None:
+                raise ValueError("No models have been built yet")
+
+        with self.lock:
+            if version in self.bundles:
+                self.bundles.move_to_end(version)
+                return self.bundles[version]
+
+        # Load outside the lock so other models can still be used while it loads
+        bundle = self.registry.load(version)
+
+        with self.lock:
+            self.bundles[version] = bundle
+            self.bundles.move_to_end(version)
+            while len(self.bundles) > self.max_size:
+                self.bundles.popitem(last=False)
+
+        return bundle
+
+
+class ScoringService:
+    """ Scores single records with a saved model. Records that arrive at the same time are collected into
+    small batches by a worker thread so the model is only called once for the batch.
+    """
+
+    def __init__(self, registry, cache_size=MODEL_CACHE_SIZE, max_batch=BATCH_MAX_SIZE,
+                 batch_wait=BATCH_WAIT_SECONDS):
+        """Creates the service, the worker thread starts with the first record
+
+            Args:
+                registry (ModelRegistry): The registry the models are loaded from
+                cache_size (int): The number of models to keep loaded
+                max_batch (int): The maximum number of records in a batch
+                batch_wait (float): Seconds the first record of a batch waits for others to join it
+            """
+        self.cache = ModelCache(registry, cache_size)
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.requests = queue.Queue()
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def score(self, record, version=None, timeout=SCORE_TIMEOUT_SECONDS):
+        """Scores one record
+
+            Args:
+                record (dict): Field name to value of the customer to score
+                version (string): The model version, None for the pinned model or the latest if none is pinned
+                timeout (float): The maximum seconds to wait for the score
+
+            Returns:
+                (float): the probability the customer belongs to the cluster with the highest success
+                (string): the version of the model used
+            """
+        bundle = self.cache.get(version)
+        row = validate_record(record, bundle)
+
+        future = Future()
+        self.start()
+        self.requests.put((bundle, row, future))
+
+        return future.result(timeout=timeout), bundle["version"]
+
+    def start(self):
+        """Starts the worker thread if it isn't running"""
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name="scoring-batcher", daemon=True)
+                self.worker.start()
+
+    def run(self):
+        """Collects records into batches and scores them until the process ends"""
+        while True:
+            batch = [self.requests.get()]
+
+            # Give other records a moment to join the batch
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self.requests.get(timeout=self.batch_wait))
+            except queue.Empty:
+                pass
+
+            # Each model scores its own records
+            versions = OrderedDict()
+            for bundle, row, future in batch:
+                versions.setdefault(bundle["version"], []).append((bundle, row, future))
+
+            for requests in versions.values():
+                score_batch(requests)
+
+
+def score_batch(requests):
+    """Scores a batch of records that use the same model and sets the result of each one's future
+
+        Args:
+            requests (list): The bundle, validated row and future of each record
+        """
+    bundle = requests[0][0]
+    try:
+        df = pd.DataFrame([row for _, row, _ in requests])
+        x = model_builder.transform_features(df, bundle)
+        prob = bundle["model"].predict_proba(x)[:, 1]
+    except Exception as err:
+        for _, _, future in requests:
+            future.set_exception(err)
+        return
+
+    for (_, _, future), value in zip(requests, prob):
+        future.set_result(float(value))
+
+
+def validate_record(record, bundle):
+    """Checks a record against the fields the model was built with and converts it to a row of the uploaded
+    data. Fields the model doesn't use are ignored and missing values are imputed the same as an empty cell.
+    Checking each record first means one bad record can't fail the batch it is scored in.
+
+        Args:
+            record (dict): Field name to value of the customer to score
+            bundle (dict): The saved model from the ModelRegistry
+
+        Returns:
+            (dict): field name to value of the fields the model uses
+        """
+    if not isinstance(record, dict):
+        raise ValueError("The record must be an object of field names to values")
+
+    known = set(field[0] for field in bundle["fields"])
+    unknown = [name for name in record if name not in known]
+    if len(unknown) > 0:
+        raise ValueError("Unknown fields: {}".format(", ".join(unknown)))
+
+    pipeline = bundle["pipeline"]
+    row = {}
+    for name, field_type in pipeline.model_fields:
+        value = record.get(name)
+
+        if field_type in NUMBER_TYPES:
+            row[name] = parse_number(name, field_type, value, pipeline.percentage_scales.get(name, 1))
+        else:
+            row[name] = "" if value is None else str(value)
+
+            # Only values the model was built with have an encoded column
+            if row[name].strip() != "" and row[name] not in pipeline.categories.get(name, []):
+                raise ValueError("{} isn't one of the values of the field {} the model was built with"
+                                 .format(row[name], name))
+
+    return row
+
+
+def parse_number(name, field_type, value, scale=1):
+    """Parses a number the same way validate_types does, so $, % and thousands separators are removed
+
+        Args:
+            name (string): The field name
+            field_type (string): The field type
+            value: The value from the record
+            scale (float): The multiplier used for a Percentage field
+
+        Returns:
+            (float): the number, nan if missing
+        """
+    if value is None or value == "":
+        return math.nan
+
+    try:
+        if isinstance(value, str):
+            value = value.replace("$", "").replace(",", "").replace("%", "").strip()
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("The field {} must be a number but is {}".format(name, value))
+
+    if field_type == "Percentage" and not 0 <= number * scale <= 100:
+        raise ValueError("Percentage values must be between 0 and 1 or between 1 and 100 for field {}"
+                         .format(name))
+
+    return number
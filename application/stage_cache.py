@@ -0,0 +1,240 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import joblib
+
+CACHE_DIR = 'stage_cache'  # Directory the cached stage outputs are stored in
+CACHE_MAX_BYTES = 2 * 1024 ** 3  # The least recently used outputs are removed when the cache is bigger than this
+HASH_BLOCK_BYTES = 1024 ** 2  # Bytes of an upload hashed at one time
+
+# Where a chain of stages resumes from: the key of each stage, the stages before the last cached stage that
+# are neither run nor loaded and the outputs that were loaded by stage name
+Resume = collections.namedtuple("Resume", ["keys", "skipped", "outputs"])
+
+
+class StageCache:
+    """ A disk cache of the output of each stage of a build. Outputs are content addressed: the key of a stage
+    is a hash of the key of the stage before it and the stage's parameters, and the first key is a hash of the
+    uploaded file. So the keys form a chain and changing a parameter only misses the stages from that point on,
+    an unchanged prefix of the pipeline is served from the cache.
+
+    Reading an output marks it as used so the least recently used outputs are removed first once the cache
+    grows over its size limit.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        """Creates the cache
+
+            Args:
+                cache_dir (string): Directory to keep the outputs in
+                max_bytes (int): The maximum size of the cache
+            """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def file_key(self, file):
+        """Hashes the contents of a file, the file is read from its current position then moved back to it
+
+            Args:
+                file (file): A binary file object that can seek
+
+            Returns:
+                (string): the key
+            """
+        stream = getattr(file, "stream", file)
+        start = stream.tell()
+
+        digest = hashlib.sha256()
+        for block in iter(lambda: stream.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+        stream.seek(start)
+
+        return digest.hexdigest()
+
+    def key(self, stage, parent_key, params):
+        """Works out the key of a stage's output
+
+            Args:
+                stage (string): The name of the stage
+                parent_key (string): The key of the stage before this one
+                params: Anything json serialisable that changes the output of the stage
+
+            Returns:
+                (string): the key
+            """
+        content = json.dumps([stage, parent_key, params], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def chain(self, parent_key, stages):
+        """Works out the keys of a chain of stages up front, before any of them are run
+
+            Args:
+                parent_key (string): The key of the input of the first stage
+                stages (list): The name and parameters of each stage in the order they run
+
+            Returns:
+                (dict): the key of each stage's output in the order they run
+            """
+        keys = {}
+        for stage, params in stages:
+            parent_key = keys[stage] = self.key(stage, parent_key, params)
+
+        return keys
+
+    def resume(self, keys, needs=None):
+        """Finds the last stage of a chain whose output is in the cache and loads it with the outputs of the
+        earlier stages that the stages after it still use. The other stages before it are skipped without
+        loading their outputs, and the stages after it are not in the cache so they don't need to be looked up.
+
+            Args:
+                keys (dict): The key of each stage's output in the order they run, from chain
+                needs (dict): The earlier stages whose outputs are loaded as well when the chain resumes from
+                    a stage, by stage name
+
+            Returns:
+                (Resume): the keys, the skipped stages and the loaded outputs
+            """
+        needs = needs or {}
+        stages = list(keys)
+
+        for index in reversed(range(len(stages))):
+            load = [stages[index]] + needs.get(stages[index], [])
+            if not all(self.contains(keys[stage]) for stage in load):
+                continue
+
+            # An output can still be removed by another process before it is read
+            outputs = {}
+            for stage in load:
+                hit, outputs[stage] = self.get(keys[stage])
+                if not hit:
+                    break
+            else:
+                return Resume(keys, [stage for stage in stages[:index] if stage not in outputs], outputs)
+
+        return Resume(keys, [], {})
+
+    def contains(self, key):
+        """Checks if an output is in the cache without reading it
+
+            Args:
+                key (string): The key of the output
+
+            Returns:
+                (bool): True if the output is in the cache
+            """
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        """Gets an output
+
+            Args:
+                key (string): The key of the output
+
+            Returns:
+                (bool): True if the output is in the cache
+                (object): the output or None
+            """
+        path = self.path(key)
+        try:
+            value = joblib.load(path)
+        except (FileNotFoundError, EOFError):
+            return False, None
+
+        # Mark the output as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return True, value
+
+    def put(self, key, value):
+        """Stores an output then removes the least recently used outputs if the cache is too big
+
+            Args:
+                key (string): The key of the output
+                value (object): The output, anything that can be pickled
+            """
+        # The temporary file is unique across the processes and threads sharing the cache directory
+        temp_file, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(temp_file)
+        try:
+            joblib.dump(value, temp_path)
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        self.evict()
+
+    def run(self, stage, parent_key, params, function):
+        """Gets the output of a stage from the cache or runs the stage and stores its output
+
+            Args:
+                stage (string): The name of the stage
+                parent_key (string): The key of the stage before this one
+                params: Anything json serialisable that changes the output of the stage
+                function (function): Runs the stage and returns its output
+
+            Returns:
+                (object): the output
+                (string): the key of the output
+                (bool): True if the output came from the cache
+            """
+        key = self.key(stage, parent_key, params)
+
+        hit, value = self.get(key)
+        if not hit:
+            value = function()
+            self.put(key, value)
+
+        return value, key, hit
+
+    def evict(self):
+        """Removes the least recently used outputs until the cache is under its size limit"""
+        with self.lock:
+            entries = []
+            for filename in os.listdir(self.cache_dir):
+                if not filename.endswith(".joblib"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, filename))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+
+            total = sum(entry[1] for entry in entries)
+            for _, size, filename in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def size(self):
+        """Gets the size of the cache
+
+            Returns:
+                (int): the bytes used by the stored outputs
+            """
+        return sum(os.path.getsize(os.path.join(self.cache_dir, filename))
+                   for filename in os.listdir(self.cache_dir) if filename.endswith(".joblib"))
+
+    def path(self, key):
+        """Gets the path of an output
+
+            Args:
+                key (string): The key of the output
+
+            Returns:
+                (string): the path
+            """
+        return os.path.join(self.cache_dir, "{}.joblib".format(key))
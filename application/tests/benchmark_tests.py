@@ -0,0 +1,81 @@
+import copy
+import io
+import numpy as np
+import pandas as pd
+from application import model_builder
+from application.file_manager import csv_to_dataframe_from_bin_file
+from benchmarks import synthetic_data
+from benchmarks import benchmark
+
+
+def test_synthetic_data_is_seeded_and_has_the_null_rates():
+
+    # Act
+    df = synthetic_data.generate(5000, seed=1)
+
+    # Assert
+    assert df.equals(synthetic_data.generate(5000, seed=1))
+    assert not df.equals(synthetic_data.generate(5000, seed=2))
+    assert list(df.columns) == [name for name, _ in synthetic_data.FIELDS]
+    for name, rate in synthetic_data.NULL_RATES.items():
+        assert abs((df[name] == "").mean() - rate) < 0.02
+    assert abs((df["Application Success Score"] == "100").mean() - synthetic_data.SUCCESS_RATE) < 0.02
+
+
+def test_synthetic_csv_passes_validation():
+
+    # Arrange
+    fields = synthetic_data.FIELDS
+    data = synthetic_data.generate_csv(2000)
+
+    # Act
+    df = csv_to_dataframe_from_bin_file(io.BytesIO(data), [name for name, _ in fields],
+                                        model_builder.field_dtypes(fields), skip_header=True)
+    df, scales = model_builder.validate_types(df, fields, return_scales=True)
+    x, y, model_fields = model_builder.stripdown_features(df, fields)
+
+    # Assert
+    assert df["Gross Income"].dtype == np.float64
+    assert scales == {"Debt Service Ratio": 1, "Loan Valuation Ratio": 100}
+    assert "Default Amount" not in x.columns
+    assert "Phone" not in x.columns
+    assert set(pd.unique(y)) == {0, 1}
+
+
+def test_compare_reports_regressions_over_the_tolerance():
+
+    # Arrange
+    baseline = {"1000": {"build": {"wall_seconds": 10.0, "peak_rss_bytes": 1000},
+                         "stages": {"cluster": {"wall_seconds": 4.0, "peak_rss_bytes": 1000},
+                                    "rank": {"wall_seconds": 0.001, "peak_rss_bytes": 1000}}}}
+    results = copy.deepcopy(baseline)
+    results["1000"]["build"]["wall_seconds"] = 12.0
+    results["1000"]["stages"]["cluster"]["wall_seconds"] = 6.0
+    results["1000"]["stages"]["rank"]["wall_seconds"] = 0.01
+    results["1000"]["stages"]["rank"]["peak_rss_bytes"] = 2000
+
+    # Act
+    regressions = benchmark.compare(results, baseline, time_tolerance=0.25, memory_tolerance=0.25)
+
+    # Assert
+    assert len(regressions) == 2
+    assert regressions[0].startswith("1000 rows cluster wall_seconds")
+    assert regressions[1].startswith("1000 rows rank peak_rss_bytes")
+    assert benchmark.compare(results, {}, allow_missing=True) == []
+
+
+def test_compare_reports_missing_baselines_unless_allowed():
+
+    # Arrange
+    baseline = {"1000": {"build": {"wall_seconds": 10.0, "peak_rss_bytes": 1000},
+                         "stages": {"cluster": {"wall_seconds": 4.0, "peak_rss_bytes": 1000}}}}
+    results = copy.deepcopy(baseline)
+    results["1000"]["stages"]["rank"] = {"wall_seconds": 0.01, "peak_rss_bytes": 1000}
+    results["10000"] = copy.deepcopy(baseline["1000"])
+
+    # Act
+    regressions = benchmark.compare(results, baseline)
+
+    # Assert
+    assert regressions == ["1000 rows rank: no baseline", "10000 rows: no baseline"]
+    assert benchmark.compare(results, baseline, allow_missing=True) == []
@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from concurrent.futures import CancelledError
+import pandas as pd
+import pytest
+from application import build_jobs
+from application import model_builder
+
+
+class UploadedFile:
+    """A stand in for an uploaded file that can be saved"""
+
+    def __init__(self, content):
+        self.content = content
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.content)
+
+
+def wait_until_finished(manager, job_id):
+    for _ in range(200):
+        status = manager.status(job_id)
+        if status["state"] in build_jobs.FINISHED_STATES:
+            return status
+        time.sleep(0.05)
+    return manager.status(job_id)
+
+
+def test_build_job_completes_with_result(tmp_path, monkeypatch):
+
+    # Arrange
+    def build(file, data_template_path, fields, ga_profile_id, ga_cred_file_location, report=None,
+              progress=None, cancel_event=None):
+        assert file.read() == b"Email,Answer\n"
+        for stage in model_builder.BUILD_STAGES:
+            progress(stage)
+        report["cluster_mode"] = "full"
+        return pd.DataFrame({"Email": ["a@x.com"], "Prob": [0.9]})
+
+    monkeypatch.setattr(model_builder, "build_and_predict", build)
+    jobs_dir = str(tmp_path)
+    manager = build_jobs.BuildJobManager(jobs_dir)
+
+    # Act
+    job_id = manager.submit(UploadedFile(b"Email,Answer\n"), "data_template.csv", [], "0")
+    status = wait_until_finished(manager, job_id)
+
+    # Assert
+    assert status["state"] == build_jobs.COMPLETED
+    assert status["progress"] == 1.0
+    assert all(stage["finished"] is not None for stage in status["stages"])
+    assert manager.result(job_id) == {"data": [{"Email": "a@x.com", "Prob": 0.9}],
+                                      "report": {"cluster_mode": "full"}}
+
+
+def test_build_job_records_error(tmp_path, monkeypatch):
+
+    # Arrange
+    def build(*args, **kwargs):
+        raise ValueError("There must only be one response variable marked for the data set.")
+
+    monkeypatch.setattr(model_builder, "build_and_predict", build)
+    jobs_dir = str(tmp_path)
+    manager = build_jobs.BuildJobManager(jobs_dir)
+
+    # Act
+    job_id = manager.submit(UploadedFile(b""), "data_template.csv", [], "0")
+    status = wait_until_finished(manager, job_id)
+
+    # Assert
+    assert status["state"] == build_jobs.FAILED
+    assert status["error"] == "There must only be one response variable marked for the data set."
+    assert manager.result(job_id) is None
+
+
+def test_build_job_cancelled_while_running(tmp_path, monkeypatch):
+
+    # Arrange
+    started = threading.Event()
+
+    def build(file, data_template_path, fields, ga_profile_id, ga_cred_file_location, report=None,
+              progress=None, cancel_event=None):
+        progress("parse")
+        started.set()
+        cancel_event.wait(5)
+        progress("validate_types")
+        return pd.DataFrame()
+
+    monkeypatch.setattr(model_builder, "build_and_predict", build)
+    jobs_dir = str(tmp_path)
+    manager = build_jobs.BuildJobManager(jobs_dir)
+
+    # Act
+    job_id = manager.submit(UploadedFile(b""), "data_template.csv", [], "0")
+    started.wait(5)
+    cancelled = manager.cancel(job_id)
+    status = wait_until_finished(manager, job_id)
+
+    # Assert
+    assert cancelled
+    assert status["state"] == build_jobs.CANCELLED
+    assert not manager.cancel(job_id)
+
+
+def test_build_job_cancelled_from_another_process_stops_the_search(monkeypatch, tmp_path):
+
+    # Arrange - the search only polls the event, as the model search does
+    started = threading.Event()
+
+    def build(file, data_template_path, fields, ga_profile_id, ga_cred_file_location, report=None,
+              progress=None, cancel_event=None):
+        progress("best_model_probabilities")
+        started.set()
+        for _ in range(100):
+            if cancel_event.is_set():
+                raise CancelledError()
+            time.sleep(0.05)
+        return pd.DataFrame()
+
+    monkeypatch.setattr(model_builder, "build_and_predict", build)
+    manager = build_jobs.BuildJobManager(str(tmp_path))
+    other_process = build_jobs.BuildJobManager(str(tmp_path))
+
+    # Act
+    job_id = manager.submit(UploadedFile(b""), "data_template.csv", [], "0")
+    started.wait(5)
+    cancelled = other_process.cancel(job_id)
+    status = wait_until_finished(manager, job_id)
+
+    # Assert
+    assert cancelled
+    assert status["state"] == build_jobs.CANCELLED
+    assert status["finished"] - status["started"] < 4
+
+
+def test_jobs_of_a_stopped_process_are_failed(tmp_path):
+
+    # Arrange - a job left running by a process that has since stopped
+    manager = build_jobs.BuildJobManager(str(tmp_path))
+    job_id = "0" * 32
+    os.makedirs(manager.job_path(job_id))
+    owner = dict(build_jobs.process_identity(), created=0)
+    manager.write_status(job_id, {"job_id": job_id, "state": build_jobs.RUNNING, "stage": "cluster", "stages": [],
+                                  "progress": 0.5, "error": None, "finished": None, "owner": owner})
+
+    # Act
+    status = build_jobs.BuildJobManager(str(tmp_path)).read_json(job_id, "status.json")
+
+    # Assert
+    assert status["state"] == build_jobs.FAILED
+    assert status["error"] == build_jobs.ABANDONED_ERROR
+
+
+def test_build_job_invalid_id(tmp_path):
+
+    # Arrange
+    manager = build_jobs.BuildJobManager(str(tmp_path))
+
+    # Act and Assert
+    assert manager.status("../../etc") is None
+    assert not manager.cancel("../../etc")
+
+
+def test_run_now_shares_the_worker_limit_with_jobs(tmp_path):
+
+    # Arrange
+    jobs_dir = str(tmp_path)
+    manager = build_jobs.BuildJobManager(jobs_dir, max_workers=1)
+    release = threading.Event()
+    started = []
+    results = []
+
+    def build(name):
+        started.append(name)
+        release.wait(5)
+        if name == "bad":
+            raise ValueError("Bad file")
+        return name
+
+    # Act
+    threads = [threading.Thread(target=lambda name=name: results.append(manager.run_now(build, name)))
+               for name in ["first", "second"]]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+    started_while_busy = list(started)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert started_while_busy == ["first"]
+    assert results == ["first", "second"]
+    with pytest.raises(ValueError):
+        manager.run_now(build, "bad")
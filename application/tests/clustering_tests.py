@@ -1,6 +1,11 @@
+import threading
+from concurrent.futures import CancelledError
 import pandas as pd
 import numpy as np
+import pytest
 from application import model_builder
+from application import clara
+from sklearn.metrics import pairwise_distances, silhouette_score
 
 def test_cluster():
 
@@ -14,9 +19,194 @@ def test_cluster():
     # Act - Data is arranged to have 2 extreme clusters to force predictable results
     cluster_labels, cluster_count = list(model_builder.cluster(df, random_state=0))
 
+    # Assert - the numbers given to the clusters depend on the medoids K Medoids starts from
+    assert cluster_labels[0] == cluster_labels[5] != cluster_labels[1]
+    assert len(set(cluster_labels[1:5])) == 1
+    assert cluster_count == 2
+
+def test_cluster_clara_mode():
+
+    # Arrange - 2 extreme clusters much larger than a clara sample
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame()
+    df["Some Feature"] = np.concatenate([rng.normal(30, 1, 300), rng.normal(50, 1, 300)])
+    df["Some Feature 2"] = np.concatenate([rng.normal(5, 0.1, 300), rng.normal(6, 0.1, 300)])
+    report = {}
+
+    # Act
+    cluster_labels, cluster_count = model_builder.cluster(df, random_state=0, mode="clara", report=report)
+
     # Assert
-    assert list(cluster_labels) == [0, 1, 1, 1, 1, 0]
     assert cluster_count == 2
+    assert len(set(cluster_labels[:300])) == 1
+    assert len(set(cluster_labels[300:])) == 1
+    assert cluster_labels[0] != cluster_labels[300]
+    medoids = report.pop("medoids")
+    cluster_k = report.pop("cluster_k")
+    assert report == {"cluster_mode": "clara", "cluster_count": 2, "k_selection": "medoid"}
+    assert [record["k"] for record in cluster_k] == [2, 3, 4, 5, 6, 7, 8]
+    assert all(record["wall_seconds"] > 0 and record["peak_rss_bytes"] > 0 for record in cluster_k)
+    assert sorted(cluster_labels[medoids]) == [0, 1]
+
+
+def test_cluster_chooses_full_mode_for_small_data():
+
+    # Arrange
+    df = pd.DataFrame()
+    df["Some Feature"] = [30.0, 40.0, 50.0, 50, 49, 29]
+    df["Some Feature 2"] = [5, 6, 6, 6, 5.9, 4.9]
+    report = {}
+
+    # Act
+    model_builder.cluster(df, random_state=0, report=report)
+
+    # Assert
+    assert report["cluster_mode"] == "full"
+
+
+def test_cluster_with_each_k_selection():
+
+    # Arrange
+    df = pd.DataFrame()
+    df["Some Feature"] = [30.0, 40.0, 50.0, 50, 49, 29]
+    df["Some Feature 2"] = [5, 6, 6, 6, 5.9, 4.9]
+    df["Some Feature 3"] = [100, 90, 90, 91, 90, 101]
+
+    for k_selection in ["medoid", "precomputed", "euclidean"]:
+
+        # Act
+        cluster_labels, cluster_count = model_builder.cluster(df, random_state=0, k_selection=k_selection)
+
+        # Assert
+        assert cluster_labels[0] == cluster_labels[5] != cluster_labels[1]
+        assert len(set(cluster_labels[1:5])) == 1
+        assert cluster_count == 2
+
+
+def test_cluster_parallel_sweep_matches_serial_sweep(monkeypatch):
+
+    # Arrange
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame()
+    df["Some Feature"] = np.concatenate([rng.normal(30, 1, 50), rng.normal(50, 1, 50)])
+    df["Some Feature 2"] = rng.rand(100)
+    monkeypatch.setattr(model_builder, "PARALLEL_SWEEP_MIN_ROWS", 0)
+
+    # Act
+    serial_labels, serial_count = model_builder.cluster(df, random_state=0, n_jobs=1)
+    parallel_labels, parallel_count = model_builder.cluster(df, random_state=0, n_jobs=2)
+
+    # Assert
+    assert list(serial_labels) == list(parallel_labels)
+    assert serial_count == parallel_count
+
+
+def test_cluster_unknown_k_selection_throws_error():
+
+    # Arrange
+    df = pd.DataFrame()
+    df["Some Feature"] = [30.0, 40.0, 50.0, 50, 49, 29]
+
+    # Act and Assert
+    with pytest.raises(ValueError):
+        model_builder.cluster(df, k_selection="Invalid")
+
+
+def test_simplified_silhouette():
+
+    # Arrange - row 0 is 1 from its medoid and 3 from the other medoid, the rest are on their medoid
+    medoid_distances = np.array([[1.0, 3.0], [0.0, 2.0], [2.0, 0.0]])
+    labels = np.array([0, 0, 1])
+
+    # Act
+    score = clara.simplified_silhouette(medoid_distances, labels)
+
+    # Assert
+    assert score == pytest.approx((2 / 3 + 1 + 1) / 3)
+
+
+def test_stratified_sample_keeps_proportions():
+
+    # Arrange
+    strata = np.array([0] * 900 + [1] * 100)
+
+    # Act
+    sample = clara.stratified_sample(1000, 100, strata, random_state=0)
+
+    # Assert
+    assert len(sample) == 100
+    assert len(set(sample)) == 100
+    assert (strata[sample] == 1).sum() == 10
+
+
+def test_weighted_silhouettes_match_the_repeated_rows():
+
+    # Arrange - row 0 is alone in its cluster
+    rng = np.random.RandomState(0)
+    points = rng.normal(size=(12, 2))
+    weights = rng.randint(1, 4, 12)
+    weights[0] = 1
+    labels = np.arange(12) % 3
+    labels[0] = 3
+    matrix = pairwise_distances(points)
+    repeated = np.repeat(np.arange(12), weights)
+    medoid_distances = matrix[:, [1, 2, 3, 0]]
+
+    # Act
+    silhouette = clara.weighted_silhouette(matrix, labels, weights)
+    simplified = clara.simplified_silhouette(medoid_distances, labels, weights)
+
+    # Assert
+    assert np.isclose(silhouette, silhouette_score(matrix[np.ix_(repeated, repeated)], labels[repeated],
+                                                   metric="precomputed"))
+    assert np.isclose(simplified, clara.simplified_silhouette(medoid_distances[repeated], labels[repeated]))
+
+
+def test_cluster_weighted_distinct_rows():
+
+    # Arrange - the distinct rows of 2 extreme clusters and the number of times each appears
+    df = pd.DataFrame()
+    df["Some Feature"] = [30.0, 46.0, 50.0, 49, 29]
+    df["Some Feature 2"] = [5, 6, 6, 5.9, 4.9]
+    weights = np.array([3, 1, 4, 2, 2])
+
+    for mode in ["full", "clara"]:
+        report = {}
+
+        # Act
+        cluster_labels, cluster_count = model_builder.cluster(df, random_state=0, mode=mode, report=report,
+                                                              weights=weights)
+
+        # Assert
+        assert cluster_count == 2
+        assert cluster_labels[0] == cluster_labels[4] != cluster_labels[1]
+        assert cluster_labels[1] == cluster_labels[2] == cluster_labels[3]
+        assert sorted(cluster_labels[report["medoids"]]) == [0, 1]
+
+
+def test_cluster_weighted_distinct_rows_like_the_repeated_rows():
+
+    # Arrange
+    df = pd.DataFrame()
+    df["Some Feature"] = [30.0, 46.0, 50.0, 49, 29]
+    df["Some Feature 2"] = [5, 6, 6, 5.9, 4.9]
+    weights = np.array([3, 1, 4, 2, 2])
+    repeated = np.repeat(np.arange(len(df)), weights)
+
+    for k_selection in ["medoid", "precomputed"]:
+
+        # Act - both are clustered on the Gower distances as precomputed distances
+        weighted_labels, weighted_count = model_builder.cluster(df, random_state=0, mode="full", weights=weights,
+                                                                k_selection=k_selection)
+        repeated_labels, repeated_count = model_builder.cluster(df.iloc[repeated].reset_index(drop=True),
+                                                                random_state=0, mode="full",
+                                                                k_selection=k_selection)
+
+        # Assert - the same clusters, whatever number each is given
+        pairs = set(zip(weighted_labels[repeated], repeated_labels))
+        assert weighted_count == repeated_count
+        assert len(pairs) == len(set(repeated_labels)) == weighted_count
+
 
 def test_determine_target_cluster_success():
 
@@ -55,3 +245,55 @@ def test_determine_best_prediction_model():
                          0.9989427243019453,
                          0.9989079413299201,
                          0.011039884561524096]
+
+
+def test_best_prediction_model_cancels_model_that_cannot_win():
+    # Arrange - the logistic regression separates the clusters perfectly
+    cluster_labels = np.array([0, 1] * 20)
+    df = pd.DataFrame()
+    df["Some Feature"] = cluster_labels * 10.0
+    df["Some Feature 2"] = np.arange(40) % 3
+    report = {}
+
+    # Act - the grid search takes much longer than the logistic regression
+    res = model_builder.best_model_probabilities(df, cluster_labels, target_cluster=1, cv=2, random_state=0,
+                                                 rf_search="grid", report=report)
+
+    # Assert
+    assert report["lr_score"] == 1
+    assert report["best_model"] == "lr"
+    assert report["cancelled_model"] == "rf"
+    assert len(res) == 40
+
+
+def test_best_prediction_model_stops_when_the_caller_cancels():
+    # Arrange - the job was cancelled before the models finished
+    cluster_labels = np.array([0, 1] * 20)
+    df = pd.DataFrame()
+    df["Some Feature"] = cluster_labels * 10.0
+    df["Some Feature 2"] = np.arange(40) % 3
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    # Act and Assert
+    with pytest.raises(CancelledError):
+        model_builder.best_model_probabilities(df, cluster_labels, target_cluster=1, cv=2, random_state=0,
+                                               rf_search="oob", cancel_event=cancel_event)
+
+
+def test_best_prediction_model_time_limit():
+    # Arrange
+    cluster_labels = np.array([0, 1, 1, 1, 1, 0])
+    df = pd.DataFrame()
+    df["Some Feature"] = [30.0, 40.0, 50.0, 50, 49, 29]
+    df["Some Feature 2"] = [5, 6, 6, 6, 5.9, 4.9]
+    report = {}
+
+    # Act - no time for the slower model once the faster one finishes
+    res = model_builder.best_model_probabilities(df, cluster_labels, target_cluster=1, cv=2, random_state=0,
+                                                 time_limit=0, rf_search="oob", report=report)
+
+    # Assert
+    assert report["cancelled_model"] != report["best_model"]
+    assert report[report["best_model"] + "_score"] is not None
+    assert len(res) == 6
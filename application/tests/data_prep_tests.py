@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import pytest
 from pandas.testing import assert_frame_equal, assert_series_equal
 from application import model_builder
@@ -418,3 +419,144 @@ def test_categorical_encoding():
 
     # Assert
     assert list(x.columns) == ["Some Feature 3", "Cat_Maybe", "Cat_No", "Cat_Yes", "Cat2_Maybe2", "Cat2_No2", "Cat2_Yes2"]
+
+
+def test_categorical_encoding_with_categories_keeps_layout():
+
+    # Arrange
+    fields = [["Cat", "Yes/No"], ["Some Feature 3", "Numeric"]]
+    df = pd.DataFrame()
+    df["Cat"] = ["Yes", "No", "Maybe", "Yes"]
+    df["Some Feature 3"] = [100, 90, 90, 91]
+    new_df = pd.DataFrame()
+    new_df["Cat"] = ["No", "Unseen"]
+    new_df["Some Feature 3"] = [95, 96]
+
+    # Act
+    categories = model_builder.encoding_categories(df, fields)
+    x = model_builder.encode_categorical(new_df, fields, categories)
+
+    # Assert
+    assert categories == {"Cat": ["Maybe", "No", "Yes"]}
+    assert list(x.columns) == ["Some Feature 3", "Cat_Maybe", "Cat_No", "Cat_Yes"]
+    assert x[["Cat_Maybe", "Cat_No", "Cat_Yes"]].astype(int).values.tolist() == [[0, 1, 0], [0, 0, 0]]
+
+
+def test_knn_imputer_reused_to_transform():
+
+    # Arrange
+    fields = [["Some Feature", "Numeric"], ["Some Feature 2", "Numeric"]]
+    df = pd.DataFrame()
+    df["Some Feature"] = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+    df["Some Feature 2"] = [10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0]
+    new_df = pd.DataFrame()
+    new_df["Some Feature"] = [np.nan]
+    new_df["Some Feature 2"] = [15.0]
+
+    # Act
+    _, imputer = model_builder.impute_nulls(df, fields, return_imputer=True)
+    result = model_builder.impute_nulls(new_df, fields, imputer=imputer)
+
+    # Assert
+    assert result["Some Feature"][0] == 3.5
+
+
+def test_compact_mode_keeps_categories_and_small_dtypes():
+
+    # Arrange
+    df = pd.DataFrame({"Status": ["Married", "Single", " ", "Married"], "Answer": ["100", "0", "100", "0"]})
+    fields = [["Status", "Value Set"], ["Answer", "Response Variable"]]
+
+    # Act
+    x = model_builder.validate_types(df, fields, compact=True)
+    validated_status = x["Status"].dtype
+    x, y, fields = model_builder.stripdown_features(x, fields)
+    x = model_builder.impute_nulls(x, fields)
+    imputed_status = list(x["Status"])
+    encoded = model_builder.encode_categorical(x, fields, model_builder.encoding_categories(x, fields), compact=True)
+
+    # Assert - the field is replaced by its encoded columns in place
+    assert validated_status.name == "category"
+    assert imputed_status == ["Married", "Single", "No Data", "Married"]
+    assert encoded is x and "Status" not in x.columns
+    assert list(encoded.columns) == ["Status_Married", "Status_No Data", "Status_Single"]
+    assert all(dtype == np.uint8 for dtype in encoded.dtypes)
+    assert list(encoded["Status_No Data"]) == [0, 0, 1, 0]
+
+
+def test_compact_mode_validates_numbers_as_float32():
+
+    # Arrange
+    df = pd.DataFrame({"Income": ["$1,000", "", "$3,000"], "Ratio": [0.1, 0.2, 0.3], "Answer": [100, 0, 100]})
+    fields = [["Income", "Money"], ["Ratio", "Percentage"], ["Answer", "Response Variable"]]
+
+    # Act
+    x = model_builder.validate_types(df, fields, compact=True)
+
+    # Assert
+    assert x["Income"].dtype == np.float32
+    assert x["Ratio"].dtype == np.float32
+    assert np.allclose(x["Ratio"], [10, 20, 30])
+
+
+def test_feature_pipeline_transforms_new_data_like_the_build():
+
+    # Arrange
+    fields = [["Email", "Contact Details"], ["Income", "Money"], ["DSR", "Percentage"], ["Marital", "Value Set"],
+              ["Answer", "Response Variable"]]
+    df = pd.DataFrame({"Email": ["a@x.com", "b@x.com", "c@x.com", "d@x.com", "e@x.com", "f@x.com", "g@x.com"],
+                       "Income": ["$1,000", "$2,000", "$3,000", "$4,000", "$5,000", "$6,000", "$7,000"],
+                       "DSR": ["10%", "20%", "30%", "40%", "50%", "60%", "70%"],
+                       "Marital": ["Single", "Married", "", "Married", "Single", "Married", "Single"],
+                       "Answer": ["100", "0", "100", "0", "100", "0", "100"]})
+    new_df = df.iloc[[2, 1]].copy()
+
+    # Act
+    pipeline = model_builder.FeaturePipeline(fields)
+    x, y = pipeline.fit_transform(df)
+    transformed = pipeline.transform(new_df)
+
+    # Assert
+    assert pipeline.model_fields == fields[1:4]
+    assert list(x.columns) == ["Income", "DSR", "Marital_Married", "Marital_No Data", "Marital_Single"]
+    assert list(y) == [1, 0, 1, 0, 1, 0, 1]
+    assert list(transformed.columns) == pipeline.columns
+    assert_frame_equal(transformed, x.iloc[[2, 1]].reset_index(drop=True), check_dtype=False)
+    with pytest.raises(ValueError):
+        model_builder.FeaturePipeline(fields).transform(new_df)
+
+
+def test_collapse_duplicates_counts_rows_and_spreads_back():
+
+    # Arrange
+    x = pd.DataFrame({"Income": [3.0, 1.0, 3.0, 2.0, 1.0, 3.0],
+                      "Marital_Single": np.array([1, 0, 1, 1, 0, 1], dtype=np.uint8)})
+
+    # Act
+    distinct, weights, rows, first_rows = model_builder.collapse_duplicates(x)
+    no_duplicates = model_builder.collapse_duplicates(distinct)
+
+    # Assert
+    assert distinct.values.tolist() == [[3, 1], [1, 0], [2, 1]]
+    assert distinct["Marital_Single"].dtype == np.uint8
+    assert list(weights) == [3, 2, 1]
+    assert list(rows) == [0, 1, 0, 2, 1, 0]
+    assert list(first_rows) == [0, 1, 3]
+    assert_frame_equal(distinct.iloc[rows].reset_index(drop=True), x)
+    assert no_duplicates[0] is distinct and no_duplicates[1] is None
+
+
+def test_collapse_duplicates_with_bool_and_float32_columns():
+
+    # Arrange
+    x = pd.DataFrame({"Income": np.array([3.0, 1.0, 3.0, 1.0], dtype=np.float32),
+                      "Owner": [True, False, True, True]})
+
+    # Act
+    distinct, weights, rows, first_rows = model_builder.collapse_duplicates(x)
+
+    # Assert
+    assert distinct.values.tolist() == [[3, True], [1, False], [1, True]]
+    assert distinct["Owner"].dtype == bool
+    assert list(weights) == [2, 1, 1]
+    assert list(rows) == [0, 1, 0, 2]
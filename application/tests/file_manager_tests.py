@@ -0,0 +1,93 @@
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+from application import file_manager
+
+
+def test_csv_to_dataframe_parses_typed_columns():
+
+    # Arrange
+    file = BytesIO(b'"Name","Amount","Answer"\n"tom","3","100"\n"john","","0"\n"sarah","5.5","50"\n')
+    expect = pd.DataFrame()
+    expect["Name"] = ["tom", "john", "sarah"]
+    expect["Amount"] = [3.0, np.nan, 5.5]
+    expect["Answer"] = [100.0, 0.0, 50.0]
+
+    # Act
+    df = file_manager.csv_to_dataframe_from_bin_file(file, ["Name", "Amount", "Answer"],
+                                                     {"Amount": np.float64, "Answer": np.float64})
+
+    # Assert
+    assert_frame_equal(df, expect, check_dtype=False)
+    assert df["Amount"].dtype == np.float64
+
+
+def test_csv_to_dataframe_keeps_empty_strings_in_string_columns():
+
+    # Arrange
+    file = BytesIO(b'Status,Amount\n"",1\nNA,2\n')
+
+    # Act
+    df = file_manager.csv_to_dataframe_from_bin_file(file, ["Status", "Amount"], {"Amount": np.float64})
+
+    # Assert
+    assert list(df["Status"]) == ["", "NA"]
+
+
+def test_csv_to_dataframe_joins_chunks():
+
+    # Arrange
+    lines = ["Id,Amount"] + ["{},{}".format(i, i * 2) for i in range(25)]
+    file = BytesIO("\n".join(lines).encode("utf-8"))
+
+    # Act
+    df = file_manager.csv_to_dataframe_from_bin_file(file, ["Id", "Amount"], {"Amount": np.float64},
+                                                     chunk_rows=10)
+
+    # Assert
+    assert df.shape == (25, 2)
+    assert list(df.index) == list(range(25))
+    assert df["Amount"].sum() == 600
+
+
+def test_csv_to_dataframe_joins_categories_of_each_chunk():
+
+    # Arrange
+    file = BytesIO(b"Status,Amount\nSingle,1\nMarried,2\n,3\nDivorced,4\nSingle,5\n")
+
+    # Act
+    df = file_manager.csv_to_dataframe_from_bin_file(file, ["Status", "Amount"],
+                                                     {"Status": "category", "Amount": np.float64}, chunk_rows=2)
+
+    # Assert
+    assert pd.api.types.is_categorical_dtype(df["Status"])
+    assert list(df["Status"].cat.categories) == ["Divorced", "Married", "Single"]
+    assert list(df["Status"].astype(object).fillna("")) == ["Single", "Married", "", "Divorced", "Single"]
+    assert list(df["Amount"]) == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_csv_to_dataframe_throws_error_on_bad_number():
+
+    # Arrange
+    file = BytesIO(b'Id,Amount\n1,3d\n')
+
+    # Act and Assert
+    with pytest.raises(ValueError):
+        file_manager.csv_to_dataframe_from_bin_file(file, ["Id", "Amount"], {"Amount": np.float64})
+
+
+def test_csv_chunks_named_from_header():
+
+    # Arrange
+    file = BytesIO(b"Email,Income\na@x.com,1\nb@x.com,\nc@x.com,3\n")
+
+    # Act
+    chunks = list(file_manager.csv_chunks_from_bin_file(file, {"Income": np.float64}, chunk_rows=2))
+
+    # Assert
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert list(chunks[0].columns) == ["Email", "Income"]
+    assert np.isnan(chunks[0]["Income"][1])
+    assert chunks[1]["Email"][2] == "c@x.com"
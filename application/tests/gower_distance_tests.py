@@ -0,0 +1,102 @@
+import os
+import gower
+import numpy as np
+import pytest
+import pandas as pd
+from application import gower_distance
+
+
+def create_mixed_data():
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame()
+    df["Some Feature"] = rng.rand(60) * 100
+    df["Some Feature 2"] = rng.randint(0, 5, 60).astype(float)
+    df["Cat"] = rng.choice(["Yes", "No", "No Data"], 60)
+    df["Constant"] = [3.0] * 60
+    return df
+
+
+def test_gower_matrix_matches_gower_package():
+
+    # Arrange
+    df = create_mixed_data()
+
+    # Act
+    matrix = gower_distance.gower_matrix(df)
+
+    # Assert
+    assert matrix.dtype == np.float32
+    assert np.allclose(matrix, gower.gower_matrix(df), atol=1e-6)
+
+
+def test_gower_matrix_small_blocks_in_parallel():
+
+    # Arrange
+    df = create_mixed_data()
+
+    # Act - budget only allows a couple of rows per block
+    matrix = gower_distance.gower_matrix(df, memory_budget=6000, n_jobs=4)
+
+    # Assert
+    assert gower_distance.block_rows(60, 6000, 4) == 2
+    assert np.allclose(matrix, gower.gower_matrix(df), atol=1e-6)
+
+
+def test_gower_matrix_memory_mapped_to_scratch_file(tmp_path):
+
+    # Arrange
+    df = create_mixed_data()
+    scratch_path = str(tmp_path / "matrix.dat")
+
+    # Act
+    matrix = gower_distance.gower_matrix(df, scratch_path=scratch_path)
+
+    # Assert
+    assert isinstance(matrix, np.memmap)
+    assert os.path.getsize(scratch_path) == 60 * 60 * 4
+    assert np.allclose(matrix, gower.gower_matrix(df), atol=1e-6)
+
+    gower_distance.release_matrix(matrix)
+    assert not os.path.exists(scratch_path)
+
+
+def test_gower_matrix_removes_scratch_file_when_a_block_fails(tmp_path, monkeypatch):
+
+    # Arrange
+    scratch_path = str(tmp_path / "matrix.dat")
+
+    def failing_distances(self, rows, columns=None, out=None):
+        raise MemoryError()
+
+    monkeypatch.setattr(gower_distance.GowerFeatures, "distances", failing_distances)
+
+    # Act
+    with pytest.raises(MemoryError):
+        gower_distance.gower_matrix(create_mixed_data(), scratch_path=scratch_path)
+
+    # Assert
+    assert not os.path.exists(scratch_path)
+
+
+def test_gower_features_reject_missing_numbers():
+
+    # Arrange
+    df = create_mixed_data()
+    df.loc[[3, 7], "Some Feature"] = np.nan
+
+    # Act / Assert
+    with pytest.raises(ValueError, match="the field Some Feature has 2"):
+        gower_distance.GowerFeatures(df)
+
+
+def test_gower_distances_between_subsets():
+
+    # Arrange
+    features = gower_distance.GowerFeatures(create_mixed_data())
+
+    # Act
+    block = features.distances([0, 1, 2], [5, 6])
+
+    # Assert
+    assert block.shape == (3, 2)
+    assert np.allclose(block, gower_distance.gower_matrix(create_mixed_data())[[0, 1, 2]][:, [5, 6]])
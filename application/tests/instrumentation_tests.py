@@ -0,0 +1,132 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.datasets import make_friedman1
+from application import instrumentation
+from application import model_builder
+from application import logistic_regression_model
+
+
+def test_measure_records_time_and_memory():
+
+    # Act
+    with instrumentation.measure({"name": "test"}) as record:
+        data = np.ones(10 ** 7)
+        time.sleep(0.1)
+        del data
+
+    # Assert
+    assert record["name"] == "test"
+    assert record["wall_seconds"] >= 0.1
+    assert record["cpu_seconds"] >= 0
+    assert record["peak_rss_bytes"] > 8 * 10 ** 7
+
+
+def test_stage_timer_records_each_stage_with_shapes():
+
+    # Arrange
+    report = {}
+    timer = instrumentation.StageTimer(report)
+    df = pd.DataFrame({"a": [1, 2, 3], "b": [4, 5, 6]})
+
+    # Act
+    timer.start("first", df)
+    timer.finish(df[["a"]], df["b"])
+    timer.start("second", df)
+    timer.start("third")
+    timer.finish()
+
+    # Assert
+    assert [record["name"] for record in report["stages"]] == ["first", "second", "third"]
+    assert report["stages"][0]["input_shape"] == [3, 2]
+    assert report["stages"][0]["output_shape"] == [[3, 1], [3]]
+    assert "output_shape" not in report["stages"][1]
+
+
+def test_build_closes_the_stage_that_raises(tmp_path):
+
+    # Arrange
+    work_dir = str(tmp_path)
+    df = pd.DataFrame({"Email": ["{}@x.com".format(i) for i in range(20)],
+                       "Income": np.arange(20) * 1000.0,
+                       "Answer": [0, 100] * 10})
+    fields = [["Email", "Contact Details"], ["Income", "Numeric"], ["Answer", "Response Variable"]]
+    df.to_csv(work_dir + "/upload.csv", index=False)
+    open(work_dir + "/template.csv", "w").close()
+    report = {}
+
+    def progress(stage):
+        if stage == "validate_types":
+            raise RuntimeError("stopped")
+
+    # Act
+    with pytest.raises(RuntimeError):
+        with open(work_dir + "/upload.csv", "rb") as file:
+            model_builder.build_and_predict(file, work_dir + "/template.csv", fields, "0", report=report,
+                                            progress=progress)
+
+    # Assert
+    assert [record["name"] for record in report["stages"]] == ["parse", "merge_google_analytics", "validate_types"]
+    assert "wall_seconds" in report["stages"][-1]
+    assert instrumentation.sampler().peaks == {}
+
+
+def test_metrics_render_prometheus_text():
+
+    # Arrange
+    registry = instrumentation.MetricsRegistry()
+    report = {"stages": [{"name": "parse", "wall_seconds": 1.5, "cpu_seconds": 1.0, "peak_rss_bytes": 100}],
+              "cluster_k": [{"k": 2, "silhouette": 0.5, "wall_seconds": 2.0, "cpu_seconds": 2.0,
+                             "peak_rss_bytes": 200}]}
+
+    # Act
+    registry.observe_build(report)
+    registry.observe_build(report)
+    text = registry.render()
+
+    # Assert
+    assert '# TYPE lams_build_stage_seconds_total counter' in text
+    assert 'lams_build_stage_seconds_total{stage="parse"} 3.0' in text
+    assert 'lams_build_stage_total{stage="parse"} 2.0' in text
+    assert 'lams_cluster_k_peak_rss_bytes{k="2"} 200.0' in text
+
+
+def test_metrics_render_adds_up_every_process(tmp_path):
+
+    # Arrange - two worker processes sharing the metrics directory
+    first = instrumentation.MetricsRegistry(str(tmp_path), flush_interval=60)
+    second = instrumentation.MetricsRegistry(str(tmp_path), flush_interval=60)
+    first.add("http_requests_total", "HTTP request count", "counter", {"route": "/"}, 2)
+    first.add("memory_bytes", "Memory", "gauge", {}, 100)
+    second.add("http_requests_total", "HTTP request count", "counter", {"route": "/"}, 3)
+    second.add("memory_bytes", "Memory", "gauge", {}, 50)
+
+    # Act
+    first.flush()
+    second.flush()
+    text = first.render()
+
+    # Assert
+    assert 'lams_http_requests_total{route="/"} 5.0' in text
+    assert "lams_memory_bytes 50.0" in text
+    assert len(list(tmp_path.glob("metrics-*.json"))) == 2
+
+
+def test_logistic_regression_records_each_round():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+    y = np.where(y > np.median(y), 1, 0)
+    report = {}
+
+    # Act
+    best_score, _ = logistic_regression_model.determine_best_model_probabilities(pd.DataFrame(x), y, 10,
+                                                                               report=report)
+
+    # Assert
+    rounds = report["lr_rounds"]
+    assert [record["round"] for record in rounds] == list(range(len(rounds)))
+    assert rounds[0]["candidates"] == 1
+    assert rounds[1]["candidates"] == 10
+    assert rounds[-1]["best_score"] == best_score
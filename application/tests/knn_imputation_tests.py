@@ -0,0 +1,114 @@
+import pickle
+import numpy as np
+import pytest
+from sklearn.impute import KNNImputer
+from application import knn_imputation
+
+
+def missing_data(rows=200, columns=4, seed=0, missing_columns=None):
+    # Each row with missing values has one missing, from missing_columns or any column
+    rng = np.random.RandomState(seed)
+    x = rng.normal(size=(rows, columns))
+    missing_rows = rng.choice(rows, rows // 5, replace=False)
+    choices = np.arange(columns) if missing_columns is None else np.asarray(missing_columns)
+    x[missing_rows, rng.choice(choices, len(missing_rows))] = np.nan
+    return x
+
+
+def nearest_complete_rows(x, n_neighbors=6):
+    # Fills each missing value with the mean of the nearest complete rows by the columns the row has
+    complete = x[~np.isnan(x).any(axis=1)]
+    result = x.copy()
+    for row in np.flatnonzero(np.isnan(x).any(axis=1)):
+        observed = ~np.isnan(x[row])
+        distances = np.sqrt(((complete[:, observed] - x[row, observed]) ** 2).sum(axis=1))
+        neighbours = np.argsort(distances, kind="stable")[:n_neighbors]
+        result[row, ~observed] = complete[neighbours][:, ~observed].mean(axis=0)
+    return result
+
+
+def test_indexed_imputer_fills_from_the_nearest_complete_rows():
+
+    # Arrange
+    x = missing_data()
+
+    # Act
+    result = knn_imputation.IndexedKNNImputer(n_neighbors=6).fit_transform(x)
+
+    # Assert
+    np.testing.assert_allclose(result, nearest_complete_rows(x))
+
+
+def test_indexed_imputer_matches_knn_imputer_when_one_column_is_missing():
+
+    # Arrange - the rows that have the missing column are the complete rows, so KNNImputer uses the same donors
+    x = missing_data(missing_columns=[2])
+
+    # Act
+    expected = KNNImputer(n_neighbors=6).fit_transform(x)
+    result = knn_imputation.IndexedKNNImputer(n_neighbors=6).fit_transform(x)
+
+    # Assert
+    np.testing.assert_allclose(result, expected)
+
+
+def test_indexed_imputer_chunks_match_and_trees_are_not_saved():
+
+    # Arrange
+    x = missing_data(seed=1)
+    imputer = knn_imputation.IndexedKNNImputer(n_jobs=1).fit(x)
+    expected = imputer.transform(x)
+
+    # Act
+    chunked = knn_imputation.IndexedKNNImputer(chunk_rows=3, n_jobs=2).fit_transform(x)
+    loaded = pickle.loads(pickle.dumps(imputer))
+
+    # Assert
+    np.testing.assert_allclose(chunked, expected)
+    assert len(imputer.trees) > 0 and loaded.trees == {}
+    np.testing.assert_allclose(loaded.transform(x), expected)
+
+
+def test_indexed_imputer_keeps_a_bounded_sample_of_complete_rows():
+
+    # Arrange
+    x = missing_data(rows=500, seed=2)
+
+    # Act
+    imputer = knn_imputation.IndexedKNNImputer(max_donor_rows=50).fit(x)
+    result, mean_filled = imputer.transform(x, return_mean_filled=True)
+
+    # Assert
+    assert imputer.complete_.shape == (50, 4)
+    assert not np.isnan(imputer.complete_).any()
+    assert not np.isnan(result).any()
+    assert mean_filled == 0
+
+
+def test_indexed_imputer_uses_and_reports_the_means_on_large_or_empty_data():
+
+    # Arrange
+    x = np.array([[1.0, np.nan, 4.0], [3.0, 2.0, np.nan], [np.nan, 6.0, np.nan]], dtype=np.float32)
+    large = knn_imputation.IndexedKNNImputer(statistic_min_rows=2)
+    no_complete_rows = knn_imputation.IndexedKNNImputer()
+
+    # Act
+    with pytest.warns(knn_imputation.MeanFillWarning):
+        result, large_mean_filled = large.fit_transform(x, return_mean_filled=True)
+    with pytest.warns(knn_imputation.MeanFillWarning):
+        no_complete_result, no_complete_mean_filled = no_complete_rows.fit_transform(x, return_mean_filled=True)
+
+    # Assert
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, [[1, 4, 4], [3, 2, 4], [2, 6, 4]])
+    np.testing.assert_allclose(no_complete_result, result)
+    assert large_mean_filled == no_complete_mean_filled == 4
+    assert not hasattr(large, "mean_filled_")
+    assert no_complete_rows.complete_ is None
+
+
+def test_indexed_imputer_must_be_fitted():
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        knn_imputation.IndexedKNNImputer().transform(np.zeros((2, 2)))
@@ -0,0 +1,56 @@
+import sys
+from application import lazy_imports
+
+
+def test_lazy_module_imports_on_first_use_and_records_the_time():
+
+    # Arrange
+    recorder = lazy_imports.ImportRecorder()
+    sys.modules.pop("colorsys", None)
+    module = lazy_imports.LazyModule("colorsys")
+    lazy_imports.recorder, previous = recorder, lazy_imports.recorder
+
+    # Act
+    try:
+        imported_before_use = "colorsys" in sys.modules
+        rgb = module.hls_to_rgb(0, 0.5, 0)
+    finally:
+        lazy_imports.recorder = previous
+
+    # Assert
+    assert not imported_before_use
+    assert rgb == (0.5, 0.5, 0.5)
+    report = recorder.report(["colorsys", "not_a_module"])
+    assert report[0]["loaded"] and report[0]["source"] == "first use" and report[0]["seconds"] >= 0
+    assert report[1] == {"module": "not_a_module", "seconds": None, "source": None, "thread": None,
+                         "loaded": False}
+
+
+def test_warm_up_loads_in_the_background_and_skips_missing_modules():
+
+    # Arrange
+    recorder = lazy_imports.ImportRecorder()
+    sys.modules.pop("colorsys", None)
+    lazy_imports.recorder, previous = recorder, lazy_imports.recorder
+
+    # Act
+    try:
+        lazy_imports.warm_up(["not_a_module", "colorsys"]).join()
+    finally:
+        lazy_imports.recorder = previous
+
+    # Assert
+    record = recorder.report(["colorsys"])[0]
+    assert record["source"] == "warm up"
+    assert record["thread"] == "import-warm-up"
+
+
+def test_model_builder_does_not_import_the_heavy_dependencies():
+
+    # Act
+    from application import model_builder
+
+    # Assert
+    assert isinstance(model_builder.sklearn_extra_cluster, lazy_imports.LazyModule)
+    assert isinstance(model_builder.xlsxwriter, lazy_imports.LazyModule)
+    assert isinstance(model_builder.random_forest_model, lazy_imports.LazyModule)
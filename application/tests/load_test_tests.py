@@ -0,0 +1,59 @@
+import io
+import pytest
+from application import model_builder
+from application.file_manager import csv_to_dataframe_from_bin_file
+from benchmarks import load_test
+
+
+def test_fake_google_analytics_merges_with_the_build_files():
+
+    # Arrange
+    files, fields = load_test.build_files(count=1, rows=200)
+    fake = load_test.FakeGoogleAnalytics(200, seconds=0)
+    df = csv_to_dataframe_from_bin_file(io.BytesIO(files[0]), [name for name, _ in fields],
+                                        model_builder.field_dtypes(fields), skip_header=True)
+
+    # Act
+    model_builder.get_data, get_data = fake.get_data, model_builder.get_data
+    try:
+        df, fields = model_builder.merge_google_analytics(df, fields, "fake-profile", "cred.json")
+    finally:
+        model_builder.get_data = get_data
+
+    # Assert
+    assert fake.calls == 1
+    assert len(df) == 200
+    assert fields[-3:] == [["User Type", "Value Set"], ["Session Count", "Numeric"],
+                           ["Session Duration", "Numeric"]]
+    assert df["Session Count"].notna().sum() == len(fake.rows)
+
+
+def test_summarise_reports_throughput_percentiles_and_errors():
+
+    # Arrange
+    results = [{"kind": "details", "latency": 0.01 * (i + 1), "error": None} for i in range(100)]
+    results += [{"kind": "build", "latency": 2.0, "error": "HTTP 500"},
+                {"kind": "build", "latency": 4.0, "error": None}]
+
+    # Act
+    summary = load_test.summarise(results, seconds=10)
+
+    # Assert
+    assert summary["all"]["count"] == 102
+    assert summary["all"]["throughput"] == pytest.approx(10.2)
+    assert summary["details"]["latency"]["p50"] == pytest.approx(0.505)
+    assert summary["details"]["max"] == pytest.approx(1.0)
+    assert summary["details"]["error_rate"] == 0
+    assert summary["build"]["error_rate"] == 0.5
+    assert summary["build"]["errors"] == {"HTTP 500": 1}
+
+
+def test_parse_mix_checks_the_weights():
+
+    # Act
+    mix = load_test.parse_mix("build=1, details=20")
+
+    # Assert
+    assert mix == {"build": 1.0, "details": 20.0}
+    with pytest.raises(ValueError):
+        load_test.parse_mix("build")
@@ -0,0 +1,159 @@
+import time
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import pytest
+from application import model_registry
+from application import model_builder
+
+
+def test_registry_saves_lists_and_loads_bundles(tmp_path):
+
+    # Arrange
+    models_dir = str(tmp_path)
+    registry = model_registry.ModelRegistry(models_dir)
+
+    # Act
+    first = registry.save({"model_type": "lr", "model": [1, 2, 3]})
+    time.sleep(1.1)
+    second = registry.save({"model_type": "rf", "model": [4, 5]})
+
+    # Assert
+    assert [manifest["version"] for manifest in registry.list()] == [first, second]
+    assert registry.load(first)["model"] == [1, 2, 3]
+    assert registry.load()["version"] == second
+    assert registry.manifest(second)["model_type"] == "rf"
+
+
+def test_registry_pinned_model_is_the_default(tmp_path):
+
+    # Arrange
+    models_dir = str(tmp_path)
+    registry = model_registry.ModelRegistry(models_dir)
+    first = registry.save({"model": "first"})
+    time.sleep(1.1)
+    registry.save({"model": "second"})
+
+    # Act
+    registry.pin(first)
+    pinned = registry.load()["model"]
+    listed = [manifest["pinned"] for manifest in registry.list()]
+    registry.unpin()
+
+    # Assert
+    assert pinned == "first"
+    assert listed == [True, False]
+    assert registry.load()["model"] == "second"
+
+
+def test_registry_reuses_the_default_version_until_it_changes(tmp_path):
+
+    # Arrange
+    registry = model_registry.ModelRegistry(str(tmp_path), default_ttl=60)
+    other_process = model_registry.ModelRegistry(str(tmp_path))
+    first = registry.save({"model": "first"})
+    registry.default_version()
+    time.sleep(1.1)
+    second = other_process.save({"model": "second"})
+
+    # Act
+    reused = registry.default_version()
+    registry.pin(second)
+    pinned = registry.default_version()
+
+    # Assert
+    assert reused == first
+    assert pinned == second
+
+
+def test_registry_throws_error_for_unknown_version(tmp_path):
+
+    # Arrange
+    models_dir = str(tmp_path)
+    registry = model_registry.ModelRegistry(models_dir)
+
+    # Act and Assert
+    with pytest.raises(ValueError):
+        registry.load()
+    with pytest.raises(ValueError):
+        registry.pin("../../etc")
+    with pytest.raises(ValueError):
+        registry.load("20200101000000-0123abcd")
+
+
+def build_model(work_dir):
+    """Builds a model from a small random data set, saving it to a registry in work_dir"""
+    rng = np.random.RandomState(0)
+    n_rows = 120
+    df = pd.DataFrame()
+    df["Email"] = ["{}@x.com".format(i) for i in range(n_rows)]
+    df["Income"] = rng.normal(50000, 10000, n_rows).round()
+    df["Dependants"] = rng.randint(0, 4, n_rows)
+    df["DSR"] = rng.uniform(0, 1, n_rows).round(2)
+    df["Marital"] = rng.choice(["Single", "Married"], n_rows)
+    df["Answer"] = rng.choice([0, 100], n_rows)
+    fields = [["Email", "Contact Details"], ["Income", "Numeric"], ["Dependants", "Numeric"],
+              ["DSR", "Percentage"], ["Marital", "Value Set"], ["Answer", "Response Variable"]]
+
+    csv_path = work_dir + "/upload.csv"
+    df.to_csv(csv_path, index=False)
+    open(work_dir + "/template.csv", "w").close()
+    registry = model_registry.ModelRegistry(work_dir + "/models")
+    report = {}
+
+    with open(csv_path, "rb") as file:
+        contacts = model_builder.build_and_predict(file, work_dir + "/template.csv", fields, "0", report=report,
+                                                   registry=registry)
+
+    return df, csv_path, registry, report, contacts
+
+
+def test_build_saves_pipeline_that_reproduces_probabilities(tmp_path):
+
+    # Arrange
+    work_dir = str(tmp_path)
+    df, _, registry, report, contacts = build_model(work_dir)
+
+    # Act
+    bundle = registry.load(report["model_version"])
+    x = model_builder.transform_features(df, bundle)
+    prob = bundle["model"].predict_proba(x)[:, 1]
+
+    # Assert
+    assert bundle["model_type"] == report["best_model"]
+    assert bundle["pipeline"].columns == ["Income", "Dependants", "DSR", "Marital_Married", "Marital_Single"]
+    assert bundle["pipeline"].percentage_scales == {"DSR": 100}
+    assert registry.manifest(report["model_version"])["columns"] == bundle["pipeline"].columns
+    assert len(bundle["medoids"]) == bundle["cluster_count"]
+    assert np.allclose(prob[contacts.index], contacts["Prob"])
+
+
+def test_score_new_data_in_chunks_with_saved_model(tmp_path):
+
+    # Arrange
+    work_dir = str(tmp_path)
+    df, csv_path, registry, report, contacts = build_model(work_dir)
+    bundle = registry.load()
+
+    # Act
+    with open(csv_path, "rb") as file:
+        chunks = list(model_builder.score(file, bundle, chunk_rows=50))
+    scored = pd.concat(chunks, ignore_index=True)
+
+    # Assert
+    assert [len(chunk) for chunk in chunks] == [50, 50, 20]
+    assert list(scored.columns) == ["Email", "Prob"]
+    assert np.allclose(scored["Prob"][contacts.index], contacts["Prob"])
+
+
+def test_score_throws_error_if_fields_missing():
+
+    # Arrange
+    pipeline = model_builder.FeaturePipeline([["Email", "Contact Details"], ["Income", "Numeric"]])
+    pipeline.model_fields = [["Income", "Numeric"]]
+    bundle = {"fields": pipeline.fields, "pipeline": pipeline}
+    file = BytesIO(b"Email,Other\na@x.com,1\n")
+
+    # Act and Assert
+    with pytest.raises(ValueError):
+        list(model_builder.score(file, bundle))
@@ -0,0 +1,85 @@
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import pytest
+from application import number_parser
+from application import model_builder
+from application.file_manager import csv_to_dataframe_from_bin_file
+
+
+def test_parse_numbers_removes_formatting_and_finds_missing_values():
+
+    # Act
+    numbers, bad = number_parser.parse_numbers(["$50,000", " 40000 ", "", None, np.nan, "$", "-1.5e3", "7"],
+                                               strip="$,")
+
+    # Assert
+    np.testing.assert_array_equal(numbers, [50000, 40000, np.nan, np.nan, np.nan, np.nan, -1500, 7])
+    assert not bad.any()
+
+
+def test_parse_numbers_reports_bad_cells():
+
+    # Act
+    numbers, bad = number_parser.parse_numbers(["0.3s c", "0.4", "nan", "12%"], strip="")
+
+    # Assert
+    assert list(bad) == [True, False, False, True]
+    assert numbers[1] == 0.4
+
+
+def test_parse_numbers_rejects_whitespace_inside_a_number():
+
+    # Act
+    numbers, bad = number_parser.parse_numbers(["1 000", "\t$ 50 ", "$1, 000", " 7\n"], strip="$,")
+
+    # Assert
+    assert list(bad) == [True, False, True, False]
+    assert list(numbers[[1, 3]]) == [50, 7]
+
+
+def test_parse_numbers_in_chunks_and_parallel_columns_match(monkeypatch):
+
+    # Arrange
+    monkeypatch.setattr(number_parser, "PARSE_CHUNK_ROWS", 7)
+    monkeypatch.setattr(number_parser, "PARALLEL_MIN_ROWS", 0)
+    rng = np.random.RandomState(0)
+    amounts = rng.randint(0, 10 ** 6, 50)
+    df = pd.DataFrame({"Money": ["${:,}".format(amount) for amount in amounts],
+                       "Percentage": ["{}%".format(amount % 100) for amount in amounts]})
+
+    # Act
+    parsed = number_parser.parse_columns(df, {"Money": "$,", "Percentage": "%"}, n_jobs=2)
+
+    # Assert
+    np.testing.assert_array_equal(parsed["Money"][0], amounts)
+    np.testing.assert_array_equal(parsed["Percentage"][0], amounts % 100)
+
+
+def test_validate_types_response_variable_missing_is_zero_and_bad_cells_are_named():
+
+    # Arrange
+    df = pd.DataFrame({"Answer": ["100", "", "20"], "Income": ["$1,000", "$2,000", "abc"]})
+
+    # Act
+    x = model_builder.validate_types(df[["Answer"]].copy(), [["Answer", "Response Variable"]])
+
+    # Assert
+    assert list(x["Answer"]) == [100, 0, 20]
+    with pytest.raises(ValueError, match="Income has 1 values that are not numbers eg. row 3 \"abc\""):
+        model_builder.validate_types(df, [["Answer", "Response Variable"], ["Income", "Money"]])
+
+
+def test_numeric_bad_cells_from_an_upload_are_named():
+
+    # Arrange
+    fields = [["Email", "Contact Details"], ["Income", "Numeric"], ["Answer", "Response Variable"]]
+    file = BytesIO(b"Email,Income,Answer\na@x.com,100,100\nb@x.com,12O,0\nc@x.com,300,x\n")
+    df = csv_to_dataframe_from_bin_file(file, [name for name, _ in fields], model_builder.field_dtypes(fields),
+                                        skip_header=True)
+
+    # Act / Assert
+    with pytest.raises(ValueError, match="Income has 1 values that are not numbers eg. row 2 \"12O\""):
+        model_builder.validate_types(df, fields)
+    with pytest.raises(ValueError, match="Answer has 1 values that are not numbers eg. row 3 \"x\""):
+        model_builder.validate_types(df, [fields[0], ["Income", "Exclude"], fields[2]])
@@ -1,6 +1,14 @@
+import threading
+from concurrent.futures import CancelledError
+import pytest
 from sklearn.datasets import make_friedman1
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import check_cv, cross_val_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
 from application import logistic_regression_model
 from application import random_forest_model
+from application import model_builder
 import pandas as pd
 import numpy as np
 import math
@@ -15,13 +23,73 @@ def test_logistic_regression():
     y = np.where(y > np.median(y), 1, 0)  # probability of belonging to target cluster
 
     # Act
-    best_score, prob = logistic_regression_model.determine_best_model_probabilities(df, y, 10)
+    best_score, prob = logistic_regression_model.determine_best_model_probabilities(df, y, 10, standardise=False)
 
     # Assert
     assert math.isclose(best_score, 0.82, rel_tol=1e-5, abs_tol=0.0)
     assert len(prob) == len(y)
 
 
+def test_logistic_regression_parallel_warm_started_matches_serial():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)  # probability of belonging to target cluster
+    report = {}
+
+    # Act
+    serial_score, serial_prob = logistic_regression_model.determine_best_model_probabilities(df, y, 10, n_jobs=1,
+                                                                                            warm_start=False,
+                                                                                            standardise=False)
+    best_score, prob = logistic_regression_model.determine_best_model_probabilities(df, y, 10, n_jobs=2,
+                                                                                    warm_start=True,
+                                                                                    standardise=False,
+                                                                                    report=report)
+
+    # Assert
+    assert math.isclose(best_score, serial_score, rel_tol=1e-5, abs_tol=0.0)
+    assert np.allclose(prob, serial_prob)
+    assert report["lr_features"] == [0, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert report["lr_not_converged"] == 0
+
+
+def test_logistic_regression_standardised():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+
+    df = pd.DataFrame(x * 1000)
+    y = np.where(y > np.median(y), 1, 0)  # probability of belonging to target cluster
+
+    # Act
+    best_score, prob = logistic_regression_model.determine_best_model_probabilities(df, y, 10, standardise=True)
+
+    # Assert
+    assert best_score > 0.8
+    assert len(prob) == len(y)
+
+
+def test_logistic_regression_standardises_each_fold_on_its_training_rows():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+    y = np.where(y > np.median(y), 1, 0)  # probability of belonging to target cluster
+    folds = list(check_cv(10, y, classifier=True).split(x, y))
+    scaling = []
+    for train, _ in folds:
+        scaler = StandardScaler().fit(x[train])
+        scaling.append((scaler.mean_, scaler.scale_))
+
+    # Act
+    score, _, _ = logistic_regression_model.cv_columns(x, y, folds, list(range(10)), scaling=scaling)
+
+    # Assert
+    expected = cross_val_score(make_pipeline(StandardScaler(), LogisticRegression()), x, y, cv=folds)
+    assert math.isclose(score, expected.mean(), rel_tol=1e-6)
+
+
 def test_random_forest():
 
     # Arrange
@@ -38,3 +106,155 @@ def test_random_forest():
     # Assert
     assert math.isclose(best_score, 0.8, rel_tol=1e-5, abs_tol=0.0)
     assert len(prob) == len(y)
+
+
+def test_random_forest_halving_search_stays_in_budget():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)  # probability of belonging to target cluster
+    report = {}
+
+    # Act - budget allows the first 2 rounds but not the 1000 tree round
+    best_score, prob = random_forest_model.determine_best_model_probabilities(df, y,
+                                                                              cv=3,
+                                                                              random_state=0,
+                                                                              search="halving",
+                                                                              budget=5000,
+                                                                              report=report)
+
+    # Assert
+    assert report["rf_search"] == "halving"
+    assert report["rf_trees_fitted"] == 6 * 100 * 3 + 2 * 300 * 3 + 300
+    assert report["rf_trees_fitted"] <= 5000
+    assert report["rf_params"]["n_estimators"] == 300
+    assert [c["params"]["n_estimators"] for c in report["rf_candidates"]] == [100] * 6 + [300] * 2
+    assert 0 <= best_score <= 1
+    assert len(prob) == len(y)
+
+
+def test_random_forest_oob_search():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)  # probability of belonging to target cluster
+    report = {}
+
+    # Act
+    best_score, prob = random_forest_model.determine_best_model_probabilities(df, y,
+                                                                              cv=10,
+                                                                              random_state=0,
+                                                                              search="oob",
+                                                                              report=report)
+
+    # Assert
+    assert report["rf_search"] == "oob"
+    assert report["rf_params"]["n_estimators"] in random_forest_model.OOB_CHECKPOINTS
+    assert report["rf_trees_fitted"] <= random_forest_model.RF_BUDGET
+    assert 0 <= best_score <= 1
+    assert len(prob) == len(y)
+
+
+def test_compact_models_are_within_the_tolerance():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)  # probability of belonging to target cluster
+
+    # Act
+    _, lr_prob = logistic_regression_model.determine_best_model_probabilities(df, y, 10, n_jobs=1)
+    _, lr_compact = logistic_regression_model.determine_best_model_probabilities(df.astype(np.float32), y, 10,
+                                                                                 n_jobs=1, compact=True)
+    _, rf_prob = random_forest_model.determine_best_model_probabilities(df, y, 3, random_state=0, search="oob")
+    _, rf_compact = random_forest_model.determine_best_model_probabilities(df.astype(np.float32), y, 3,
+                                                                           random_state=0, search="oob",
+                                                                           compact=True)
+
+    # Assert
+    assert np.abs(lr_prob - lr_compact).max() < model_builder.COMPACT_PROB_TOLERANCE
+    assert np.abs(rf_prob - rf_compact).max() < model_builder.COMPACT_PROB_TOLERANCE
+
+
+def test_weighted_models_match_the_repeated_rows(monkeypatch):
+
+    # Arrange - each row stands for the number of rows in weights
+    monkeypatch.setattr(random_forest_model, "PARAM_GRID", {"max_depth": [30], "max_features": [2, 3],
+                                                            "n_estimators": [20]})
+    x, y = make_friedman1(n_samples=40, n_features=5, random_state=0)
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)
+    weights = np.random.RandomState(0).randint(1, 4, len(y))
+    repeated = np.repeat(np.arange(len(y)), weights)
+    report = {}
+
+    # Act - a single feature so the stepwise selection can't differ between the folds
+    _, lr_prob = logistic_regression_model.determine_best_model_probabilities(df[[0]], y, 3, n_jobs=1,
+                                                                              sample_weight=weights)
+    _, lr_repeated = logistic_regression_model.determine_best_model_probabilities(df[[0]].iloc[repeated],
+                                                                                  y[repeated], 3, n_jobs=1)
+    rf_score, rf_prob = random_forest_model.determine_best_model_probabilities(df, y, 3, random_state=0,
+                                                                               sample_weight=weights,
+                                                                               report=report)
+
+    # Assert
+    assert np.allclose(lr_prob[repeated], lr_repeated, atol=1e-3)
+    assert [c["params"]["max_features"] for c in report["rf_candidates"]] == [2, 3]
+    assert report["rf_trees_fitted"] == 2 * 20 * 3 + 20
+    assert 0 <= rf_score <= 1
+    assert len(rf_prob) == len(y)
+
+
+def test_random_forest_grid_search_can_be_cancelled():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    # Act and Assert
+    with pytest.raises(CancelledError):
+        random_forest_model.determine_best_model_probabilities(df, y, cv=3, random_state=0, search="grid",
+                                                               cancel_event=cancel_event)
+
+
+def test_random_forest_model_predicts_on_one_thread():
+
+    # Arrange
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)
+
+    # Act
+    _, _, model = random_forest_model.determine_best_model_probabilities(df, y, cv=3, random_state=0, search="oob",
+                                                                         n_jobs=2, return_model=True)
+
+    # Assert
+    assert model.n_jobs == 1
+
+
+def test_logistic_regression_stops_within_a_round():
+
+    # Arrange - the event is set after the first two candidates of the first round
+    x, y = make_friedman1(n_samples=50, n_features=10, random_state=0)
+    df = pd.DataFrame(x)
+    y = np.where(y > np.median(y), 1, 0)
+    checks = []
+
+    class CountingEvent(threading.Event):
+        def is_set(self):
+            checks.append(1)
+            return len(checks) > 2
+
+    # Act and Assert
+    with pytest.raises(CancelledError):
+        logistic_regression_model.determine_best_model_probabilities(df, y, 3, n_jobs=1,
+                                                                     cancel_event=CountingEvent())
+    assert len(checks) == 3
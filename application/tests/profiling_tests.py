@@ -0,0 +1,72 @@
+import pstats
+import threading
+import time
+import pytest
+from application import profiling
+
+
+def busy_work(seconds):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+def test_cprofile_profile_is_saved_and_readable(tmp_path):
+
+    # Act
+    with profiling.profile("cprofile", "/api/v1/model/build", str(tmp_path)) as details:
+        busy_work(0.05)
+
+    # Assert
+    assert details["profile_id"] is not None
+    raw_path = profiling.profile_file(details["profile_id"], "raw", str(tmp_path))
+    assert raw_path.endswith(".prof")
+    functions = [function[2] for function in pstats.Stats(raw_path).stats]
+    assert "busy_work" in functions
+    summary_path = profiling.profile_file(details["profile_id"], "summary", str(tmp_path))
+    assert "busy_work" in open(summary_path).read()
+    assert profiling.list_profiles(str(tmp_path))[0]["profile_id"] == details["profile_id"]
+
+
+def test_sampling_profile_sees_other_threads(tmp_path):
+
+    # Arrange
+    worker = threading.Thread(target=busy_work, args=(0.2,))
+
+    # Act
+    with profiling.profile("sampling", "/api/v1/model/build", str(tmp_path)) as details:
+        worker.start()
+        worker.join()
+
+    # Assert
+    raw_path = profiling.profile_file(details["profile_id"], "raw", str(tmp_path))
+    assert raw_path.endswith(".folded")
+    folded = open(raw_path).read()
+    assert "busy_work (profiling_tests.py" in folded
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+
+
+def test_only_one_profile_runs_at_a_time(tmp_path):
+
+    # Act
+    with profiling.profile("sampling", "first", str(tmp_path)) as first:
+        with profiling.profile("cprofile", "second", str(tmp_path)) as second:
+            pass
+
+    # Assert
+    assert first["profile_id"] is not None
+    assert second["profile_id"] is None
+    assert "error" in second
+    assert len(profiling.list_profiles(str(tmp_path))) == 1
+
+
+def test_profile_rejects_unknown_mode_and_ids(tmp_path):
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        with profiling.profile("unknown", "build", str(tmp_path)):
+            pass
+    assert profiling.profile_file("../app", "raw", str(tmp_path)) is None
+    assert profiling.profile_file("0" * 32, "summary", str(tmp_path)) is None
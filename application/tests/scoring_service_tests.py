@@ -0,0 +1,125 @@
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from application import model_builder
+from application import model_registry
+from application import scoring_service
+
+
+class CountingModel:
+    """Wraps a model to count the calls to predict_proba"""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = 0
+
+    def predict_proba(self, x):
+        self.calls += 1
+        return self.model.predict_proba(x)
+
+
+def fit_bundle():
+    """Fits the pipeline and a small model the same way a build does"""
+    rng = np.random.RandomState(0)
+    fields = [["Email", "Contact Details"], ["Income", "Money"], ["DSR", "Percentage"], ["Marital", "Value Set"],
+              ["Answer", "Response Variable"]]
+    df = pd.DataFrame()
+    df["Email"] = ["{}@x.com".format(i) for i in range(60)]
+    df["Income"] = rng.normal(50000, 10000, 60).round()
+    df["DSR"] = rng.uniform(0, 1, 60)
+    df["Marital"] = rng.choice(["Single", "Married"], 60)
+    df["Answer"] = rng.choice([0, 100], 60)
+
+    pipeline = model_builder.FeaturePipeline(fields)
+    x, _ = pipeline.fit_transform(df)
+    model = CountingModel(LogisticRegression().fit(x, np.where(x["DSR"] > 50, 1, 0)))
+
+    return {"fields": fields, "pipeline": pipeline, "model": model}
+
+
+def save_model(registry):
+    """Fits a small model the same way a build does and saves it"""
+    bundle = fit_bundle()
+    return registry.save(bundle), bundle["model"]
+
+
+def test_score_record_matches_model(tmp_path):
+
+    # Arrange
+    models_dir = str(tmp_path)
+    registry = model_registry.ModelRegistry(models_dir)
+    version, model = save_model(registry)
+    service = scoring_service.ScoringService(registry)
+    bundle = registry.load(version)
+    x = model_builder.transform_features(pd.DataFrame({"Income": [52000.0], "DSR": [0.3], "Marital": ["Single"]}),
+                                         bundle)
+
+    # Act
+    prob, used_version = service.score({"Email": "a@x.com", "Income": "$52,000", "DSR": "0.3", "Marital": "Single"})
+
+    # Assert
+    assert used_version == version
+    assert np.isclose(prob, bundle["model"].predict_proba(x)[0, 1])
+
+
+def test_concurrent_records_are_scored_in_batches(tmp_path):
+
+    # Arrange
+    models_dir = str(tmp_path)
+    registry = model_registry.ModelRegistry(models_dir)
+    save_model(registry)
+    service = scoring_service.ScoringService(registry, batch_wait=0.2)
+    results = [None] * 8
+    barrier = threading.Barrier(len(results))
+
+    def score(index):
+        barrier.wait()
+        results[index] = service.score({"Income": 40000 + index * 1000, "DSR": 0.1 * index, "Marital": None})[0]
+
+    # Act
+    threads = [threading.Thread(target=score, args=(index,)) for index in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert all(0 <= prob <= 1 for prob in results)
+    assert service.cache.get()["model"].calls < len(results)
+
+
+def test_validate_record_throws_errors():
+
+    # Arrange
+    bundle = fit_bundle()
+
+    # Act and Assert
+    with pytest.raises(ValueError):
+        scoring_service.validate_record({"Other": 1}, bundle)
+    with pytest.raises(ValueError):
+        scoring_service.validate_record({"Income": "lots"}, bundle)
+    with pytest.raises(ValueError):
+        scoring_service.validate_record({"DSR": 2}, bundle)
+    with pytest.raises(ValueError):
+        scoring_service.validate_record({"Marital": "Divorced"}, bundle)
+    assert scoring_service.validate_record({"Income": "$1,000"}, bundle)["Marital"] == ""
+
+
+def test_model_cache_drops_least_recently_used(tmp_path):
+
+    # Arrange
+    models_dir = str(tmp_path)
+    registry = model_registry.ModelRegistry(models_dir)
+    versions = [registry.save({"model": index}) for index in range(3)]
+    cache = scoring_service.ModelCache(registry, max_size=2)
+
+    # Act
+    cache.get(versions[0])
+    cache.get(versions[1])
+    cache.get(versions[0])
+    cache.get(versions[2])
+
+    # Assert
+    assert list(cache.bundles.keys()) == [versions[0], versions[2]]
@@ -0,0 +1,136 @@
+import os
+import time
+from io import BytesIO
+import numpy as np
+import pandas as pd
+from application import model_builder
+from application import random_forest_model
+from application import stage_cache
+
+
+def test_stage_cache_runs_stage_once(tmp_path):
+
+    # Arrange
+    cache_dir = str(tmp_path)
+    cache = stage_cache.StageCache(cache_dir)
+    calls = []
+
+    def stage():
+        calls.append(1)
+        return {"value": 1}
+
+    # Act
+    first, first_key, first_hit = cache.run("stage", "parent", [1, 2], stage)
+    second, second_key, second_hit = cache.run("stage", "parent", [1, 2], stage)
+    _, other_key, other_hit = cache.run("stage", "other parent", [1, 2], stage)
+
+    # Assert
+    assert first == second == {"value": 1}
+    assert first_key == second_key != other_key
+    assert (first_hit, second_hit, other_hit) == (False, True, False)
+    assert len(calls) == 2
+
+
+def test_stage_cache_removes_least_recently_used(tmp_path):
+
+    # Arrange
+    cache_dir = str(tmp_path)
+    cache = stage_cache.StageCache(cache_dir, max_bytes=10 ** 6)
+    value = np.zeros(40000)  # about 320KB each
+
+    # Act
+    for key in ["a", "b", "c"]:
+        cache.put(key, value)
+        os.utime(cache.path(key), (time.time() - 100, time.time() - 100))
+    cache.get("a")
+    cache.put("d", value)
+
+    # Assert
+    assert [cache.get(key)[0] for key in ["a", "b", "c", "d"]] == [True, False, True, True]
+    assert cache.size() <= 10 ** 6
+
+
+def test_stage_cache_file_key_rewinds_file(tmp_path):
+
+    # Arrange
+    cache = stage_cache.StageCache(str(tmp_path))
+    file = BytesIO(b"Email,Answer\na@x.com,1\n")
+
+    # Act
+    key = cache.file_key(file)
+
+    # Assert
+    assert key == cache.file_key(BytesIO(b"Email,Answer\na@x.com,1\n"))
+    assert file.read() == b"Email,Answer\na@x.com,1\n"
+
+
+def test_stage_cache_resume_loads_only_the_last_stage_and_its_needs(tmp_path):
+
+    # Arrange
+    cache = stage_cache.StageCache(str(tmp_path))
+    keys = cache.chain("file", [("a", []), ("b", [1]), ("c", [2]), ("d", [3])])
+    for stage in ["a", "b", "c"]:
+        cache.put(keys[stage], stage.upper())
+    loaded = []
+    get = cache.get
+
+    def recording_get(key):
+        loaded.append(key)
+        return get(key)
+
+    cache.get = recording_get
+
+    # Act
+    resume = cache.resume(keys, {"c": ["a"]})
+    os.remove(cache.path(keys["a"]))
+    fallback = cache.resume(keys, {"c": ["a"]})
+
+    # Assert
+    assert resume.outputs == {"c": "C", "a": "A"}
+    assert resume.skipped == ["b"]
+    assert sorted(loaded[:2]) == sorted([keys["a"], keys["c"]])
+    assert fallback.outputs == {"b": "B"}
+    assert fallback.skipped == ["a"]
+    assert len(loaded) == 3
+
+
+def test_build_again_serves_unchanged_stages_from_cache(tmp_path, monkeypatch):
+
+    # Arrange - a small random forest grid keeps the builds quick
+    monkeypatch.setattr(random_forest_model, "PARAM_GRID", {"max_depth": [30], "max_features": [2],
+                                                            "n_estimators": [20]})
+    rng = np.random.RandomState(0)
+    n_rows = 120
+    df = pd.DataFrame()
+    df["Email"] = ["{}@x.com".format(i) for i in range(n_rows)]
+    df["Income"] = rng.normal(50000, 10000, n_rows).round()
+    df["Dependants"] = rng.randint(0, 4, n_rows)
+    df["Marital"] = rng.choice(["Single", "Married"], n_rows)
+    df["Answer"] = rng.choice([0, 100], n_rows)
+    fields = [["Email", "Contact Details"], ["Income", "Numeric"], ["Dependants", "Numeric"],
+              ["Marital", "Value Set"], ["Answer", "Response Variable"]]
+    changed_fields = fields[:3] + [["Marital", "Exclude"]] + fields[4:]
+
+    work_dir = str(tmp_path)
+    csv_path = work_dir + "/upload.csv"
+    df.to_csv(csv_path, index=False)
+    open(work_dir + "/template.csv", "w").close()
+    cache = stage_cache.StageCache(work_dir + "/cache")
+    reports = [{}, {}, {}]
+
+    # Act
+    results = []
+    for build_fields, report in zip([fields, fields, changed_fields], reports):
+        with open(csv_path, "rb") as file:
+            results.append(model_builder.build_and_predict(file, work_dir + "/template.csv", build_fields, "0",
+                                                           report=report, cache=cache))
+
+    # Assert
+    assert "cached_stages" not in reports[0]
+    assert reports[1]["cached_stages"][:9] == ["parse", "validate_types", "response", "stripdown_features",
+                                               "impute_nulls", "encode_categorical", "collapse_duplicates",
+                                               "gower_matrix", "cluster"]
+    assert reports[1]["best_model"] + "_search" in reports[1]["cached_stages"]
+    assert reports[1]["best_model"] == reports[0]["best_model"]
+    assert np.allclose(results[1]["Prob"], results[0]["Prob"])
+    assert reports[2]["cached_stages"] == ["parse"]
@@ -0,0 +1,210 @@
+""" Runs build_and_predict on synthetic data sets of increasing size and compares the time and peak memory of
+the whole build and of each stage with the stored baselines. Used to accept or reject performance changes:
+
+    python -m benchmarks.benchmark                          # 1k, 10k, 50k and 200k rows
+    python -m benchmarks.benchmark --rows 1000 10000        # only some sizes
+    python -m benchmarks.benchmark --save-baseline          # store the results as the new baselines
+    python -m benchmarks.benchmark --compact                # build in the compact dtype mode
+    python -m benchmarks.benchmark --allow-missing-baselines  # only compare what has a baseline
+
+The exit code is 1 if anything is slower or uses more memory than its baseline by more than the tolerance, or if
+a size or stage has no baseline. The baselines are measured on the reference machine with --save-baseline and
+committed as baselines.json next to this file.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from benchmarks import synthetic_data
+
+SIZES = [1000, 10000, 50000, 200000]  # Number of rows of each data set
+SEED = 0  # Random seed of the synthetic data
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DATA_TEMPLATE_PATH = 'data_template.csv'  # Copied for each build so the real template isn't changed
+TIME_TOLERANCE = 0.25  # Proportion a time can exceed its baseline by before it is a regression
+MEMORY_TOLERANCE = 0.25  # Proportion a peak memory can exceed its baseline by before it is a regression
+MIN_COMPARED_SECONDS = 0.1  # Times shorter than this are too noisy to compare
+
+# The measurements compared with the baselines and which tolerance each one uses
+COMPARED = {"wall_seconds": "time", "peak_rss_bytes": "memory"}
+
+
+def run_size(rows, seed=SEED, template_path=DATA_TEMPLATE_PATH, compact=False):
+    """Builds a model on a synthetic data set and measures it. Runs in its own process so the peak memory
+    of one size doesn't carry over to the next.
+
+        Args:
+            rows (int): The number of rows
+            seed (int): The random seed of the data
+            template_path (string): The data template to copy for the build
+            compact (bool): Build in the compact dtype mode
+
+        Returns:
+            (dict): the measurements of the build and of each stage
+    """
+    from application import model_builder
+    from application import instrumentation
+
+    data = synthetic_data.generate_csv(rows, seed)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        template_copy = os.path.join(work_dir, "data_template.csv")
+        if os.path.exists(template_path):
+            shutil.copy(template_path, template_copy)
+        else:
+            open(template_copy, "w").close()
+
+        report = {}
+        with instrumentation.measure() as build:
+            model_builder.build_and_predict(io.BytesIO(data), template_copy, synthetic_data.FIELDS, '0',
+                                            report=report, compact=compact)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {"rows": rows, "seed": seed, "build": build,
+            "stages": {record["name"]: {key: record[key] for key in ["wall_seconds", "cpu_seconds",
+                                                                     "peak_rss_bytes"]}
+                       for record in report["stages"]},
+            "cluster_mode": report.get("cluster_mode"), "best_model": report.get("best_model")}
+
+
+def run(sizes=SIZES, seed=SEED, compact=False):
+    """Measures each size in a new process
+
+        Args:
+            sizes (list): The number of rows of each data set
+            seed (int): The random seed of the data
+            compact (bool): Build in the compact dtype mode
+
+        Returns:
+            (dict): the measurements of each size keyed by the number of rows
+    """
+    results = {}
+    for rows in sizes:
+        # The process is terminated once it returns, a cancelled model search can keep it alive after the build
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            results[str(rows)] = pool.apply(run_size, (rows, seed, DATA_TEMPLATE_PATH, compact))
+        print_result(results[str(rows)])
+
+    return results
+
+
+def compare(results, baselines, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE,
+            allow_missing=False):
+    """Compares measurements with the baselines
+
+        Args:
+            results (dict): The measurements from run
+            baselines (dict): The stored measurements in the same format
+            time_tolerance (float): Proportion a time can exceed its baseline by
+            memory_tolerance (float): Proportion a peak memory can exceed its baseline by
+            allow_missing (bool): Skip the sizes and stages without a baseline instead of reporting them
+
+        Returns:
+            (list): a description of each regression
+    """
+    tolerances = {"time": time_tolerance, "memory": memory_tolerance}
+    regressions = []
+
+    for rows, result in results.items():
+        baseline = baselines.get(rows)
+        if baseline is None:
+            if not allow_missing:
+                regressions.append("{} rows: no baseline".format(rows))
+            continue
+
+        # The whole build then each stage
+        measurements = [("build", result["build"], baseline["build"])]
+        for name, record in result["stages"].items():
+            if name in baseline["stages"]:
+                measurements.append((name, record, baseline["stages"][name]))
+            elif not allow_missing:
+                regressions.append("{} rows {}: no baseline".format(rows, name))
+
+        for name, record, baseline_record in measurements:
+            for key, kind in COMPARED.items():
+                if kind == "time" and baseline_record[key] < MIN_COMPARED_SECONDS:
+                    continue
+
+                limit = baseline_record[key] * (1 + tolerances[kind])
+                if record[key] > limit:
+                    regressions.append("{} rows {} {}: {:.4g} is more than {:.0%} over the baseline {:.4g}"
+                                       .format(rows, name, key, record[key], tolerances[kind],
+                                               baseline_record[key]))
+
+    return regressions
+
+
+def print_result(result):
+    """Prints the measurements of one size
+
+        Args:
+            result (dict): The measurements from run_size
+    """
+    print("{} rows: {:.2f}s, {:.0f}MB peak ({} clustering, {} model)"
+          .format(result["rows"], result["build"]["wall_seconds"], result["build"]["peak_rss_bytes"] / 1024 ** 2,
+                  result["cluster_mode"], result["best_model"]))
+    for name, record in result["stages"].items():
+        print("    {:<26} {:9.3f}s {:9.0f}MB".format(name, record["wall_seconds"],
+                                                   record["peak_rss_bytes"] / 1024 ** 2))
+
+
+def load_baselines(path=BASELINE_PATH):
+    """Loads the stored baselines
+
+        Args:
+            path (string): The baseline file
+
+        Returns:
+            (dict): the baselines keyed by the number of rows, empty if there are none
+    """
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark build_and_predict on synthetic loan applications")
+    parser.add_argument("--rows", type=int, nargs="+", default=SIZES, help="the number of rows of each data set")
+    parser.add_argument("--seed", type=int, default=SEED, help="the random seed of the data")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="the baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baselines")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument("--output", help="a file to write the results to as json")
+    parser.add_argument("--compact", action="store_true", help="build in the compact dtype mode")
+    parser.add_argument("--allow-missing-baselines", action="store_true",
+                        help="only compare the sizes and stages that have a baseline")
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.seed, args.compact)
+
+    if args.output is not None:
+        with open(args.output, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+    baselines = load_baselines(args.baseline)
+    if args.save_baseline:
+        baselines.update(results)
+        with open(args.baseline, "w") as json_file:
+            json.dump(baselines, json_file, indent=2, sort_keys=True)
+        print("Saved the baselines to {}".format(args.baseline))
+        return 0
+
+    regressions = compare(results, baselines, args.time_tolerance, args.memory_tolerance,
+                          args.allow_missing_baselines)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,398 @@
+""" Sends a mix of concurrent requests to the app and reports the throughput, latency percentiles and error rate
+of each route. Used to size the number of workers before a rollout:
+
+    python -m benchmarks.load_test                                      # starts the app in this process
+    python -m benchmarks.load_test --mix build=1,details=20,export=5 --concurrency 8 --requests 200
+    python -m benchmarks.load_test --url http://localhost:8000          # an app that is already running
+
+When the app is started in this process Google Analytics is replaced by a local fake, so builds that merge
+Google Analytics data can be included in the mix without credentials or network calls.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from benchmarks import synthetic_data
+
+REQUEST_MIX = {"build": 1, "build_ga": 1, "details": 20, "export": 5}  # Relative weight of each kind of request
+CONCURRENCY = 4  # Number of requests in flight at once
+REQUEST_COUNT = 100  # Number of requests to send
+BUILD_ROWS = 500  # Rows of the files uploaded to the build routes
+BUILD_FILES = 4  # Number of different files uploaded, builds of the same file can be served from the stage cache
+EXPORT_ROWS = 1000  # Customers in each export to excel
+REQUEST_TIMEOUT_SECONDS = 600  # Maximum seconds to wait for a response
+PERCENTILES = [50, 90, 95, 99]  # Latency percentiles reported for each route
+SEED = 0  # Random seed of the data and of the order of the requests
+
+FAKE_GA_PROFILE_ID = 'fake-profile'  # The Google Analytics profile id sent with builds that merge GA data
+FAKE_GA_SECONDS = 0.2  # How long the fake Google Analytics takes to respond
+FAKE_GA_COVERAGE = 0.6  # Proportion of customers that have Google Analytics data
+GA_MERGE_FIELD = "Customer Id"  # The column of the uploaded files used to merge the Google Analytics data
+
+
+class FakeGoogleAnalytics:
+    """ Stands in for ga_adapter.get_data. Returns sessions for a share of the customer ids of the generated
+    files after a short delay, in the same format as the Google Analytics reporting API.
+    """
+
+    def __init__(self, customer_count, seed=SEED, seconds=FAKE_GA_SECONDS, coverage=FAKE_GA_COVERAGE):
+        """Creates the fake
+
+            Args:
+                customer_count (int): Customer ids 0 to customer_count - 1 can have sessions
+                seed (int): The random seed of the sessions
+                seconds (float): How long each call takes
+                coverage (float): Proportion of customers with sessions
+            """
+        rng = np.random.RandomState(seed)
+        ids = np.flatnonzero(rng.rand(customer_count) < coverage)
+        self.rows = [[str(customer_id), str(rng.choice(["New Visitor", "Returning Visitor"])),
+                      str(rng.randint(1, 20)), str(rng.randint(0, 1800)), "1"] for customer_id in ids]
+        self.seconds = seconds
+        self.calls = 0
+
+    def get_data(self, key_file_location, profile_id, dimensions, start_date):
+        """Gets the sessions the same way as ga_adapter.get_data
+
+            Args:
+                key_file_location (string): Ignored
+                profile_id (string): Ignored
+                dimensions (string): Ignored, the rows always have the dimensions merge_google_analytics asks for
+                start_date (string): Ignored
+
+            Returns:
+                (dict): the results with the rows of dimension values and the user count
+            """
+        self.calls += 1
+        time.sleep(self.seconds)
+        return {"rows": self.rows}
+
+
+def build_files(count=BUILD_FILES, rows=BUILD_ROWS, seed=SEED):
+    """Generates the files uploaded to the build routes, each with a customer id to merge Google Analytics on
+
+        Args:
+            count (int): The number of different files
+            rows (int): The rows in each file
+            seed (int): The random seed of the first file
+
+        Returns:
+            (list): the bytes of each csv file
+            (list): the fields of the files
+    """
+    files = []
+    for index in range(count):
+        df = synthetic_data.generate(rows, seed + index)
+        df.insert(0, GA_MERGE_FIELD, np.arange(rows).astype(str))
+        files.append(df.to_csv(index=False).encode("utf-8"))
+
+    return files, [[GA_MERGE_FIELD, "GA Merge Variable"]] + synthetic_data.FIELDS
+
+
+def export_customers(rows=EXPORT_ROWS, seed=SEED):
+    """Generates the ranked customers sent to the export route, in the format the build route returns
+
+        Args:
+            rows (int): The number of customers
+            seed (int): The random seed
+
+        Returns:
+            (string): the customers as json
+    """
+    contact_fields = [name for name, field_type in synthetic_data.FIELDS if field_type == "Contact Details"]
+    df = synthetic_data.generate(rows, seed)[contact_fields]
+    df["Prob"] = np.random.RandomState(seed).rand(rows)
+    return df.to_json(orient="records")
+
+
+class LoadTest:
+    """ Sends the requests of a mix from a number of threads and records the latency and result of each """
+
+    def __init__(self, url, mix=REQUEST_MIX, rows=BUILD_ROWS, files=BUILD_FILES, seed=SEED):
+        """Creates the requests
+
+            Args:
+                url (string): The address of the app eg. http://127.0.0.1:5000
+                mix (dict): Kind of request to its relative weight
+                rows (int): Rows of the files uploaded to the build routes
+                files (int): Number of different files uploaded
+                seed (int): The random seed
+            """
+        unknown = [kind for kind in mix if kind not in REQUEST_MIX]
+        if len(unknown) > 0:
+            raise ValueError("Unknown request kinds {}, the kinds are {}"
+                             .format(", ".join(unknown), ", ".join(REQUEST_MIX)))
+
+        self.url = url.rstrip("/")
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.files, self.fields = build_files(files, rows, seed)
+        self.customers = export_customers(seed=seed)
+        self.local = threading.local()
+
+    def next_kind(self):
+        """Picks the kind of the next request by its weight
+
+            Returns:
+                (string): the kind
+            """
+        with self.rng_lock:
+            return self.rng.choices(self.kinds, self.weights)[0]
+
+    def send(self, kind):
+        """Sends one request
+
+            Args:
+                kind (string): The kind of request
+
+            Returns:
+                (dict): the kind, start, latency in seconds, status code and error if it failed
+            """
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+
+        start = time.perf_counter()
+        result = {"kind": kind, "start": start, "status": None, "error": None}
+        try:
+            if kind in ["build", "build_ga"]:
+                with self.rng_lock:
+                    data = self.rng.choice(self.files)
+                response = session.post(self.url + "/api/v1/model/build",
+                                        files={"file": ("applications.csv", io.BytesIO(data), "text/csv")},
+                                        data={"fields": json.dumps(self.fields),
+                                              "connect_ga": FAKE_GA_PROFILE_ID if kind == "build_ga" else '0'},
+                                        timeout=REQUEST_TIMEOUT_SECONDS)
+            elif kind == "details":
+                response = session.post(self.url + "/api/v1/data_template/details",
+                                        data={"data[]": [name for name, _ in self.fields]},
+                                        timeout=REQUEST_TIMEOUT_SECONDS)
+            else:
+                response = session.post(self.url + "/api/v1/model/export_to_excel", data={"data": self.customers},
+                                        timeout=REQUEST_TIMEOUT_SECONDS)
+
+            result["status"] = response.status_code
+            if response.status_code >= 400:
+                result["error"] = "HTTP {}".format(response.status_code)
+            elif response.headers.get("Content-Type", "").startswith("application/json"):
+                body = response.json()
+                if not body.get("success", False):
+                    result["error"] = body.get("error") or "Unsuccessful"
+        except requests.RequestException as err:
+            result["error"] = "{}: {}".format(type(err).__name__, err)
+
+        result["latency"] = time.perf_counter() - start
+        return result
+
+    def run(self, concurrency=CONCURRENCY, count=REQUEST_COUNT, duration=None):
+        """Sends requests from a number of threads until the count is sent or the duration is up
+
+            Args:
+                concurrency (int): The number of requests in flight at once
+                count (int): The number of requests to send
+                duration (float): Optional seconds to send requests for instead of a count
+
+            Returns:
+                (list): the result of each request
+                (float): the seconds the test took
+            """
+        results = []
+        results_lock = threading.Lock()
+        remaining = [count]
+        start = time.perf_counter()
+
+        def worker():
+            while True:
+                with results_lock:
+                    if duration is not None:
+                        if time.perf_counter() - start >= duration:
+                            return
+                    elif remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+
+                result = self.send(self.next_kind())
+                with results_lock:
+                    results.append(result)
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            for future in [executor.submit(worker) for _ in range(concurrency)]:
+                future.result()
+
+        return results, time.perf_counter() - start
+
+
+def summarise(results, seconds):
+    """Works out the throughput, latency percentiles and error rate of each kind of request and of them all
+
+        Args:
+            results (list): The result of each request from LoadTest.run
+            seconds (float): The seconds the test took
+
+        Returns:
+            (dict): kind of request, and "all", to its count, throughput, error rate, latency percentiles,
+                mean and max and the most common errors
+    """
+    summary = {}
+    kinds = sorted(set(result["kind"] for result in results))
+    for kind in ["all"] + kinds:
+        selected = [result for result in results if kind == "all" or result["kind"] == kind]
+        latencies = np.array([result["latency"] for result in selected])
+        errors = [result["error"] for result in selected if result["error"] is not None]
+
+        counts = {}
+        for error in errors:
+            counts[error] = counts.get(error, 0) + 1
+
+        summary[kind] = {
+            "count": len(selected),
+            "throughput": len(selected) / seconds if seconds > 0 else 0.0,
+            "error_rate": len(errors) / len(selected) if len(selected) > 0 else 0.0,
+            "latency": {"p{}".format(percentile): float(np.percentile(latencies, percentile))
+                        for percentile in PERCENTILES} if len(selected) > 0 else {},
+            "mean": float(latencies.mean()) if len(selected) > 0 else None,
+            "max": float(latencies.max()) if len(selected) > 0 else None,
+            "errors": dict(sorted(counts.items(), key=lambda item: -item[1])[:5])
+        }
+
+    return summary
+
+
+def print_summary(summary, seconds):
+    """Prints the summary as a table
+
+        Args:
+            summary (dict): The summary from summarise
+            seconds (float): The seconds the test took
+    """
+    print("{:.1f} seconds".format(seconds))
+    print("{:<10} {:>6} {:>8} {:>7} ".format("kind", "count", "req/s", "errors") +
+          " ".join("{:>8}".format("p{}".format(percentile)) for percentile in PERCENTILES) + " {:>8}".format("max"))
+    for kind, row in summary.items():
+        print("{:<10} {:>6} {:>8.2f} {:>6.1%} ".format(kind, row["count"], row["throughput"], row["error_rate"]) +
+              " ".join("{:>7.3f}s".format(row["latency"]["p{}".format(percentile)]) for percentile in PERCENTILES)
+              + " {:>7.3f}s".format(row["max"]))
+    for kind, row in summary.items():
+        for error, count in row["errors"].items():
+            if kind != "all":
+                print("{} error x{}: {}".format(kind, count, error))
+
+
+def parse_mix(text):
+    """Parses a request mix eg. build=1,details=20
+
+        Args:
+            text (string): Comma separated kind=weight pairs
+
+        Returns:
+            (dict): kind to weight
+    """
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        try:
+            mix[kind.strip()] = float(weight)
+        except ValueError:
+            raise ValueError("The mix must be kind=weight pairs separated by commas, not {}".format(item))
+
+    return mix
+
+
+def start_app(stage_cache=False, ga_customers=BUILD_ROWS, seed=SEED):
+    """Starts the app in a background thread with its files in a temporary directory and Google Analytics
+    replaced by the fake
+
+        Args:
+            stage_cache (bool): Keep the stage cache, otherwise every build runs every stage
+            ga_customers (int): The number of customer ids the fake Google Analytics has sessions for
+            seed (int): The random seed of the fake Google Analytics
+
+        Returns:
+            (string): the address of the app
+            (function): stops the app and removes its files
+    """
+    from werkzeug.serving import make_server
+    import app as app_module
+    from application import model_builder
+    from application.model_registry import ModelRegistry
+    from application.scoring_service import ScoringService
+    from application.stage_cache import StageCache
+
+    # Keep the models, cache and data template of the test apart from the real ones
+    work_dir = tempfile.mkdtemp()
+    template_path = os.path.join(work_dir, "data_template.csv")
+    if os.path.exists(app_module.DATA_TEMPLATE_PATH):
+        shutil.copy(app_module.DATA_TEMPLATE_PATH, template_path)
+    else:
+        open(template_path, "w").close()
+    app_module.DATA_TEMPLATE_PATH = template_path
+    app_module.model_registry = ModelRegistry(os.path.join(work_dir, "models"))
+    app_module.scoring_service = ScoringService(app_module.model_registry)
+    app_module.stage_cache = StageCache(os.path.join(work_dir, "stage_cache")) if stage_cache else None
+
+    model_builder.get_data = FakeGoogleAnalytics(ga_customers, seed).get_data
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name="load-test-server", daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return "http://127.0.0.1:{}".format(server.server_port), stop
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send a mix of concurrent requests to the app")
+    parser.add_argument("--url", help="the address of a running app, otherwise the app is started in this process")
+    parser.add_argument("--mix", default=",".join("{}={}".format(kind, weight) for kind, weight in REQUEST_MIX.items()),
+                        help="the relative weight of each kind of request: " + ", ".join(REQUEST_MIX))
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="the number of requests in flight")
+    parser.add_argument("--requests", type=int, default=REQUEST_COUNT, help="the number of requests to send")
+    parser.add_argument("--duration", type=float, help="seconds to send requests for instead of a count")
+    parser.add_argument("--rows", type=int, default=BUILD_ROWS, help="the rows of each uploaded file")
+    parser.add_argument("--files", type=int, default=BUILD_FILES, help="the number of different uploaded files")
+    parser.add_argument("--stage-cache", action="store_true", help="let builds use the stage cache")
+    parser.add_argument("--seed", type=int, default=SEED, help="the random seed")
+    parser.add_argument("--output", help="a file to write the summary to as json")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+
+    stop = None
+    url = args.url
+    if url is None:
+        url, stop = start_app(args.stage_cache, args.rows, args.seed)
+
+    try:
+        load_test = LoadTest(url, mix, args.rows, args.files, args.seed)
+        results, seconds = load_test.run(args.concurrency, args.requests, args.duration)
+    finally:
+        if stop is not None:
+            stop()
+
+    summary = summarise(results, seconds)
+    print_summary(summary, seconds)
+
+    if args.output is not None:
+        with open(args.output, "w") as json_file:
+            json.dump({"seconds": seconds, "concurrency": args.concurrency, "mix": mix, "summary": summary},
+                      json_file, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+SUCCESS_RATE = 0.25  # Proportion of applications that were completed
+
+# The fields of a generated data set in the same format as the data template
+FIELDS = [["First Name", "Contact Details"], ["Last Name", "Contact Details"], ["Email", "Contact Details"],
+          ["Phone", "Contact Details"], ["Gross Income", "Money"], ["Loan Amount", "Money"],
+          ["Total Asset Value", "Money"], ["Default Amount", "Money"], ["Debt Service Ratio", "Percentage"],
+          ["Loan Valuation Ratio", "Percentage"], ["Number of Dependants", "Numeric"], ["Veda Score", "Numeric"],
+          ["Length of Time at Current Address", "Numeric"], ["Primary Income Type", "Value Set"],
+          ["Employment Basis", "Value Set"], ["Residential Status", "Value Set"], ["Gender", "Value Set"],
+          ["Relationship Status", "Value Set"], ["Loan Type", "Value Set"], ["First Home Buyer", "Yes/No"],
+          ["Guarantor", "Yes/No"], ["Lenders Mortgage Insurance", "Yes/No"],
+          ["Residential Address Postcode", "String"], ["Application Success Score", "Response Variable"]]
+
+# The proportion of missing values in each field, fields over model_builder.MAX_NULL_PERCENT are dropped
+NULL_RATES = {"Phone": 0.15, "Gross Income": 0.03, "Loan Amount": 0.01, "Total Asset Value": 0.08,
+              "Default Amount": 0.85, "Debt Service Ratio": 0.05, "Loan Valuation Ratio": 0.04,
+              "Number of Dependants": 0.06, "Veda Score": 0.09, "Length of Time at Current Address": 0.12,
+              "Primary Income Type": 0.02, "Employment Basis": 0.04, "Residential Status": 0.03,
+              "Gender": 0.01, "Relationship Status": 0.05, "Loan Type": 0.0, "First Home Buyer": 0.07,
+              "Guarantor": 0.02, "Lenders Mortgage Insurance": 0.3, "Residential Address Postcode": 0.01}
+
+# The values of each Value Set field and how often they occur
+VALUE_SETS = {
+    "Primary Income Type": (["PAYG", "Self Employed", "Pension", "Rental", "Other"], [0.7, 0.15, 0.07, 0.05, 0.03]),
+    "Employment Basis": (["Full Time", "Part Time", "Casual", "Contract"], [0.65, 0.15, 0.1, 0.1]),
+    "Residential Status": (["Own Home", "Mortgage", "Renting", "Boarding", "With Parents"],
+                           [0.2, 0.35, 0.3, 0.05, 0.1]),
+    "Gender": (["Male", "Female", "Other"], [0.49, 0.49, 0.02]),
+    "Relationship Status": (["Single", "Married", "De Facto", "Divorced", "Widowed"],
+                            [0.35, 0.4, 0.15, 0.08, 0.02]),
+    "Loan Type": (["Personal", "Car", "Home", "Refinance", "Investment"], [0.3, 0.25, 0.25, 0.12, 0.08])}
+
+FIRST_NAMES = ["James", "Olivia", "William", "Charlotte", "Jack", "Mia", "Noah", "Amelia", "Thomas", "Ava"]
+LAST_NAMES = ["Smith", "Jones", "Williams", "Brown", "Wilson", "Taylor", "Nguyen", "Johnson", "Martin", "White"]
+
+
+def generate(rows, seed=0):
+    """Generates loan applications that look like an uploaded csv: money with $ and thousands separators,
+    percentages with % or as 0 to 1, Yes/No and Value Set text and blank cells for missing values. Whether an
+    application was completed depends on the income, loan, credit score and debt so the models have something
+    to find.
+
+        Args:
+            rows (int): The number of applications
+            seed (int): The random seed, the same seed always generates the same data
+
+        Returns:
+            (pandas.DataFrame): the applications as strings in the order of FIELDS
+    """
+    rng = np.random.RandomState(seed)
+
+    income = np.round(rng.lognormal(11.2, 0.45, rows), -2)
+    loan = np.round(income * rng.uniform(0.2, 6, rows), -3)
+    assets = np.round(rng.lognormal(12, 1.2, rows), -3)
+    defaults = np.round(rng.exponential(2500, rows), 0)
+    service_ratio = np.clip(loan / income * rng.uniform(4, 9, rows), 1, 95)
+    valuation_ratio = np.clip(rng.beta(6, 3, rows), 0.05, 0.99)
+    dependants = rng.poisson(1.1, rows)
+    veda = np.clip(rng.normal(650, 120, rows), 0, 1200).round()
+    time_at_address = rng.gamma(2, 2.5, rows).round()
+    first_home = rng.rand(rows) < 0.3
+    guarantor = rng.rand(rows) < 0.1
+    insurance = valuation_ratio > 0.8
+
+    # Completion is more likely with a good credit score, a higher income and a lower debt service ratio
+    logit = (veda - 650) / 120 + (np.log(income) - 11.2) / 0.45 * 0.5 - (service_ratio - 30) / 20
+    threshold = np.quantile(logit + rng.normal(0, 1, rows), 1 - SUCCESS_RATE)
+    completed = logit + rng.normal(0, 1, rows) >= threshold
+    score = np.where(completed, 100, rng.randint(0, 10, rows) * 10)
+
+    ids = np.arange(rows)
+    columns = {
+        "First Name": np.array(FIRST_NAMES)[rng.randint(0, len(FIRST_NAMES), rows)],
+        "Last Name": np.array(LAST_NAMES)[rng.randint(0, len(LAST_NAMES), rows)],
+        "Email": pd.Series(ids).map("applicant{}@example.com".format).values,
+        "Phone": pd.Series(rng.randint(10 ** 8, 10 ** 9, rows)).map("04{}".format).values,
+        "Gross Income": money(income),
+        "Loan Amount": money(loan),
+        "Total Asset Value": money(assets),
+        "Default Amount": money(defaults),
+        "Debt Service Ratio": pd.Series(service_ratio).map("{:.1f}%".format).values,
+        "Loan Valuation Ratio": pd.Series(valuation_ratio).map("{:.3f}".format).values,
+        "Number of Dependants": dependants.astype(str),
+        "Veda Score": veda.astype(int).astype(str),
+        "Length of Time at Current Address": time_at_address.astype(int).astype(str),
+        "First Home Buyer": np.where(first_home, "Yes", "No"),
+        "Guarantor": np.where(guarantor, "Yes", "No"),
+        "Lenders Mortgage Insurance": np.where(insurance, "Yes", "No"),
+        "Residential Address Postcode": rng.randint(2000, 7000, rows).astype(str),
+        "Application Success Score": score.astype(str)
+    }
+    for name, (values, weights) in VALUE_SETS.items():
+        columns[name] = np.array(values)[rng.choice(len(values), rows, p=weights)]
+
+    df = pd.DataFrame({name: columns[name] for name, _ in FIELDS})
+
+    # Blank out cells at each field's null rate
+    for name, rate in NULL_RATES.items():
+        df.loc[rng.rand(rows) < rate, name] = ""
+
+    return df
+
+
+def money(values):
+    """Formats amounts the way they are exported eg. $52,300
+
+        Args:
+            values (numpy.ndarray): The amounts
+
+        Returns:
+            (numpy.ndarray): the formatted amounts
+    """
+    return pd.Series(values).map("${:,.0f}".format).values
+
+
+def generate_csv(rows, seed=0):
+    """Generates loan applications as the bytes of an uploaded csv file
+
+        Args:
+            rows (int): The number of applications
+            seed (int): The random seed
+
+        Returns:
+            (bytes): the csv file with a header row
+    """
+    return generate(rows, seed).to_csv(index=False).encode("utf-8")
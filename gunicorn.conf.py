@@ -0,0 +1,90 @@
+""" Settings for serving the app with pre-forked gunicorn workers, eg.
+
+    gunicorn --config gunicorn.conf.py app:app
+    LAMS_WORKERS=4 LAMS_THREADS=8 LAMS_BUILD_WORKERS=1 gunicorn --config gunicorn.conf.py app:app
+
+The app is loaded once by the master process and shared by the forked workers. Send the master SIGHUP to
+restart the workers gracefully with any changed settings, running builds get graceful_timeout seconds to finish.
+Since the app is preloaded, new code needs a new master: send SIGUSR2 to start one, then SIGWINCH and SIGQUIT
+to the old master once the new one is serving.
+"""
+import multiprocessing
+import os
+import tempfile
+
+# The address to listen on, PORT is set by Heroku
+bind = os.environ.get("LAMS_BIND", "0.0.0.0:{}".format(os.environ.get("PORT", "8000")))
+
+# Each worker is a process with a pool of request threads. Builds run on each worker's build pool
+# (LAMS_BUILD_WORKERS) so the request threads stay free for the interactive routes while builds run.
+workers = int(os.environ.get("LAMS_WORKERS", max(1, multiprocessing.cpu_count() // 2)))
+threads = int(os.environ.get("LAMS_THREADS", 8))
+worker_class = "gthread"
+
+# Load the app before forking so workers start quickly and share its memory
+preload_app = True
+
+# Seconds a worker can go without reporting in before it is restarted. The main loop of each gthread worker
+# reports in while its request threads are busy, so a request waiting for a build doesn't count against this.
+timeout = int(os.environ.get("LAMS_TIMEOUT", 60))
+
+# Seconds a worker has to finish its running requests when it is restarted or stopped
+graceful_timeout = int(os.environ.get("LAMS_GRACEFUL_TIMEOUT", 600))
+keepalive = 5
+
+# Restart each worker after this many requests, plus some jitter so they don't all restart together, 0 to never
+max_requests = int(os.environ.get("LAMS_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+# Where the master's process id is written so it can be sent signals
+pidfile = os.environ.get("LAMS_PIDFILE") or None
+
+accesslog = "-"
+
+# Each worker writes its metrics here so /metrics reports the totals of every worker, not just the one that
+# answers. Set before the app is loaded so the workers inherit it.
+os.environ.setdefault("LAMS_METRICS_DIR", os.path.join(tempfile.gettempdir(), "lams-metrics-{}".format(os.getpid())))
+
+
+def on_starting(server):
+    """Starts the metrics from zero rather than adding to the totals of an earlier server
+
+        Args:
+            server (gunicorn.arbiter.Arbiter): The master process
+    """
+    from application import instrumentation
+
+    instrumentation.clear_metrics_dir(os.environ["LAMS_METRICS_DIR"])
+
+
+def worker_exit(server, worker):
+    """Writes the last metrics of a worker that is stopping so they are still counted
+
+        Args:
+            server (gunicorn.arbiter.Arbiter): The master process
+            worker (gunicorn.workers.base.Worker): The worker that is stopping
+    """
+    from application import instrumentation
+
+    instrumentation.metrics.flush()
+
+
+def when_ready(server):
+    """Loads the heavy dependencies in the master once it is listening, before the workers are forked, so every
+    worker starts with them loaded. Only when LAMS_WARM_UP=1, otherwise each worker loads them on first use.
+
+        Args:
+            server (gunicorn.arbiter.Arbiter): The master process
+    """
+    if os.environ.get("LAMS_WARM_UP", "0") != "1":
+        return
+
+    from application import lazy_imports
+
+    # Threads don't survive a fork so import here rather than with lazy_imports.warm_up
+    for name in lazy_imports.HEAVY_MODULES:
+        try:
+            lazy_imports.load(name, "warm up")
+        except ImportError as err:
+            server.log.warning("Couldn't preload %s: %s", name, err)
+    server.log.info("Preloaded %s", ", ".join(lazy_imports.HEAVY_MODULES))
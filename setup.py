@@ -24,7 +24,9 @@ build_exe_options = {
                      "include_msvcr": True,
                      "packages":
                          ["scipy.sparse", "scipy.spatial", "scipy.spatial.ckdtree", "scipy",
-                          "multiprocessing.pool"],
+                          "multiprocessing.pool",
+                          # Imported by name on first use so they aren't found by following the imports
+                          "sklearn", "sklearn_extra", "xlsxwriter", "googleapiclient", "oauth2client"],
                      "excludes": ["scipy.spatial.cKDTree", "multiprocessing.Pool"],
                      "include_files": collect_dist_info(["scipy"])}
 